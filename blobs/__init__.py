@@ -5,8 +5,20 @@ Cube files manager
 
 # Add imports here
 from .colors import *
+from .bonds import *
+from .encoding import *
 from .cube import *
 from .frequencies import *
+from .cache import *
+from .store import *
+from .isosurface import *
+from .mesh import *
+from .pyramid import *
+from .progressive import *
+from .viewer import *
+from .render import *
+from .volume import *
+from .raster import *
 
 # Handle versioneer
 from ._version import get_versions
@@ -0,0 +1,10 @@
+"""
+__main__.py
+Run the blobs command with python -m blobs
+"""
+
+import sys
+
+from .cli import main
+
+sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+bonds.py
+Bonds drawn as a single line trace
+"""
+
+import numpy as np
+import plotly.graph_objects as go
+
+
+def bond_lines(positions, bonds):
+    """
+    Vertices of every half-bond, separated by gaps, for one line trace.
+
+    Each bond is drawn as two segments, from each atom to the midpoint
+    of the bond. Segments are separated by a row of NaN so the line
+    breaks between them.
+
+    Parameters
+    ----------
+    positions: np.array (natom, 3)
+    bonds: list<[atom1, atom2, distance]>
+        Output of build_bond_list.
+
+    Returns
+    --------
+    (points: np.array (6 * nbonds, 3), atoms: np.array (6 * nbonds,))
+        The vertices and the atom each of them belongs to.
+
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    pairs = np.array([bond[:2] for bond in bonds], dtype=np.int64).reshape(-1, 2)
+    middle = (positions[pairs[:, 0]] + positions[pairs[:, 1]]) / 2
+
+    # Rows of (atom, middle, gap) for the first and then the second atom of every bond
+    atoms = pairs.T.ravel()
+    points = np.full((len(atoms), 3, 3), np.nan)
+    points[:, 0] = positions[atoms]
+    points[:, 1] = np.concatenate([middle, middle])
+    return points.reshape(-1, 3), np.repeat(atoms, 3)
+
+
+def bond_trace(positions, bonds, colors, width=7):
+    """
+    All bonds of a molecule as one go.Scatter3d line trace, see bond_lines.
+
+    Each half-bond takes the color of its atom. Vertices carry the index
+    of their color in a stepped colorscale of the distinct atom colors,
+    which plotly validates much faster than one color string per vertex.
+
+    Parameters
+    ----------
+    positions: np.array (natom, 3)
+    bonds: list<[atom1, atom2, distance]>
+    colors: list<str>
+        Color of each atom.
+    width: float, optional
+        Line width. Default is 7.
+
+    Returns
+    --------
+    trace: go.Scatter3d
+
+    """
+    points, atoms = bond_lines(positions, bonds)
+    points = points.astype(np.float32)
+    palette, index = np.unique(np.asarray(colors, dtype=str), return_inverse=True)
+    top = max(len(palette) - 1, 1)
+    colorscale = [[k / top, color] for k, color in enumerate(palette.tolist())]
+    if len(palette) == 1:
+        colorscale.append([1, colorscale[0][1]])
+
+    return go.Scatter3d(x=points[:, 0],
+                        y=points[:, 1],
+                        z=points[:, 2],
+                        mode="lines",
+                        connectgaps=False,
+                        hoverinfo="skip",
+                        line={
+                            "color": index[atoms],
+                            "colorscale": colorscale,
+                            "cmin": 0,
+                            "cmax": top,
+                            "width": width
+                        })
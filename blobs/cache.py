@@ -0,0 +1,398 @@
+"""
+cache.py
+Persistent caches of parsed cube files and of their isosurface meshes
+"""
+
+import hashlib
+import io
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from .cube import cube_to_array, load_grid
+from .isosurface import isosurfaces
+from .mesh import postprocess_meshes
+from .pyramid import build_pyramid
+
+
+def _default_directory():
+    base = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base, "blobs")
+
+
+def _identity(fname, hash_content=False):
+    """Fields that identify the contents of a file: path, size, modification time and optionally a hash."""
+    fname = os.path.abspath(fname)
+    stat = os.stat(fname)
+    fields = [fname, str(stat.st_size), str(stat.st_mtime_ns)]
+    if hash_content:
+        fields.append(_content_hash(fname))
+    return fields
+
+
+def _read_dtype(fname, dtype=None):
+    """
+    Type code of the array cube_to_array returns for dtype: float64 for
+    cube files and the stored type of containers when dtype is None.
+    """
+    if dtype is None:
+        from .store import CubeStore, is_store
+        dtype = CubeStore(fname).dtype if is_store(fname) else np.float64
+    return np.dtype(dtype).str
+
+
+def _content_hash(fname, block=2**22):
+    """sha256 of the contents of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(fname, 'rb') as cube:
+        for chunk in iter(lambda: cube.read(block), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CubeCache():
+    """
+    Cache of parsed cube files stored as raw binary arrays.
+
+    Each entry is a ``.bin`` file with the voxel values and a ``.json``
+    file with the shape, dtype and header metadata. Cached grids are
+    returned as read-only ``np.memmap`` arrays, so loading them does not
+    copy the data. When the cache grows over ``max_bytes`` the least
+    recently used entries are removed.
+
+    Parameters
+    ----------
+    directory : str, optional
+        Where the cache lives. Default is ``$XDG_CACHE_HOME/blobs``.
+    max_bytes : int, optional
+        Size cap of the cached arrays. Default is 2 GiB.
+    hash_content : bool, optional
+        Include a hash of the file contents in the key, on top of the
+        path, size and modification time. Default is False.
+
+    """
+    def __init__(self, directory=None, max_bytes=2**31, hash_content=False):
+        self.directory = os.path.abspath(directory or _default_directory())
+        self.max_bytes = max_bytes
+        self.hash_content = hash_content
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, fname, dtype=None):
+        """Cache key of a cube file read as dtype."""
+        fields = _identity(fname, self.hash_content) + [_read_dtype(fname, dtype)]
+        return hashlib.sha1("\0".join(fields).encode()).hexdigest()
+
+    @staticmethod
+    def _level_key(key, level, method):
+        return f"{key}-{method}{level}" if level else key
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + ".bin", base + ".json"
+
+    def load(self, fname, dtype=None, level=0, method="mean"):
+        """
+        Read a cube file through the cache.
+
+        Parameters
+        ----------
+        fname: filename of cube file
+        dtype: np.dtype, optional
+            Floating point type of the grid, see cube_to_array. Each
+            dtype is cached separately.
+        level: int, optional
+            Pyramid level, the grid downsampled 2**level times. The
+            first request of a coarse level builds and caches levels 1
+            to 3, or deeper, in one pass over the file. Default is 0,
+            the full grid.
+        method: str, optional
+            "mean" or "maxabs" downsampling, see downsample.
+
+        Returns
+        --------
+        (data: np.memmap, metadata: dict)
+
+        """
+        base = self.key(fname, dtype)
+        key = self._level_key(base, level, method)
+        bin_path, json_path = self._paths(key)
+
+        if not (os.path.exists(bin_path) and os.path.exists(json_path)):
+            if level:
+                pyramid = build_pyramid(fname, levels=max(level, 3), method=method, dtype=dtype)
+                # The requested level goes last, so evicting for the other levels cannot remove it
+                for depth in sorted(pyramid, key=lambda depth: depth == level):
+                    self.store(self._level_key(base, depth, method), *pyramid[depth], source=fname)
+            else:
+                self.store(key, *cube_to_array(fname, dtype=dtype), source=fname)
+
+        with open(json_path, 'r') as handle:
+            entry = json.load(handle)
+        os.utime(json_path)
+
+        data = np.memmap(bin_path, dtype=entry["dtype"], mode='r', shape=tuple(entry["shape"]))
+        cube_details = entry["meta"]
+        cube_details['atoms'] = [tuple(atom) for atom in cube_details['atoms']]
+        return data, cube_details
+
+    def store(self, key, data, cube_details, source=None):
+        """Write a parsed cube to the cache and evict old entries."""
+        bin_path, json_path = self._paths(key)
+        entry = {
+            "source": os.path.abspath(source) if source else None,
+            "shape": list(data.shape),
+            "dtype": data.dtype.str,
+            "meta": cube_details,
+        }
+
+        np.ascontiguousarray(data).tofile(bin_path + ".tmp")
+        os.replace(bin_path + ".tmp", bin_path)
+        with open(json_path + ".tmp", 'w') as handle:
+            json.dump(entry, handle)
+        os.replace(json_path + ".tmp", json_path)
+
+        self.evict(keep=key)
+
+    def info(self):
+        """
+        List the cached entries, most recently used first.
+
+        Returns
+        --------
+        entries: list<dict> with key, source, shape, dtype, nbytes and last_used
+
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            key = name[:-5]
+            bin_path, json_path = self._paths(key)
+            try:
+                with open(json_path, 'r') as handle:
+                    entry = json.load(handle)
+                entries.append({
+                    "key": key,
+                    "source": entry["source"],
+                    "shape": tuple(entry["shape"]),
+                    "dtype": entry["dtype"],
+                    "nbytes": os.path.getsize(bin_path),
+                    "last_used": os.path.getmtime(json_path),
+                })
+            except (OSError, ValueError):
+                continue
+        entries.sort(key=lambda entry: entry["last_used"], reverse=True)
+        return entries
+
+    def nbytes(self):
+        """Total size of the cached arrays."""
+        return sum(entry["nbytes"] for entry in self.info())
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        entries = self.info()
+        total = sum(entry["nbytes"] for entry in entries)
+        for entry in reversed(entries):
+            if total <= self.max_bytes:
+                break
+            if entry["key"] == keep:
+                continue
+            if self.remove(entry["key"]):
+                total -= entry["nbytes"]
+
+    def remove(self, key):
+        """Remove one entry. Returns False if it is still in use and cannot be deleted."""
+        try:
+            for path in self._paths(key):
+                if os.path.exists(path):
+                    os.remove(path)
+        except OSError:
+            return False
+        return True
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        for entry in self.info():
+            self.remove(entry["key"])
+
+
+class MeshCache():
+    """
+    Cache of the isosurface meshes extracted from cube files.
+
+    Meshes are keyed by the identity of the cube file, the isovalue with
+    its sign, the dtype and pyramid level the grid was read at and the
+    decimation and smoothing settings. Recently used meshes are kept in memory, and when
+    a directory is given they are also written there as ``.npz`` files,
+    so they survive the Python session. A lookup that finds every level
+    in the cache neither parses the cube file nor extracts a surface.
+
+    Parameters
+    ----------
+    directory : str, optional
+        Where the on-disk tier lives. Default is None, memory only.
+    max_entries : int, optional
+        Number of meshes kept in memory. Default is 64.
+    max_bytes : int, optional
+        Size cap of the on-disk tier. Default is 256 MiB.
+    hash_content : bool, optional
+        Include a hash of the file contents in the key, on top of the
+        path, size and modification time. Default is False.
+
+    Attributes
+    ----------
+    hits, disk_hits, misses : int
+        Lookups served from memory, from disk, and extracted anew.
+
+    """
+    def __init__(self, directory=None, max_entries=64, max_bytes=2**28, hash_content=False):
+        self.directory = os.path.abspath(directory) if directory else None
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hash_content = hash_content
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, fname, iso, simplify=None, smoothing=0, dtype=None, lod=0, method="mean", crop=None):
+        """Cache key of the mesh of a cube file at one isovalue with the given settings."""
+        fields = _identity(fname, self.hash_content) + [repr(float(iso)), repr(simplify), str(smoothing),
+                                                        _read_dtype(fname, dtype)]
+        if lod:
+            fields += [str(lod), method]
+        if crop is not None:
+            fields += ["crop", repr(float(crop))]
+        return hashlib.sha1("\0".join(fields).encode()).hexdigest()
+
+    def stats(self):
+        """Hit and miss counters and the number of meshes held in memory."""
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses, "entries": len(self._memory)}
+
+    def isosurfaces(self, fname, levels, simplify=None, smoothing=0, dtype=None, cache=None, lod=0, method="mean",
+                    crop=None):
+        """
+        Isosurface meshes of a cube file, extracting only the levels not in the cache.
+
+        Parameters
+        ----------
+        fname: filename of cube file
+        levels: list<float>
+            Isovalues, of any sign.
+        simplify: int or float, optional
+            Triangle target passed to decimate.
+        smoothing: int, optional
+            Number of Taubin smoothing steps.
+        dtype: np.dtype, optional
+            Floating point type the grid is read as, see cube_to_array.
+        cache: CubeCache, optional
+            Cache used to read the cube file on a miss.
+        lod: int, optional
+            Pyramid level the surfaces are extracted from. Vertices are
+            in voxel index units of that level. Default is 0.
+        method: str, optional
+            Downsampling of the pyramid level, "mean" or "maxabs".
+        crop: float, optional
+            Threshold of crop_to_significant. Vertices are then relative
+            to the cropped box, stored in the metadata under 'box'.
+
+        Returns
+        --------
+        (meshes: list<(vertices, faces)>, metadata: dict)
+
+        """
+        levels = [float(level) for level in np.atleast_1d(levels)]
+        keys = [self.key(fname, level, simplify, smoothing, dtype, lod, method, crop) for level in levels]
+        meshes = [self._get(key) for key in keys]
+        cube_details = next((entry[2] for entry in meshes if entry is not None), None)
+
+        missing = [i for i, entry in enumerate(meshes) if entry is None]
+        self.misses += len(missing)
+        if missing:
+            data, cube_details = load_grid(fname, cache, dtype, lod, method, crop)
+            extracted = postprocess_meshes(isosurfaces(data, [levels[i] for i in missing]), simplify, smoothing)
+            for i, (vertices, faces) in zip(missing, extracted):
+                meshes[i] = (vertices, faces, cube_details)
+                self._put(keys[i], meshes[i])
+
+        return [(vertices, faces) for vertices, faces, meta in meshes], cube_details
+
+    def _get(self, key):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return self._memory[key]
+
+        path = self._path(key)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as stored:
+                entry = (stored["vertices"], stored["faces"], json.loads(str(stored["meta"])))
+        except (OSError, ValueError, KeyError):
+            return None
+        entry[2]['atoms'] = [tuple(atom) for atom in entry[2]['atoms']]
+        os.utime(path)
+        self.disk_hits += 1
+        self._remember(key, entry)
+        return entry
+
+    def _put(self, key, entry):
+        self._remember(key, entry)
+        path = self._path(key)
+        if path is None:
+            return
+        vertices, faces, cube_details = entry
+        buffer = io.BytesIO()
+        np.savez(buffer, vertices=vertices, faces=faces, meta=json.dumps(cube_details))
+        with open(path + ".tmp", 'wb') as handle:
+            handle.write(buffer.getvalue())
+        os.replace(path + ".tmp", path)
+        self.evict(keep=key)
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz") if self.directory else None
+
+    def evict(self, keep=None):
+        """Remove least recently used meshes from disk until the directory fits in max_bytes."""
+        if self.directory is None:
+            return
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz"):
+                path = os.path.join(self.directory, name)
+                try:
+                    entries.append((os.path.getmtime(path), os.path.getsize(path), name[:-4], path))
+                except OSError:
+                    continue
+        total = sum(entry[1] for entry in entries)
+        for last_used, nbytes, key, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= nbytes
+            except OSError:
+                continue
+
+    def clear(self):
+        """Forget every mesh, in memory and on disk, and reset the counters."""
+        self._memory.clear()
+        self.hits = self.disk_hits = self.misses = 0
+        if self.directory is None:
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz"):
+                os.remove(os.path.join(self.directory, name))
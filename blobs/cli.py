@@ -0,0 +1,276 @@
+"""
+cli.py
+Command line batch rendering of cube files
+"""
+
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Names of the cube files found in directories given on the command line
+_CUBE_SUFFIXES = (".cube", ".cube.gz", ".cube.bz2", ".cube.xz")
+
+_EXTENSIONS = {"html": ".html", "png": ".png", "obj": ".obj"}
+
+# Settings of Cube.plot that shape the isosurfaces written to OBJ files
+_SURFACE_SETTINGS = ("iso", "cube_type", "level", "max_voxels", "crop", "simplify", "smoothing")
+
+
+def find_cubes(inputs):
+    """
+    Cube files of directories and glob patterns.
+
+    Parameters
+    ----------
+    inputs: list<str>
+        Directories, whose cube files, compressed ones included, are
+        taken, or glob patterns, whose matches are taken whatever their
+        name, so containers can be listed too.
+
+    Returns
+    --------
+    cubes: list<(cube_file: str, root: str or None)>
+        Files in the order found, with the directory they were listed
+        from, or None for glob matches.
+
+    """
+    cubes = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            names = sorted(name for name in os.listdir(pattern) if name.endswith(_CUBE_SUFFIXES))
+            cubes += [(os.path.join(pattern, name), pattern) for name in names]
+        else:
+            cubes += [(fname, None) for fname in sorted(glob.glob(pattern)) if os.path.isfile(fname)]
+    return cubes
+
+
+def output_name(cube_file, output_dir, fmt, root=None):
+    """Output file of a cube file: its name without cube and compression suffixes, in output_dir."""
+    name = os.path.relpath(cube_file, root) if root is not None else os.path.basename(cube_file)
+    for suffix in sorted(_CUBE_SUFFIXES, key=len, reverse=True):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    return os.path.join(output_dir, name + _EXTENSIONS[fmt])
+
+
+def options_file(output):
+    """Hidden file next to an output holding the options it was rendered with."""
+    directory, name = os.path.split(output)
+    return os.path.join(directory, f".{name}.json")
+
+
+def _fingerprint(options):
+    """Options of render with its defaults filled in, as canonical JSON."""
+    return json.dumps(dict({"fmt": "png", "backend": "plotly"}, **options), sort_keys=True, default=str)
+
+
+def up_to_date(cube_file, output, options=None):
+    """True if output exists, is newer than cube_file and was rendered with the same options of render."""
+    if not (os.path.exists(output) and os.path.getmtime(output) >= os.path.getmtime(cube_file)):
+        return False
+    try:
+        with open(options_file(output)) as handle:
+            return handle.read() == _fingerprint(options or {})
+    except OSError:
+        return False
+
+
+def render(cube_file, output, fmt="png", backend="plotly", **settings):
+    """
+    Render a cube file, without a wavefunction, to an HTML, PNG or OBJ file.
+
+    The output is written to a temporary file next to it and renamed
+    when complete, then the options are saved in its options_file, so
+    an interrupted render never looks up to date.
+
+    Parameters
+    ----------
+    cube_file: filename of cube file
+    output: filename of the output
+    fmt: str, optional
+        "html", "png" or "obj". Default is "png".
+    backend: str, optional
+        Backend of html outputs, "plotly" or "webgl". Default is "plotly".
+    settings:
+        Keyword arguments of Cube.plot. OBJ files hold the isosurfaces
+        of cube_surfaces, which only take iso, cube_type, level,
+        max_voxels, crop, simplify and smoothing, in bohr.
+
+    """
+    import blobs
+
+    root, ext = os.path.splitext(output)
+    partial = f"{root}.part{ext}"
+    options = options_file(output)
+    if os.path.exists(options):
+        os.remove(options)
+    try:
+        if fmt == "obj":
+            meshes, levels = blobs.cube_surfaces(cube_file, **{key: settings[key] for key in _SURFACE_SETTINGS
+                                                               if key in settings})
+            blobs.write_obj(partial, meshes, names=[f"iso_{value:g}" for value in levels])
+        else:
+            blobs.Cube.from_file(cube_file).plot(cube_file, backend="png" if fmt == "png" else backend,
+                                                 filename=partial, **settings)
+        os.replace(partial, output)
+        with open(options, 'w') as handle:
+            handle.write(_fingerprint(dict(settings, fmt=fmt, backend=backend)))
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+
+def _timed_render(job):
+    """Render one job of render_batch in a worker, returning its summary row instead of raising."""
+    cube_file, output, options = job
+    start = time.perf_counter()
+    try:
+        render(cube_file, output, **options)
+    except Exception as error:
+        return cube_file, output, "failed", time.perf_counter() - start, f"{type(error).__name__}: {error}"
+    return cube_file, output, "rendered", time.perf_counter() - start, ""
+
+
+def render_batch(jobs, summary=None, workers=None, force=False, log=None):
+    """
+    Render cube files with a pool of processes.
+
+    Outputs newer than their cube file and rendered with the same
+    options are skipped unless force is set, so a batch that was
+    interrupted picks up where it stopped and a change of options
+    renders again. Failures
+    of single files are recorded and do not stop the batch, nor do
+    workers that die, whose unfinished jobs are recorded as failed.
+
+    Parameters
+    ----------
+    jobs: list<(cube_file: str, output: str, options: dict)>
+        Arguments of render.
+    summary: str, optional
+        CSV file receiving a row per job as it finishes: file, output,
+        status ("rendered", "skipped" or "failed"), seconds and error.
+    workers: int, optional
+        Number of processes, None uses one per CPU. A single worker
+        renders in this process.
+    force: bool, optional
+        Render outputs that are up to date too.
+    log: file object, optional
+        Stream of the progress lines. Default is None, no progress.
+
+    Returns
+    --------
+    rows: list<tuple>
+        Summary rows, in the order the jobs finished.
+
+    """
+    rows = []
+    out = open(summary, 'w', newline='') if summary is not None else None
+    writer = csv.writer(out) if out is not None else None
+    if writer is not None:
+        writer.writerow(["file", "output", "status", "seconds", "error"])
+
+    def record(row):
+        rows.append(row)
+        if writer is not None:
+            writer.writerow(row[:3] + (f"{row[3]:.3f}",) + row[4:])
+            out.flush()
+        if log is not None:
+            print(f"[{len(rows)}/{len(jobs)}] {row[2]:<8s} {row[3]:8.2f} s  {row[0]}"
+                  + (f"  {row[4]}" if row[4] else ""), file=log, flush=True)
+
+    try:
+        pending = []
+        for cube_file, output, options in jobs:
+            if not force and up_to_date(cube_file, output, options):
+                record((cube_file, output, "skipped", 0.0, ""))
+            else:
+                pending.append((cube_file, output, options))
+
+        if workers == 1:
+            for job in pending:
+                record(_timed_render(job))
+        elif pending:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(_timed_render, job): job for job in pending}
+                for future in as_completed(futures):
+                    try:
+                        row = future.result()
+                    except Exception as error:
+                        # A worker that died breaks the pool, which fails the jobs it had not finished
+                        cube_file, output, options = futures[future]
+                        row = cube_file, output, "failed", 0.0, f"{type(error).__name__}: {error}"
+                    record(row)
+    finally:
+        if out is not None:
+            out.close()
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="blobs",
+                                     description="Render cube files to HTML, PNG or OBJ files with a pool of "
+                                                 "processes. Outputs newer than their cube file and rendered "
+                                                 "with the same options are skipped.")
+    parser.add_argument("inputs", nargs="+", help="directories of cube files or glob patterns")
+    parser.add_argument("-o", "--output", default=".", help="directory of the outputs, default is the current one")
+    parser.add_argument("-f", "--format", choices=sorted(_EXTENSIONS), default="png", help="output format")
+    parser.add_argument("--backend", choices=["plotly", "webgl"], default="plotly", help="backend of html outputs")
+    parser.add_argument("--iso", type=float, nargs="+", default=[0.03], help="isovalues")
+    parser.add_argument("--cube-type", choices=["density", "orbital"], default="density",
+                        help="orbitals add the negative lobes")
+    parser.add_argument("--colorscale", default="Blues", help="plotly colorscale of the surfaces")
+    parser.add_argument("--mode", choices=["mesh", "volume"], default="mesh", help="isosurfaces or a volume")
+    parser.add_argument("--size", type=float, default=1, help="scale of the figure, 1 is 500 pixels")
+    parser.add_argument("--level", type=int, default=None, help="pyramid level of the grid")
+    parser.add_argument("--max-voxels", type=int, default=None, help="pick the finest level within this budget")
+    parser.add_argument("--crop", action="store_true", help="crop the grid to the smallest isovalue")
+    parser.add_argument("--simplify", type=int, default=None, help="target number of faces per surface")
+    parser.add_argument("--smoothing", type=int, default=0, help="smoothing iterations of the surfaces")
+    parser.add_argument("--latency", type=float, default=1.0, help="time budget of volumes in seconds")
+    parser.add_argument("--no-geometry", action="store_true", help="do not draw atoms")
+    parser.add_argument("--no-bonds", action="store_true", help="do not draw bonds")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of processes, default one per CPU")
+    parser.add_argument("--force", action="store_true", help="render outputs that are up to date too")
+    parser.add_argument("--summary", default=None,
+                        help="CSV file of per file timings, default is timings.csv in the output directory")
+    args = parser.parse_args(argv)
+
+    if args.mode == "volume" and (args.format == "obj" or (args.format == "html" and args.backend == "webgl")):
+        parser.error(f"--mode volume cannot be written as {args.format} with the {args.backend} backend"
+                     if args.format == "html" else "--mode volume has no surfaces to write as obj")
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    cubes = find_cubes(args.inputs)
+    if not cubes:
+        parser.error("no cube files found")
+    outputs = [output_name(cube_file, args.output, args.format, root) for cube_file, root in cubes]
+    if len(set(outputs)) < len(outputs):
+        parser.error("several cube files would be written to the same output, render them separately")
+
+    options = dict(fmt=args.format, backend=args.backend, iso=args.iso, cube_type=args.cube_type,
+                   colorscale=args.colorscale, mode=args.mode, size=args.size, level=args.level,
+                   max_voxels=args.max_voxels, crop=args.crop, simplify=args.simplify, smoothing=args.smoothing,
+                   latency=args.latency, plot_geometry=not args.no_geometry, plot_bonds=not args.no_bonds)
+    for output in outputs:
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+
+    summary = args.summary or os.path.join(args.output, "timings.csv")
+    jobs = [(cube_file, output, options) for (cube_file, root), output in zip(cubes, outputs)]
+    start = time.perf_counter()
+    rows = render_batch(jobs, summary, args.workers, args.force, log=sys.stdout)
+
+    counts = {status: sum(row[2] == status for row in rows) for status in ("rendered", "skipped", "failed")}
+    print(", ".join(f"{count} {status}" for status, count in counts.items())
+          + f" in {time.perf_counter() - start:.1f} s, timings in {summary}")
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
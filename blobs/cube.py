@@ -3,6 +3,13 @@ cube.py
 Psi4 cube files visualization tool
 """
 
+import bz2
+import functools
+import gzip
+import lzma
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import psi4
 import blobs
@@ -10,6 +17,8 @@ import blobs
 import plotly.graph_objects as go
 import plotly.express as px
 
+from .bonds import bond_trace
+from .encoding import compact_mesh
 
 
 class Cube():
@@ -23,7 +32,48 @@ class Cube():
         self.overage = psi4.core.get_global_option("CUBIC_GRID_OVERAGE")
         self.origin = self.get_origin()
         self.info = self.get_info()
+        self.bonds = build_bond_list(self.geometry.geometry().np)
         self.meta = None
+        self.render = None
+        self.viewer = None
+
+    @classmethod
+    def from_file(cls, cube_file):
+        """
+        Cube of the molecule in the header of a cube file, without a wavefunction.
+
+        Atoms are placed in voxel index units of the grid of the file and
+        bonded from their coordinates in bohr, so the cube file, and any
+        other file on the same grid, can be plotted without psi4.
+
+        Parameters
+        ----------
+        cube_file: filename of cube file
+
+        Returns
+        --------
+        cube: Cube
+
+        """
+        cube_details = _load_header(cube_file)
+        axes = np.array([cube_details['xvec'], cube_details['yvec'], cube_details['zvec']])
+        bohr = np.array([values[1:4] for number, values in cube_details['atoms']]).reshape(-1, 3)
+        voxels = np.linalg.solve(axes.T, (bohr - cube_details['org']).T).T
+
+        atoms_colors = blobs.get_colors()
+        symbols = {number: symbol for symbol, (color, number) in atoms_colors.items()}
+        sym = [symbols[number] for number, values in cube_details['atoms']]
+
+        self = cls.__new__(cls)
+        self.wfn = self.geometry = self.overage = None
+        self.origin = np.array(cube_details['org'])
+        self.spacing = np.linalg.norm(axes, axis=1)
+        self.info = {"sym": sym, "x": voxels[:, 0], "y": voxels[:, 1], "z": voxels[:, 2],
+                     "color": [atoms_colors[symbol][0] for symbol in sym],
+                     "size": np.array([atoms_colors[symbol][1] + 15 for symbol in sym])}
+        self.bonds = build_bond_list(bohr)
+        self.meta = self.render = self.viewer = None
+        return self
 
     def get_origin(self):
         geometry = self.geometry.full_geometry().np
@@ -94,15 +144,75 @@ class Cube():
              colorscale="Blues",
              size=1,
              plot_geometry=True,
-             plot_bonds=True):
-
-        atoms_colors = blobs.get_colors()
-        cube, meta = cube_to_array(cube_file)
-        self.meta = meta
-
-        X, Y, Z = np.mgrid[:cube.shape[0], :cube.shape[1], :cube.shape[2]]
-
-        data = []
+             plot_bonds=True,
+             cache=None,
+             dtype=None,
+             mode="mesh",
+             simplify=None,
+             smoothing=0,
+             mesh_cache=None,
+             level=None,
+             max_voxels=None,
+             crop=False,
+             progressive=False,
+             preview_voxels=2**16,
+             backend="plotly",
+             filename=None,
+             latency=1.0):
+
+        # A new plot supersedes the surfaces still being refined for the previous one
+        if self.render is not None:
+            self.render.cancel()
+            self.render = None
+        _check_plot(mode, progressive, backend, filename)
+
+        if level is None:
+            level = 0 if max_voxels is None else blobs.pick_level(blobs.grid_shape(cube_file), max_voxels)
+        method = "maxabs" if cube_type == "orbital" else "mean"
+        threshold = np.min(np.abs(iso)) if crop is True else (crop or None)
+        grid = {"cache": cache, "dtype": dtype, "level": level, "method": method, "crop": threshold}
+        surfaces, traces, volume = [], [], None
+
+        if mode == "mesh":
+            levels, colors = surface_levels(iso, cube_type, colorscale)
+            settings = {"simplify": simplify, "smoothing": smoothing, "mesh_cache": mesh_cache}
+            if progressive:
+                self._plot_progressive(cube_file, levels, colors, grid, settings, preview_voxels, size,
+                                       plot_geometry, plot_bonds)
+                return
+            surfaces = self._mesh_surfaces(cube_file, levels, colors, grid, settings)
+        elif mode == "isosurface":
+            traces = self._isosurface_traces(cube_file, iso, cube_type, colorscale, grid)
+        else:
+            volume = self._volume(cube_file, iso, cube_type, colorscale, latency, grid)
+
+        info = self._info_in_box(level) if threshold is not None else self.info
+        if backend != "plotly":
+            scene = self._scene(surfaces, info, size, plot_geometry, plot_bonds)
+            if volume is not None:
+                scene.add_volume(**volume)
+            blobs.get_backend(backend).show(scene, filename)
+            return
+
+        data = [mesh_trace(vertices, faces, color) for (vertices, faces), color in surfaces] + traces
+        if volume is not None:
+            data += blobs.volume_traces(**volume)
+        fig = self._figure(data, info, size, plot_geometry, plot_bonds)
+        if filename is not None:
+            fig.write_html(filename)
+        else:
+            fig.show(config={'scrollZoom': False})
+
+    def _mesh_surfaces(self, cube_file, levels, colors, grid, settings):
+        """((vertices, faces), color) surfaces of surface_meshes, with the load_grid arguments of grid."""
+        meshes, self.meta = surface_meshes(cube_file, levels, **settings, **grid)
+        return list(zip(meshes, colors))
+
+    def _isosurface_traces(self, cube_file, iso, cube_type, colorscale, grid):
+        """Plotly Isosurface traces of a cube file, loaded with the load_grid arguments of grid."""
+        cube, self.meta = load_grid(cube_file, **grid)
+        X, Y, Z = blobs.to_full_grid(np.mgrid[:cube.shape[0], :cube.shape[1], :cube.shape[2]], grid["level"])
+        X, Y, Z, cube = (values.astype(np.float32) for values in (X, Y, Z, cube))
 
         vol_data = go.Isosurface(x=X.flatten(),
                                  y=Y.flatten(),
@@ -115,7 +225,7 @@ class Cube():
                                  opacity=0.2,
                                  colorscale=colorscale)
 
-        data.append(vol_data)
+        data = [vol_data]
 
         if cube_type == "orbital":
             vol_data_neg = go.Isosurface(x=X.flatten(),
@@ -130,15 +240,169 @@ class Cube():
 
             data.append(vol_data_neg)
 
+        return data
+
+    def _volume(self, cube_file, iso, cube_type, colorscale, latency, grid):
+        """Volume of a cube file as the arguments of Scene.add_volume, loaded with the load_grid arguments of grid."""
+        # Densities glow from iso up to their peak, orbitals add their negative lobe in reds
+        cube, self.meta = load_grid(cube_file, **grid)
+        return {"data": cube, "level": grid["level"], "colorscale": colorscale,
+                "negative": "Reds" if cube_type == "orbital" else None,
+                "threshold": float(np.min(np.abs(iso))), "latency": latency}
+
+    def _plot_progressive(self, cube_file, levels, colors, grid, settings, preview_voxels, size=1,
+                          plot_geometry=True, plot_bonds=True):
+        """
+        Display a figure widget with the coarsest preview of the surfaces and refine it in the background.
+
+        The final stage returns the metadata of the grid with its meshes,
+        which is kept in self.meta once they are displayed, on the thread
+        owning the figure.
+        """
+        # Previews sample the file every few planes, stages keep atoms in full grid units
+        def preview(step):
+            return blobs.sampled_isosurfaces(cube_file, levels, step, dtype=grid["dtype"], crop=grid["crop"]), None
+
+        steps = blobs.progressive_steps(blobs.grid_shape(cube_file), preview_voxels, final_step=2 ** grid["level"])
+        final = functools.partial(surface_meshes, cube_file, levels, uncrop=True, **settings, **grid)
+        stages = [functools.partial(preview, step) for step in steps] + [final]
+        meshes, meta = stages.pop(0)()
+        self._keep_meta(meta)
+
+        data = [mesh_trace(vertices, faces, color) for (vertices, faces), color in zip(meshes, colors)]
+        fig = self._figure(data, self.info, size, plot_geometry, plot_bonds, widget=True)
+
+        from IPython.display import display
+        self.render = blobs.ProgressiveRender(fig, range(len(meshes)), stages, on_display=self._keep_meta).start()
+        display(fig)
+
+    def _keep_meta(self, meta):
+        """Keep the metadata of a progressive stage that read the grid, previews have none."""
+        if meta is not None:
+            self.meta = meta
+
+    def view(self, cube_file=None, size=1, plot_geometry=True, plot_bonds=True, **settings):
+        """
+        Show cube files in one persistent CubeViewer.
+
+        The first call creates and displays the figure widget, later calls
+        update it in place, so only the surfaces whose settings change are
+        recomputed and sent to the browser. size, plot_geometry and
+        plot_bonds apply to the first call. The other keyword arguments
+        are those of plot: iso, cube_type, colorscale, cache, mesh_cache,
+        dtype, simplify, smoothing, level and crop.
+
+        Returns
+        --------
+        viewer: CubeViewer
+
+        """
+        if self.viewer is None:
+            from IPython.display import display
+            self.viewer = blobs.CubeViewer(self, size, plot_geometry, plot_bonds)
+            display(self.viewer.figure)
+        if cube_file is not None:
+            settings["cube_file"] = cube_file
+        return self.viewer.update(**settings)
+
+    def slider(self,
+               cube_file,
+               isovalues,
+               cube_type="density",
+               colorscale="Blues",
+               size=1,
+               plot_geometry=True,
+               plot_bonds=True,
+               cache=None,
+               dtype=None,
+               simplify=None,
+               smoothing=0,
+               level=None,
+               max_voxels=None,
+               crop=False,
+               workers=None):
+        """
+        Plot the isosurfaces of a cube file with a slider over isovalues.
+
+        The file is read once and the surfaces of every isovalue are
+        extracted in one sweep of the grid, triangulated and decimated
+        by parallel workers. Their meshes are stored in the steps of the
+        slider, which restyle the surface traces in the browser without
+        calling back into Python.
+
+        Parameters
+        ----------
+        cube_file: filename of cube file
+        isovalues: list<float>
+            Positive isovalues; orbitals add the negative lobe of each.
+        workers: int, optional
+            Number of threads, None uses one per CPU.
+
+        The other parameters are those of plot.
+
+        """
+        isovalues = [float(iso) for iso in np.atleast_1d(isovalues)]
+        if level is None:
+            level = 0 if max_voxels is None else blobs.pick_level(blobs.grid_shape(cube_file), max_voxels)
+        method = "maxabs" if cube_type == "orbital" else "mean"
+        threshold = np.min(np.abs(isovalues)) if crop is True else (crop or None)
+
+        levels = list(isovalues)
+        colors = px.colors.sample_colorscale(colorscale, [1.0])
+        if cube_type == "orbital":
+            levels += [-1 * iso for iso in isovalues]
+            colors += px.colors.sample_colorscale("Reds", [1.0])
+
+        cube, self.meta = load_grid(cube_file, cache, dtype, level, method, threshold)
+        meshes = blobs.postprocess_meshes(blobs.isosurfaces(cube, levels, workers=workers), simplify, smoothing,
+                                          workers=workers)
+        meshes = [compact_mesh(blobs.to_full_grid(vertices, level), faces) for vertices, faces in meshes]
+        surfaces = [meshes[i::len(isovalues)] for i in range(len(isovalues))]
+
+        data = [mesh_trace(vertices, faces, color) for (vertices, faces), color in zip(surfaces[0], colors)]
+        info = self._info_in_box(level) if threshold is not None else self.info
+        fig = self._figure(data, info, size, plot_geometry, plot_bonds)
+
+        steps = []
+        for iso, group in zip(isovalues, surfaces):
+            restyle = {name: [vertices[:, axis] for vertices, faces in group] for axis, name in enumerate("xyz")}
+            restyle.update({name: [faces[:, axis] for vertices, faces in group] for axis, name in enumerate("ijk")})
+            steps.append(dict(method="restyle", label=f"{iso:.3g}", args=[restyle, list(range(len(group)))]))
+        fig.update_layout(sliders=[dict(active=0, currentvalue={"prefix": "iso: "}, pad={"t": 20}, steps=steps)])
+
+        fig.show(config={'scrollZoom': False})
+
+    def _info_in_box(self, level=0):
+        """Atoms moved from voxel index units of the full grid into the cropped box of self.meta."""
+        offset = np.array([lo for lo, hi in self.meta['box']]) * 2 ** level
+        info = self.info
+        return dict(info, x=info["x"] - offset[0], y=info["y"] - offset[1], z=info["z"] - offset[2])
+
+    def _scene(self, surfaces, info, size=1, plot_geometry=True, plot_bonds=True):
+        """Scene with the given ((vertices, faces), color) surfaces and the atoms and bonds of info."""
+        scene = blobs.Scene(size)
+        for (vertices, faces), color in surfaces:
+            scene.add_mesh(vertices, faces, color)
+        if plot_geometry or plot_bonds:
+            positions = np.stack([info["x"], info["y"], info["z"]], axis=1)
+            scene.add_atoms(positions, info["color"], info["size"] * size, outline=10, visible=plot_geometry)
+        if plot_bonds:
+            scene.add_bonds(self.bonds, width=7 * size)
+        return scene
+
+    def _figure(self, data, info, size=1, plot_geometry=True, plot_bonds=True, widget=False):
+        """Figure with the given surface traces, the atoms and bonds of info and the scene layout."""
+        data = list(data)
+
         if plot_geometry == True:
-            geo_data = go.Scatter3d(x=self.info["x"],
-                                    y=self.info["y"],
-                                    z=self.info["z"],
+            geo_data = go.Scatter3d(x=info["x"],
+                                    y=info["y"],
+                                    z=info["z"],
                                     mode="markers",
                                     marker={
                                         "showscale": False,
-                                        "color": self.info["color"],
-                                        "size": self.info["size"] * size / 1.0,
+                                        "color": info["color"],
+                                        "size": info["size"] * size / 1.0,
                                         "showscale": False,
                                         "opacity": 1.0,
                                         "line": {
@@ -149,53 +413,13 @@ class Cube():
 
             data.append(geo_data)
 
-        fig = go.Figure(data=data)
+        fig = go.FigureWidget(data=data) if widget else go.Figure(data=data)
 
         if plot_bonds == True:
-            
-            bonds = build_bond_list(self.geometry.geometry().np)
-
-            for i in range(len(bonds)):
-                
-                midx  = (self.info["x"][bonds[i][0]] + self.info["x"][bonds[i][1]]) / 2
-                midy  = (self.info["y"][bonds[i][0]] + self.info["y"][bonds[i][1]]) / 2
-                midz  = (self.info["z"][bonds[i][0]] + self.info["z"][bonds[i][1]]) / 2
-                
-                bond_color_1= atoms_colors[self.info["sym"][bonds[i][0]]][0]
-                bond_color_2= atoms_colors[self.info["sym"][bonds[i][1]]][0]
-
-                bond_x_1 = [self.info["x"][bonds[i][0]], midx]
-                bond_y_1 = [self.info["y"][bonds[i][0]], midy]
-                bond_z_1 = [self.info["z"][bonds[i][0]], midz]
-
-                bond_x_2 = [self.info["x"][bonds[i][1]], midx]
-                bond_y_2 = [self.info["y"][bonds[i][1]], midy]
-                bond_z_2 = [self.info["z"][bonds[i][1]], midz]
-                
-                fig.add_trace(
-                    go.Scatter3d(
-                        x=bond_x_1,
-                        y=bond_y_1,
-                        z=bond_z_1,
-                        mode="lines",
-                        line={
-                            "color": bond_color_1,
-                            "width": 7 * size
-                        },
-                    ))
-
-                fig.add_trace(
-                    go.Scatter3d(
-                        x=bond_x_2,
-                        y=bond_y_2,
-                        z=bond_z_2,
-                        mode="lines",
-                        line={
-                            "color": bond_color_2,
-                            "width": 7 * size
-                        },
-                    ))
-        
+            atoms_colors = blobs.get_colors()
+            positions = np.stack([info["x"], info["y"], info["z"]], axis=1)
+            colors = [atoms_colors[sym][0] for sym in info["sym"]]
+            fig.add_trace(bond_trace(positions, self.bonds, colors, width=7 * size))
 
         layout = go.layout.Template(layout=go.Layout(title_font=dict(family="Rockwell", size=24)))
 
@@ -248,7 +472,241 @@ class Cube():
                               }
                           })
 
-        fig.show(config={'scrollZoom': False})
+        return fig
+
+
+def _check_plot(mode, progressive, backend, filename):
+    """Raise a ValueError for the combinations of Cube.plot options that cannot be drawn."""
+    if mode not in ("mesh", "isosurface", "volume"):
+        raise ValueError(f"Unknown mode {mode!r}, use 'mesh', 'isosurface' or 'volume'")
+    if progressive and mode != "mesh":
+        raise ValueError("Progressive rendering refines meshes, use mode='mesh'")
+    if progressive and filename is not None:
+        raise ValueError("Progressive rendering refines a live figure, it cannot be written to a file")
+    if backend != "plotly" and (mode not in ("mesh", "volume") or progressive):
+        raise ValueError(f"The {backend} backend draws finished meshes or volumes, use mode='mesh' or "
+                         "mode='volume' without progressive")
+
+
+def surface_levels(iso, cube_type="density", colorscale="Blues"):
+    """
+    Isovalues drawn by Cube.plot and their colors.
+
+    Parameters
+    ----------
+    iso: float or list<float>
+        Positive isovalues.
+    cube_type: str, optional
+        "density" or "orbital". Orbitals add the negative of every
+        isovalue, drawn in reds. Default is "density".
+    colorscale: str, optional
+        Plotly colorscale of the positive isovalues. Default is "Blues".
+
+    Returns
+    --------
+    (levels: list<float>, colors: list<str>)
+        The first isovalues take the strongest colors.
+
+    """
+    levels = list(np.atleast_1d(iso))
+    colors = px.colors.sample_colorscale(colorscale, np.linspace(1.0, 0.4, len(levels)).tolist())
+    if cube_type == "orbital":
+        levels += [-1 * level for level in levels]
+        colors += px.colors.sample_colorscale("Reds", np.linspace(1.0, 0.4, len(colors)).tolist())
+    return levels, colors
+
+
+def surface_meshes(fname, levels, cache=None, dtype=None, level=0, method="mean", crop=None, simplify=None,
+                   smoothing=0, mesh_cache=None, uncrop=False):
+    """
+    Isosurface meshes of a cube file with the settings of Cube.plot.
+
+    Parameters
+    ----------
+    fname: filename of cube file
+    levels: list<float>
+        Isovalues, see surface_levels.
+    cache: CubeCache, optional
+    dtype: np.dtype, optional
+    level: int, optional
+    method: str, optional
+    crop: float, optional
+        See load_grid.
+    simplify: int or float, optional
+    smoothing: int, optional
+        Decimation target and smoothing iterations, see postprocess_meshes.
+    mesh_cache: MeshCache, optional
+        Cache of the meshes, which then reads the grid only on a miss.
+    uncrop: bool, optional
+        Place the meshes of a cropped grid in the full grid. Default is
+        False, they stay relative to the cropped box.
+
+    Returns
+    --------
+    (meshes: list<(vertices: np.array (n, 3), faces: np.array (m, 3))>, metadata: dict)
+        One mesh per level in voxel index units of the full grid, and the
+        metadata of the grid they were extracted from.
+
+    """
+    if mesh_cache is not None:
+        meshes, cube_details = mesh_cache.isosurfaces(fname, levels, simplify=simplify, smoothing=smoothing,
+                                                      dtype=dtype, cache=cache, lod=level, method=method, crop=crop)
+    else:
+        data, cube_details = load_grid(fname, cache, dtype, level, method, crop)
+        meshes = blobs.postprocess_meshes(blobs.isosurfaces(data, levels), simplify, smoothing)
+
+    offset = np.zeros(3)
+    if uncrop and crop is not None:
+        offset = np.array([lo for lo, hi in cube_details['box']])
+    return [(blobs.to_full_grid(vertices + offset, level), faces) for vertices, faces in meshes], cube_details
+
+
+def cube_surfaces(fname, iso=0.03, cube_type="density", level=None, max_voxels=None, crop=False, simplify=None,
+                  smoothing=0):
+    """
+    Isosurfaces of a cube file drawn by Cube.plot, placed in the frame of the file.
+
+    Parameters
+    ----------
+    fname: filename of cube file, plain, compressed or a container
+    iso: float or list<float>, optional
+        Positive isovalues. Default is 0.03.
+    cube_type: str, optional
+        "density" or "orbital", see surface_levels. Default is "density".
+    level: int, optional
+        Pyramid level of the grid. Default is None, picked from max_voxels.
+    max_voxels: int, optional
+        Voxel budget of the level picked when level is None. Default is
+        None, the full grid.
+    crop: bool or float, optional
+        Crop the grid to the smallest isovalue, or to a threshold. Default
+        is False.
+    simplify: int or float, optional
+    smoothing: int, optional
+        Decimation target and smoothing iterations, see postprocess_meshes.
+
+    Returns
+    --------
+    (meshes: list<(vertices: np.array (n, 3), faces: np.array (m, 3))>, levels: list<float>)
+        One mesh per isovalue, with vertices in the units of the cube
+        file (bohr).
+
+    """
+    if level is None:
+        level = 0 if max_voxels is None else blobs.pick_level(blobs.grid_shape(fname), max_voxels)
+    method = "maxabs" if cube_type == "orbital" else "mean"
+    threshold = np.min(np.abs(iso)) if crop is True else (crop or None)
+    levels = surface_levels(iso, cube_type)[0]
+    meshes = surface_meshes(fname, levels, level=level, method=method, crop=threshold, simplify=simplify,
+                            smoothing=smoothing, uncrop=True)[0]
+
+    header = _load_header(fname)
+    origin = np.array(header['org'])
+    axes = np.array([header['xvec'], header['yvec'], header['zvec']])
+    return [(origin + vertices @ axes, faces) for vertices, faces in meshes], levels
+
+
+def _load_header(fname):
+    """Metadata of a cube file or a container, read from its header only."""
+    from .store import CubeStore, is_store
+    if is_store(fname):
+        return CubeStore(fname).cube_details
+    return CubeSlabs(fname).cube_details
+
+
+def load_grid(fname, cache=None, dtype=None, level=0, method="mean", crop=None):
+    """
+    Grid of a cube file at a pyramid level, cropped to its significant voxels.
+
+    Parameters
+    ----------
+    fname: filename of cube file, plain, compressed or a container
+    cache: CubeCache or False, optional
+        Cache the grid is read through. Default is None: coarse levels
+        are saved in a CubeCache in its default directory, so zooming in
+        and out of a file only parses it once, and the full grid is read
+        without a cache. False reads every level without a cache.
+    dtype: np.dtype, optional
+        Floating point type of the grid, see cube_to_array.
+    level: int, optional
+        Pyramid level, the grid is downsampled 2**level times. Default is 0.
+    method: str, optional
+        "mean" or "maxabs", see downsample. Default is "mean".
+    crop: float, optional
+        Threshold of crop_to_significant. Default is None, no cropping.
+
+    Returns
+    --------
+    (data: np.array, metadata: dict)
+
+    """
+    if cache is None and level:
+        cache = blobs.CubeCache()
+    if cache is not None and cache is not False:
+        data, cube_details = cache.load(fname, dtype=dtype, level=level, method=method)
+    elif level:
+        data, cube_details = blobs.build_pyramid(fname, levels=[level], method=method, dtype=dtype)[level]
+    else:
+        data, cube_details = cube_to_array(fname, dtype=dtype)
+    if crop is not None:
+        data, cube_details = crop_to_significant(data, cube_details, crop)
+    return data, cube_details
+
+
+def mesh_trace(vertices, faces, color, opacity=0.2):
+    """
+    Mesh3d trace of an isosurface in a single color.
+
+    Parameters
+    ----------
+    vertices: np.array (n, 3)
+    faces: np.array (m, 3)
+    color: str
+    opacity: float, optional
+        Default is 0.2.
+
+    Returns
+    --------
+    trace: go.Mesh3d
+        Vertices are sent as float32 and faces as uint16 or uint32, see compact_mesh.
+
+    """
+    vertices, faces = compact_mesh(vertices, faces)
+    return go.Mesh3d(x=vertices[:, 0],
+                     y=vertices[:, 1],
+                     z=vertices[:, 2],
+                     i=faces[:, 0],
+                     j=faces[:, 1],
+                     k=faces[:, 2],
+                     color=color,
+                     opacity=opacity,
+                     flatshading=False,
+                     hoverinfo="skip")
+
+
+_COMPRESSION = [
+    (b'\x1f\x8b', gzip),
+    (b'BZh', bz2),
+    (b'\xfd7zXZ\x00', lzma),
+]
+
+
+def _compression(fname):
+    """Module able to decompress a file, found from its magic bytes, or None."""
+    with open(fname, 'rb') as cube:
+        magic = cube.read(6)
+    for prefix, module in _COMPRESSION:
+        if magic.startswith(prefix):
+            return module
+    return None
+
+
+def _open_cube(fname):
+    """Open a cube file in binary mode, decompressing gzip, bz2 and xz files on the fly."""
+    module = _compression(fname)
+    if module is None:
+        return open(fname, 'rb')
+    return module.open(fname, 'rb')
 
 
 def _getline(cube):
@@ -271,37 +729,786 @@ def _getline(cube):
     return int(l[0]), list(map(float, l[1:]))
 
 
-def cube_to_array(fname):
+def _read_header(cube):
+    """
+    Read the header of a cube file, leaving the file positioned
+    at the first line of the voxel block.
+
+    Parameters
+    ----------
+    cube: file object of the cube file
+
+    Returns
+    --------
+    (shape: tuple<int>, metadata: dict)
+
+    """
+    cube_details = {}
+    cube.readline()
+    cube.readline()  # ignore comments
+    natm, cube_details['org'] = _getline(cube)
+    nx, cube_details['xvec'] = _getline(cube)
+    ny, cube_details['yvec'] = _getline(cube)
+    nz, cube_details['zvec'] = _getline(cube)
+    cube_details['atoms'] = [_getline(cube) for i in range(natm)]
+    return (nx, ny, nz), cube_details
+
+
+def _parse_voxels(text, count, dtype=np.float64):
+    """
+    Convert a block of whitespace separated voxel values to a flat array.
+
+    The conversion is done in a single call to numpy's text parser, so no
+    per-value Python objects are created.
+
+    Parameters
+    ----------
+    text: str or bytes holding the voxel values
+    count: number of values expected in text
+    dtype: floating point type of the output
+
+    Returns
+    --------
+    data: np.array
+
+    """
+    data = np.fromstring(text, dtype=dtype, sep=' ')
+    if data.size != count:
+        raise ValueError(f"Expected {count} voxel values, found {data.size}")
+    return data
+
+
+def _parse_voxel_stream(cube, count, dtype=np.float64, block=2**22):
+    """
+    Parse the voxel values of an open file, one block of text at a time.
+
+    Each block is completed up to the next line break so that no value is
+    split, and is parsed straight into its slice of the output. Only one
+    block of text is held in memory, which keeps decompressed files from
+    being staged whole.
+
+    """
+    data = np.empty(count, dtype=dtype)
+    filled = 0
+    while True:
+        text = cube.read(block) + cube.readline()
+        if not text:
+            break
+        values = np.fromstring(text, dtype=dtype, sep=' ')
+        if filled + values.size > count:
+            raise ValueError(f"Expected {count} voxel values, found more")
+        data[filled:filled + values.size] = values
+        filled += values.size
+    if filled != count:
+        raise ValueError(f"Expected {count} voxel values, found {filled}")
+    return data
+
+
+def _voxel_layout(cube, nz):
+    """
+    Detect how the voxel block of a cube file is broken into lines.
+
+    Psi4 writes the values as one stream, six per line. Other programs
+    also start a new line after every z-column. The file is expected to
+    be positioned at the start of the voxel block and is left there.
+
+    Returns
+    --------
+    (per_line: int, column_breaks: bool)
+
+    """
+    start = cube.tell()
+    line = cube.readline()
+    per_line = len(line.split())
+    lines_per_column = -(-nz // per_line)
+    for i in range(lines_per_column - 1):
+        line = cube.readline()
+    column_breaks = nz % per_line != 0 and len(line.split()) == nz % per_line
+    cube.seek(start)
+    return per_line, column_breaks
+
+
+def _values_before_line(line, nvalues, nz, layout):
+    """Number of voxel values that precede a line of the voxel block."""
+    per_line, column_breaks = layout
+    if not column_breaks:
+        return min(line * per_line, nvalues)
+    columns, rest = divmod(line, -(-nz // per_line))
+    return min(columns * nz + min(rest * per_line, nz), nvalues)
+
+
+# Largest chunk of voxel text a parsing thread holds at a time
+_CHUNK_BYTES = 2**26
+
+
+def _line_chunks(cube, start, end, nchunks):
+    """
+    Split the byte range [start, end) of an open cube file into
+    at most nchunks ranges that begin and end on line boundaries.
+
+    """
+    bounds = [start]
+    step = max((end - start) // nchunks, 1)
+    for i in range(1, nchunks):
+        cube.seek(max(start + i * step, bounds[-1]))
+        cube.readline()
+        pos = cube.tell()
+        if pos >= end:
+            break
+        bounds.append(pos)
+    bounds.append(end)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _count_lines(fname, start, end, block=2**22):
+    """Number of line breaks in a byte range of a file, read one block at a time."""
+    count = 0
+    with open(fname, 'rb') as cube:
+        cube.seek(start)
+        while start < end:
+            text = cube.read(min(block, end - start))
+            if not text:
+                break
+            count += text.count(b'\n')
+            start += len(text)
+    return count
+
+
+def _indexed_chunks(fname, start, end, shape, nchunks):
+    """
+    Chunks of a fixed-width voxel block, as (start, end, first, last) byte
+    offsets and flat voxel indices, placed with _LineIndex.
+    """
+    nvalues = shape[0] * shape[1] * shape[2]
+    with open(fname, 'rb') as cube:
+        cube.seek(start)
+        index = _LineIndex(cube, shape)
+    nlines = index.line_of(nvalues - 1) + 1
+    lines = sorted(set(np.linspace(0, nlines, nchunks + 1).astype(int).tolist()))
+    offsets = [index.line_start(line) for line in lines[:-1]] + [end]
+    values = [index.values_before(line) for line in lines]
+    return list(zip(offsets[:-1], offsets[1:], values[:-1], values[1:]))
+
+
+def _counted_chunks(fname, start, end, shape, nchunks, pool):
+    """
+    Chunks of any voxel block split on line boundaries, as (start, end,
+    first, last), the first voxel of each following from the line breaks
+    counted before it.
+    """
+    nvalues = shape[0] * shape[1] * shape[2]
+    with open(fname, 'rb') as cube:
+        cube.seek(start)
+        layout = _voxel_layout(cube, shape[2])
+        ranges = _line_chunks(cube, start, end, nchunks)
+    counts = list(pool.map(lambda chunk: _count_lines(fname, *chunk), ranges))
+    lines = np.concatenate([[0], np.cumsum(counts)])
+    values = [_values_before_line(int(line), nvalues, shape[2], layout) for line in lines[:-1]] + [nvalues]
+    return [(begin, stop, values[i], values[i + 1]) for i, (begin, stop) in enumerate(ranges)]
+
+
+def _parse_voxels_parallel(fname, start, end, shape, workers, dtype=np.float64):
+    """
+    Parse the voxel block of a cube file with a pool of threads.
+
+    The block is split in chunks on line boundaries, whose first value
+    follows from the fixed-width layout of the lines, or from the line
+    breaks counted before them when lines differ in length. Each thread
+    then reads its chunk and parses it straight into its slice of the
+    output array, so only the text of the chunks being parsed is in
+    memory. numpy releases the GIL while parsing, so chunks run
+    concurrently.
+
+    """
+    data = np.empty(shape[0] * shape[1] * shape[2], dtype=dtype)
+    nchunks = max(4 * workers, -(-(end - start) // _CHUNK_BYTES))
+
+    def parse(chunk):
+        begin, stop, first, last = chunk
+        with open(fname, 'rb') as cube:
+            cube.seek(begin - 1)
+            text = cube.read(stop - begin + 1)
+        if text[:1] != b'\n':
+            raise ValueError("Voxel block of cube file is not fixed width")
+        data[first:last] = _parse_voxels(text, last - first, dtype)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            list(pool.map(parse, _indexed_chunks(fname, start, end, shape, nchunks)))
+        except ValueError:
+            # Lines of different lengths, place the chunks by counting their line breaks
+            list(pool.map(parse, _counted_chunks(fname, start, end, shape, nchunks, pool)))
+
+    return data
+
+
+def cube_to_array(fname, workers=1, dtype=None):
     """
     Read cube file into numpy array
 
     Parameters
     ----------
     fname: filename of cube file
+    workers: int, optional
+        Number of threads used to parse the voxel block. None uses
+        one thread per CPU. The result is identical to the serial
+        parser; files with an irregular number of values per line
+        raise ValueError and must be read with a single worker.
+        Compressed files are always parsed by a single thread.
+    dtype: np.dtype, optional
+        Floating point type of the array. Values are parsed straight
+        into it, so float32 halves the memory of the grid. Default is
+        float64, or the stored dtype for containers.
+
+    Files compressed with gzip, bz2 or xz are recognized from their
+    magic bytes and decompressed while parsing. Containers written by
+    cube_to_store are read as well.
 
     Returns
     --------
     (data: np.array, metadata: dict)
 
     """
-    cube_details = {}
-    with open(fname, 'r') as cube:
-        cube.readline()
-        cube.readline()  # ignore comments
-        natm, cube_details['org'] = _getline(cube)
-        nx, cube_details['xvec'] = _getline(cube)
-        ny, cube_details['yvec'] = _getline(cube)
-        nz, cube_details['zvec'] = _getline(cube)
-        cube_details['atoms'] = [_getline(cube) for i in range(natm)]
-        data = np.zeros((nx * ny * nz))
-        idx = 0
-        for line in cube:
-            for val in line.strip().split():
-                data[idx] = float(val)
-                idx += 1
-    data = np.reshape(data, (nx, ny, nz))
-    cube.close()
-    return data, cube_details
+    from .store import CubeStore, is_store
+    if is_store(fname):
+        store = CubeStore(fname)
+        data = store.data if dtype is None else store.data.astype(dtype, copy=False)
+        return data, store.cube_details
+
+    volume = CubeVolume(fname, workers=workers, dtype=np.float64 if dtype is None else dtype)
+    return volume.data, volume.cube_details
+
+
+def _read_voxels(fname, offset, shape, workers=1, dtype=np.float64):
+    """Read the voxel block that starts at byte offset of a cube file."""
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers > 1 and _compression(fname) is None:
+        data = _parse_voxels_parallel(fname, offset, os.path.getsize(fname), shape, workers, dtype)
+    else:
+        with _open_cube(fname) as cube:
+            cube.seek(offset)
+            data = _parse_voxel_stream(cube, shape[0] * shape[1] * shape[2], dtype)
+
+    return np.reshape(data, shape)
+
+
+class _LineIndex():
+    """
+    Byte offsets of the lines of a fixed-width voxel block.
+
+    Cube writers print every value in a field of the same width, so all
+    full lines of the voxel block have the same length. The offset of
+    any voxel then follows from the header, the length of the first
+    line and the layout found by _voxel_layout.
+
+    """
+    def __init__(self, cube, shape):
+        self.nz = shape[2]
+        self.nvalues = shape[0] * shape[1] * shape[2]
+        self.offset = cube.tell()
+        self.layout = _voxel_layout(cube, self.nz)
+        self.per_line, column_breaks = self.layout
+
+        lines = [cube.readline() for i in range(-(-self.nz // self.per_line))]
+        self.line_bytes = len(lines[0])
+        self.column_bytes = sum(len(line) for line in lines) if column_breaks else None
+        if any(len(line) != self.line_bytes for line in lines[:-1]):
+            raise ValueError("Voxel block of cube file is not fixed width")
+
+        last = self.line_of(self.nvalues - 1)
+        cube.seek(self.line_start(last) - 1)
+        tail = cube.read()
+        count = self.nvalues - self.values_before(last)
+        if tail[:1] != b'\n' or np.fromstring(tail, sep=' ').size != count:
+            raise ValueError("Voxel block of cube file is not fixed width")
+
+    def values_before(self, line):
+        return _values_before_line(line, self.nvalues, self.nz, self.layout)
+
+    def line_of(self, index):
+        """Line holding the voxel with flat index."""
+        if self.column_bytes is None:
+            return index // self.per_line
+        column, rest = divmod(index, self.nz)
+        return column * -(-self.nz // self.per_line) + rest // self.per_line
+
+    def line_start(self, line):
+        """Byte offset of the start of a line."""
+        if self.column_bytes is None:
+            return self.offset + line * self.line_bytes
+        column, rest = divmod(line, -(-self.nz // self.per_line))
+        return self.offset + column * self.column_bytes + rest * self.line_bytes
+
+    def read(self, cube, first, last, dtype=np.float64):
+        """Read the voxels with flat indices [first, last) by seeking to their lines."""
+        start = self.line_of(first)
+        stop = self.line_of(last - 1) + 1
+        cube.seek(self.line_start(start))
+        text = cube.read(self.line_start(stop) - self.line_start(start))
+        values = _parse_voxels(text, self.values_before(stop) - self.values_before(start), dtype)
+        skip = first - self.values_before(start)
+        return values[skip:skip + last - first]
+
+
+def bounds_to_box(bounds, cube_details, shape):
+    """
+    Smallest index box holding a real-space bounding box, clipped to the grid.
+
+    Parameters
+    ----------
+    bounds: ((xmin, xmax), (ymin, ymax), (zmin, zmax))
+        Bounding box in the units of the cube file, usually bohr.
+    cube_details: dict
+        Metadata of the grid, as returned by cube_to_array.
+    shape: tuple<int>
+        Shape of the grid.
+
+    Returns
+    --------
+    box: ((x0, x1), (y0, y1), (z0, z1))
+        Half-open voxel index ranges.
+
+    """
+    axes = np.array([cube_details['xvec'], cube_details['yvec'], cube_details['zvec']])
+    corners = np.array(np.meshgrid(*bounds, indexing='ij')).reshape(3, -1).T
+    index = np.linalg.solve(axes.T, (corners - cube_details['org']).T).T
+    lower = np.clip(np.floor(index.min(axis=0)), 0, shape).astype(int)
+    upper = np.clip(np.ceil(index.max(axis=0)) + 1, 0, shape).astype(int)
+    return tuple(zip(lower.tolist(), upper.tolist()))
+
+
+def cube_region_to_array(fname, box=None, bounds=None, dtype=None, step=1):
+    """
+    Read a subvolume of a cube file into numpy array
+
+    Only the lines holding the requested voxels are read: the reader
+    seeks to each x-plane of the subvolume and parses the rows it
+    covers, and skips the rest of the file. Compressed files cannot be
+    seeked cheaply and are streamed up to the last plane of the region.
+    With a step above 1 only every step-th plane is parsed, which gives
+    a sampled preview of a large file for a fraction of the read time.
+
+    Parameters
+    ----------
+    fname: filename of cube file
+    box: ((x0, x1), (y0, y1), (z0, z1)), optional
+        Half-open ranges of voxel indices along each axis.
+    bounds: ((xmin, xmax), (ymin, ymax), (zmin, zmax)), optional
+        Real-space bounding box in the units of the cube file (bohr).
+        It is converted to the smallest index box that holds it.
+    dtype: np.dtype, optional
+        Floating point type of the array, see cube_to_array.
+    step: int, optional
+        Keep every step-th voxel along each axis. Default is 1.
+
+    Returns
+    --------
+    (data: np.array, metadata: dict)
+        The metadata origin is moved to the first voxel of the subvolume
+        and the index box is stored under 'box'. With a step, the voxel
+        vectors are scaled by it and it is stored under 'step'.
+
+    """
+    from .store import CubeStore, is_store
+    if is_store(fname):
+        data, cube_details = CubeStore(fname).region(box=box, bounds=bounds)
+        if step > 1:
+            data, cube_details = data[::step, ::step, ::step], _stepped(cube_details, step)
+        return (data if dtype is None else data.astype(dtype, copy=False)), cube_details
+
+    if (box is None) == (bounds is None):
+        raise ValueError("Give exactly one of box or bounds")
+
+    with _open_cube(fname) as cube:
+        shape, cube_details = _read_header(cube)
+    if bounds is not None:
+        box = bounds_to_box(bounds, cube_details, shape)
+    box = tuple((max(int(lo), 0), min(int(hi), n)) for (lo, hi), n in zip(box, shape))
+    (x0, x1), (y0, y1), (z0, z1) = box
+    if x1 <= x0 or y1 <= y0 or z1 <= z0:
+        raise ValueError(f"Empty region {box} for grid of shape {shape}")
+
+    dtype = np.float64 if dtype is None else dtype
+    nx, ny, nz = shape
+    data = np.empty((len(range(x0, x1, step)), len(range(y0, y1, step)), len(range(z0, z1, step))), dtype=dtype)
+
+    if _compression(fname) is not None:
+        # Compressed streams cannot seek cheaply, stream the planes up to x1 instead
+        for x, slab in CubeSlabs(fname, dtype=dtype):
+            if x >= x1:
+                break
+            if x >= x0 and (x - x0) % step == 0:
+                data[(x - x0) // step] = slab[0, y0:y1:step, z0:z1:step]
+    else:
+        with open(fname, 'rb') as cube:
+            _read_header(cube)
+            index = _LineIndex(cube, shape)
+            for x in range(x0, x1, step):
+                first = (x * ny + y0) * nz
+                rows = index.read(cube, first, first + (y1 - y0) * nz, dtype)
+                data[(x - x0) // step] = rows.reshape(y1 - y0, nz)[::step, z0:z1:step]
+
+    cube_details = move_to_box(cube_details, box)
+    return data, (_stepped(cube_details, step) if step > 1 else cube_details)
+
+
+def move_to_box(cube_details, box):
+    """
+    Metadata of the subvolume of a grid in an index box.
+
+    Parameters
+    ----------
+    cube_details: dict
+        Metadata of the grid, as returned by cube_to_array.
+    box: ((x0, x1), (y0, y1), (z0, z1))
+        Half-open voxel index ranges.
+
+    Returns
+    --------
+    cube_details: dict
+        Copy of the metadata with the origin moved to the first voxel of
+        the box, which is stored under 'box'.
+
+    """
+    cube_details = dict(cube_details)
+    axes = np.array([cube_details['xvec'], cube_details['yvec'], cube_details['zvec']])
+    cube_details['org'] = (np.array(cube_details['org']) + np.array([lo for lo, hi in box]) @ axes).tolist()
+    cube_details['box'] = tuple(box)
+    return cube_details
+
+
+def _stepped(cube_details, step):
+    """Copy of the metadata for a grid sampled every step voxels, stored under 'step'."""
+    cube_details = dict(cube_details)
+    for name in ['xvec', 'yvec', 'zvec']:
+        cube_details[name] = (step * np.array(cube_details[name])).tolist()
+    cube_details['step'] = step
+    return cube_details
+
+
+def significant_box(data, threshold, pad=1):
+    """
+    Tight index box around the voxels whose magnitude reaches a threshold.
+
+    Parameters
+    ----------
+    data: np.array with shape (nx, ny, nz)
+    threshold: float
+        Voxels with abs(value) >= threshold are significant. Using the
+        smallest isovalue keeps every surface inside the box.
+    pad: int, optional
+        Voxels added on each side, clipped to the grid. Default is 1.
+
+    Returns
+    --------
+    box: ((x0, x1), (y0, y1), (z0, z1))
+        Half-open index ranges. The whole grid when no voxel is
+        significant.
+
+    """
+    mask = np.abs(data) >= threshold
+    if not mask.any():
+        return tuple((0, n) for n in data.shape)
+    box = []
+    for axis, n in enumerate(data.shape):
+        inside = np.flatnonzero(mask.any(axis=tuple(k for k in range(3) if k != axis)))
+        box.append((max(int(inside[0]) - pad, 0), min(int(inside[-1]) + 1 + pad, n)))
+    return tuple(box)
+
+
+def crop_to_significant(data, cube_details, threshold, pad=1):
+    """
+    Cut a grid down to the box around its significant voxels, see significant_box.
+
+    Psi4 pads its grids with several bohr of near zero values, which this
+    removes before surfaces are extracted or the grid is sent to plotly.
+
+    Returns
+    --------
+    (data: np.array, metadata: dict)
+        A view of the subvolume. The metadata origin is moved to its
+        first voxel and the index box is stored under 'box', as in
+        cube_region_to_array.
+
+    """
+    box = significant_box(data, threshold, pad)
+    return data[tuple(slice(lo, hi) for lo, hi in box)], move_to_box(cube_details, box)
+
+
+class CubeVolume():
+    """
+    Lazily loaded cube file.
+
+    Only the header is read when the object is created, and the byte
+    offset of the voxel block is recorded. The grid dimensions, origin,
+    voxel vectors and atoms are then available at once, while the voxel
+    values are parsed on the first access to ``data``.
+
+    Parameters
+    ----------
+    fname: filename of cube file
+    workers: int, optional
+        Number of threads used to parse the voxel block, see cube_to_array.
+    dtype: np.dtype, optional
+        Floating point type of the voxel array. Default is float64.
+
+    """
+    def __init__(self, fname, workers=1, dtype=np.float64):
+        self.fname = fname
+        self.workers = workers
+        self.dtype = np.dtype(dtype)
+        self._data = None
+        with _open_cube(fname) as cube:
+            self.shape, self.cube_details = _read_header(cube)
+            self.offset = cube.tell()
+
+    @property
+    def origin(self):
+        return np.array(self.cube_details['org'])
+
+    @property
+    def axes(self):
+        """Voxel vectors as the rows of a 3x3 array."""
+        return np.array([self.cube_details['xvec'], self.cube_details['yvec'], self.cube_details['zvec']])
+
+    @property
+    def atoms(self):
+        return self.cube_details['atoms']
+
+    @property
+    def loaded(self):
+        return self._data is not None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = _read_voxels(self.fname, self.offset, self.shape, self.workers, self.dtype)
+        return self._data
+
+    def slabs(self, thickness=1):
+        """Stream the voxel block as x-slabs, see CubeSlabs."""
+        return CubeSlabs(self.fname, thickness=thickness, dtype=self.dtype)
+
+    def region(self, box=None, bounds=None):
+        """Read a subvolume without parsing the whole file, see cube_region_to_array."""
+        return cube_region_to_array(self.fname, box=box, bounds=bounds, dtype=self.dtype)[0]
+
+
+class CubeSlabs():
+    """
+    Stream the voxel block of a cube file as consecutive x-slabs.
+
+    The header is read when the object is created, so ``shape`` and
+    ``cube_details`` are available before any voxel is parsed. Iterating
+    yields ``(x, slab)`` pairs, where ``slab`` holds the planes
+    ``x:x + thickness`` with shape ``(thickness, ny, nz)``; the last slab
+    may be thinner. Only one slab and one block of text are held in
+    memory at a time, so peak memory depends on the slab size and not
+    on the size of the grid.
+
+    Parameters
+    ----------
+    fname: filename of cube file
+    thickness: int, optional
+        Number of x-planes per slab. Default is 1.
+    dtype: np.dtype, optional
+        Floating point type of the slabs. Default is float64.
+    block: int, optional
+        Bytes of text read from the file at a time. Default is 1 MiB.
+
+    """
+    def __init__(self, fname, thickness=1, dtype=np.float64, block=2**20):
+        self.fname = fname
+        self.thickness = thickness
+        self.dtype = np.dtype(dtype)
+        self.block = block
+        with _open_cube(fname) as cube:
+            self.shape, self.cube_details = _read_header(cube)
+            self.offset = cube.tell()
+
+    def __len__(self):
+        return -(-self.shape[0] // self.thickness)
+
+    def __iter__(self):
+        nx, ny, nz = self.shape
+        pending = np.empty(0, dtype=self.dtype)
+
+        with _open_cube(self.fname) as cube:
+            cube.seek(self.offset)
+            for x in range(0, nx, self.thickness):
+                planes = min(self.thickness, nx - x)
+                slab = np.empty(planes * ny * nz, dtype=self.dtype)
+
+                filled = min(pending.size, slab.size)
+                slab[:filled] = pending[:filled]
+                pending = pending[filled:]
+
+                while filled < slab.size:
+                    text = cube.read(self.block) + cube.readline()
+                    if not text:
+                        raise ValueError(f"Expected {nx * ny * nz} voxel values, "
+                                         f"found {x * ny * nz + filled}")
+                    values = np.fromstring(text, dtype=self.dtype, sep=' ')
+                    count = min(values.size, slab.size - filled)
+                    slab[filled:filled + count] = values[:count]
+                    pending = values[count:]
+                    filled += count
+
+                yield x, slab.reshape(planes, ny, nz)
+
+
+def _format_header_value(value):
+    """Fixed six decimals like Psi4, or the shortest exact repr when that would lose digits."""
+    text = f"{value:10.6f}"
+    return text if float(text) == value else f"{value!r:>10s}"
+
+
+def _scientific(values, precision=5):
+    """
+    Text of values in %E format built from their digits with array arithmetic.
+
+    Parameters
+    ----------
+    values: np.array (n,)
+    precision: int, optional
+        Number of decimals, from 1 to 9. Default is 5.
+
+    Returns
+    --------
+    (text: np.array (n, precision + 8) of np.uint8, unsure: np.array (n,) of bool)
+        ASCII of each value formatted as ``%{precision + 7}.{precision}E``
+        followed by a space, and the values whose text has to come from
+        Python instead: not finite, with three exponent digits, or too
+        close to a rounding tie to be decided in floating point.
+
+    """
+    values = np.asarray(values, dtype=np.float64)
+    magnitude = np.abs(values)
+    finite = np.isfinite(values)
+    magnitude = np.where(finite, magnitude, 0.0)
+    low, high = 10.0 ** precision, 10.0 ** (precision + 1)
+
+    exponent = np.floor(np.log10(np.where(magnitude > 0, magnitude, 1.0))).astype(np.int64)
+    # Values too small or large for two exponent digits overflow here and are marked unsure below
+    with np.errstate(over="ignore", invalid="ignore"):
+        # log10 can be one off next to powers of ten, and rounding can carry into the next power
+        for _ in range(2):
+            scaled = magnitude * 10.0 ** (precision - exponent)
+            digits = np.rint(scaled)
+            exponent += (digits >= high).astype(np.int64) - ((digits < low) & (magnitude > 0)).astype(np.int64)
+        scaled = magnitude * 10.0 ** (precision - exponent)
+        digits = np.rint(scaled)
+        unsure = ~finite | (np.abs(exponent) > 99) | ~(np.abs(scaled - np.floor(scaled) - 0.5) >= high * 1e-12)
+    digits = np.where(unsure, low, digits).astype(np.int64)
+    exponent = np.where(unsure, 0, exponent)
+
+    text = np.empty((len(values), precision + 8), dtype=np.uint8)
+    text[:, 0] = np.where(np.signbit(values), ord('-'), ord(' '))
+    for column in range(precision + 2, 2, -1):
+        text[:, column] = ord('0') + digits % 10
+        digits //= 10
+    text[:, 1] = ord('0') + digits
+    text[:, 2] = ord('.')
+    text[:, precision + 3] = ord('E')
+    text[:, precision + 4] = np.where(exponent < 0, ord('-'), ord('+'))
+    text[:, precision + 5] = ord('0') + np.abs(exponent) // 10
+    text[:, precision + 6] = ord('0') + np.abs(exponent) % 10
+    text[:, precision + 7] = ord(' ')
+    return text, unsure
+
+
+def _write_lines(out, rows, precision):
+    """Write rows of voxel values as lines of fixed-width fields, with Python formatting only where needed."""
+    field = f"%{precision + 7}.{precision}E "
+    line = field * rows.shape[1] + "\n"
+    if not 1 <= precision <= 9:
+        out.write((line * len(rows)) % tuple(rows.ravel().tolist()))
+        return
+
+    text, unsure = _scientific(rows.ravel(), precision)
+    text = np.concatenate([text.reshape(len(rows), -1), np.full((len(rows), 1), ord('\n'), np.uint8)], axis=1)
+    start = 0
+    for row in np.flatnonzero(unsure.reshape(rows.shape).any(axis=1)):
+        out.write(text[start:row].tobytes().decode('ascii'))
+        out.write(line % tuple(rows[row].tolist()))
+        start = row + 1
+    out.write(text[start:].tobytes().decode('ascii'))
+
+
+def _write_voxels(out, blocks, precision=5, per_line=6):
+    """
+    Write voxel values six per line, formatting one block of lines at a time.
+
+    The text of all full lines of a block is built from the digits of
+    the values by array operations, see _scientific; values left over
+    from a partial line are carried to the next block.
+
+    """
+    field = f"%{precision + 7}.{precision}E "
+    pending = np.empty(0)
+    for block in blocks:
+        values = np.concatenate([pending, np.ravel(block)])
+        full = values.size - values.size % per_line
+        if full:
+            _write_lines(out, values[:full].reshape(-1, per_line), precision)
+        pending = values[full:]
+    if pending.size:
+        out.write((field * pending.size) % tuple(pending.tolist()) + "\n")
+
+
+def array_to_cube(fname, data, cube_details, comment=None, precision=5, block=2**16):
+    """
+    Write a numpy array to a cube file
+
+    The inverse of cube_to_array. Values are written in the Psi4 layout,
+    six per line in ``%.5E`` format, and the text of each block of values
+    is built by array operations instead of formatting them one at a
+    time. Reading the file back gives the same metadata.
+
+    Parameters
+    ----------
+    fname: filename of cube file. Names ending in .gz, .bz2 or .xz are compressed.
+    data: np.array with shape (nx, ny, nz), or CubeSlabs
+        Voxel values. A CubeSlabs is written slab by slab, so grids
+        larger than memory can be converted.
+    cube_details: dict
+        Metadata as returned by cube_to_array.
+    comment: str, optional
+        Text for the two comment lines at the top of the file.
+    precision: int, optional
+        Number of decimals of the voxel values. Default is 5.
+    block: int, optional
+        Number of values formatted at a time. Default is 65536.
+
+    """
+    nx, ny, nz = data.shape
+    if isinstance(data, np.ndarray):
+        flat = data.reshape(-1)
+        blocks = (flat[i:i + block] for i in range(0, flat.size, block))
+    else:
+        blocks = (slab for x, slab in data)
+
+    comments = (comment or "Psi4 Gaussian Cube File.\nWritten by blobs.").split("\n")
+    comments = (comments + [""])[:2]
+
+    header = [comments[0], comments[1]]
+    for n, key in [(len(cube_details['atoms']), 'org'), (nx, 'xvec'), (ny, 'yvec'), (nz, 'zvec')]:
+        header.append(f"{n:6d} " + " ".join(_format_header_value(v) for v in cube_details[key]))
+    for number, values in cube_details['atoms']:
+        header.append(f"{number:3d} " + " ".join(_format_header_value(v) for v in values))
+
+    for suffix, module in [(".gz", gzip), (".bz2", bz2), (".xz", lzma)]:
+        if str(fname).endswith(suffix):
+            out = module.open(fname, 'wt')
+            break
+    else:
+        out = open(fname, 'w')
+
+    with out:
+        out.write("\n".join(header) + "\n")
+        _write_voxels(out, blocks, precision)
 
 
 def calculate_distance(rA, rB):
@@ -0,0 +1,97 @@
+"""
+encoding.py
+Compact binary encoding of the arrays sent to the browser
+"""
+
+import base64
+
+import numpy as np
+
+
+def encode_array(values, dtype=None):
+    """
+    Base64 encoding of an array as little-endian typed array data.
+
+    The result has the {"dtype", "bdata"} layout plotly.js reads, so it
+    can be used in plotly figures as well as in the webgl backend.
+
+    Parameters
+    ----------
+    values: np.array
+    dtype: np.dtype, optional
+        Type to store the values as. Default is the type of values.
+
+    Returns
+    --------
+    encoded: dict
+        dtype, a numpy type code such as "f4" or "u2", and bdata.
+
+    """
+    values = np.asarray(values)
+    dtype = np.dtype(values.dtype if dtype is None else dtype).newbyteorder('<')
+    data = np.ascontiguousarray(values.ravel(), dtype=dtype)
+    return {"dtype": dtype.str[1:], "bdata": base64.b64encode(data.tobytes()).decode("ascii")}
+
+
+def decode_array(encoded):
+    """Array of an encode_array result, quantized ones included, see quantize."""
+    values = np.frombuffer(base64.b64decode(encoded["bdata"]), dtype=np.dtype('<' + encoded["dtype"]))
+    if "scale" in encoded:
+        width = len(encoded["scale"])
+        return (values.reshape(-1, width) * np.array(encoded["scale"]) + np.array(encoded["offset"])).ravel()
+    return values
+
+
+def index_dtype(nvertices):
+    """Smallest unsigned integer type able to index nvertices vertices, uint16 or uint32."""
+    return np.uint16 if nvertices <= 2**16 else np.uint32
+
+
+def compact_mesh(vertices, faces):
+    """Mesh with float32 vertices and uint16 or uint32 faces."""
+    vertices = np.asarray(vertices, dtype=np.float32)
+    return vertices, np.asarray(faces).astype(index_dtype(len(vertices)), copy=False)
+
+
+def quantize(points, max_error):
+    """
+    Store points as integers on a regular grid, within max_error of their values.
+
+    Every coordinate axis is mapped to the smallest number of steps of
+    at most 2 * max_error that span its range, so each decoded value is
+    at most max_error away from the original one. Points needing more
+    than 65536 steps along an axis cannot be quantized.
+
+    Parameters
+    ----------
+    points: np.array (n, 3)
+    max_error: float
+        Largest difference allowed between a point and its decoded value.
+
+    Returns
+    --------
+    encoded: dict
+        encode_array result of the uint8 or uint16 grid indices, with the
+        offset and scale of every axis. Decoded values are
+        index * scale + offset.
+
+    """
+    if max_error <= 0:
+        raise ValueError(f"Quantization needs a positive max_error, got {max_error}")
+    points = np.asarray(points, dtype=np.float64)
+    if points.ndim == 1:
+        points = points[:, None]
+    if len(points) == 0:
+        lo = hi = np.zeros(points.shape[1])
+    else:
+        lo, hi = points.min(axis=0), points.max(axis=0)
+    steps = np.ceil((hi - lo) / (2 * max_error)).astype(np.int64)
+    if steps.max(initial=0) >= 2**16:
+        raise ValueError(f"Points spanning {np.max(hi - lo):.6g} need more than 16 bits for max_error {max_error}")
+
+    scale = np.where(steps > 0, (hi - lo) / np.maximum(steps, 1), 1.0)
+    dtype = np.uint8 if steps.max(initial=0) < 2**8 else np.uint16
+    indices = np.rint((points - lo) / scale).astype(dtype)
+    encoded = encode_array(indices)
+    encoded.update(offset=lo.tolist(), scale=scale.tolist())
+    return encoded
@@ -23,6 +23,7 @@ class Freq():
         self.info = self.get_info()
         self.bonds = None
         self.norm = None
+        self.viewer = None
         
 
     def get_info(self):
@@ -51,139 +52,64 @@ class Freq():
             if j == "V":
                 vib_index.append(i)
         return vib_index
-    
+
+    def get_norm(self):
+        """Normal mode displacements of the vibrations, as (nvib, natom, 3)."""
+        modes = self.wfn.frequency_analysis['x'].dict()["data"][:, self.indices]
+        return modes.T.reshape(len(self.indices), len(self.geo), 3)
 
     def plot(self,
              size=1,
-             nframes = 8,
-             vib = 0, 
-            ):
+             nframes=8,
+             vib=0,
+             backend="plotly",
+             filename=None):
 
         atoms_colors = blobs.get_colors()
         bonds = build_bond_list(self.geo)   
         self.bonds = bonds    
         fms = []
-        norm_coord = self.wfn.frequency_analysis['x'].dict()["data"][:,self.indices].T.reshape(len(self.indices),len(self.geo),3)
+        norm_coord = self.get_norm()
         self.norm = norm_coord
-                       
+        colors = [atoms_colors[sym][0] for sym in self.sym]
+
+        if backend != "plotly":
+            # One back and forth swing, which the backend loops over
+            scene = blobs.Scene(size, title=F"Frequency: {self.frequencies[vib].real:.2f} 1/cm")
+            scene.add_atoms(self.geo + norm_coord[vib] / nframes, colors, self.info["size"] * size)
+            scene.add_bonds(bonds, width=7 * size)
+            swing = [self.geo + norm_coord[vib] / (nframes - frame) for frame in range(nframes - 1)]
+            for positions in swing + swing[::-1]:
+                scene.add_frame(positions)
+            blobs.get_backend(backend).show(scene, filename)
+            return
+
         for frame in range(nframes - 1):
-                      
-            data = [] 
-            data.append(go.Scatter3d(x=self.geo[:,0] + self.norm[vib][:,0]/(nframes - frame), 
-                                     y=self.geo[:,1] + self.norm[vib][:,1]/(nframes - frame), 
-                                     z=self.geo[:,2] + self.norm[vib][:,2]/(nframes - frame)))
-            fms.append(go.Frame(data=data))         
-
-            for i in range(1, len(bonds)):
-                
-                bond_color_1= atoms_colors[self.sym[bonds[i][0]]][0]
-                bond_color_2= atoms_colors[self.sym[bonds[i][1]]][0]
-
-                midx  = (self.geo[bonds[i][0]][0] + self.norm[vib][bonds[i][0],0]/(nframes - frame) + self.geo[bonds[i][1]][0] + self.norm[vib][bonds[i][1],0]/(nframes - frame)) / 2
-                midy  = (self.geo[bonds[i][0]][1] + self.norm[vib][bonds[i][0],1]/(nframes - frame) + self.geo[bonds[i][1]][1] + self.norm[vib][bonds[i][1],1]/(nframes - frame)) / 2
-                midz  = (self.geo[bonds[i][0]][2] + self.norm[vib][bonds[i][0],2]/(nframes - frame) + self.geo[bonds[i][1]][2] + self.norm[vib][bonds[i][1],2]/(nframes - frame)) / 2
-
-                bond_x_1 = [self.geo[:,0][bonds[i][0]] + self.norm[vib][bonds[i][0],0]/(nframes - frame), midx]
-                bond_y_1 = [self.geo[:,1][bonds[i][0]] + self.norm[vib][bonds[i][0],1]/(nframes - frame), midy]
-                bond_z_1 = [self.geo[:,2][bonds[i][0]] + self.norm[vib][bonds[i][0],2]/(nframes - frame), midz]
-
-                bond_x_2 = [self.geo[:,0][bonds[i][1]] + self.norm[vib][bonds[i][1],0]/(nframes - frame), midx]
-                bond_y_2 = [self.geo[:,1][bonds[i][1]] + self.norm[vib][bonds[i][1],1]/(nframes - frame), midy]
-                bond_z_2 = [self.geo[:,2][bonds[i][1]] + self.norm[vib][bonds[i][1],2]/(nframes - frame), midz]
-
-                data.append(go.Scatter3d(
-                            x=bond_x_1,
-                            y=bond_y_1,
-                            z=bond_z_1,
-                            mode="lines",
-                            line={
-                                "color": bond_color_1,
-                                "width": 7 * size
-                            },
-                        ))
-
-                data.append(go.Scatter3d(
-                            x=bond_x_2,
-                            y=bond_y_2,
-                            z=bond_z_2,
-                            mode="lines",
-                            line={
-                                "color": bond_color_2,
-                                "width": 7 * size
-                            },
-                        ))
+
+            positions = self.geo + self.norm[vib] / (nframes - frame)
+            points, _ = blobs.bond_lines(positions, bonds)
+            data = [go.Scatter3d(x=positions[:, 0], y=positions[:, 1], z=positions[:, 2]),
+                    go.Scatter3d(x=points[:, 0], y=points[:, 1], z=points[:, 2])]
+            fms.append(go.Frame(data=data, traces=[0, 1]))
 
         fms.reverse()
         fms_inv = fms.copy()
         fms.reverse()
 
-        data = [go.Scatter3d(x=self.geo[:,0] + norm_coord[vib][:,0]/nframes, 
-                            y=self.geo[:,1] + norm_coord[vib][:,1]/nframes, 
-                            z=self.geo[:,2] + norm_coord[vib][:,2]/nframes,
-                       mode='markers',
-                       marker={"showscale": False,
-                               "color": self.info["color"],
-                                "size": self.info["size"] * size / 1.0,
-                                "showscale": False,
-                                "opacity": 1.0,
-                                "line": {
-                                        "width": 2,
-                                        "color": "black"
-                                        }
-                                    })]
-
-        for i in range(len(bonds)):
-
-            midx  = (self.geo[bonds[i][0]][0] + self.norm[vib][bonds[i][0],0]/(nframes) + self.geo[bonds[i][1]][0] + self.norm[vib][bonds[i][1],0]/(frame)) / 2
-            midy  = (self.geo[bonds[i][0]][1] + self.norm[vib][bonds[i][0],1]/(nframes) + self.geo[bonds[i][1]][1] + self.norm[vib][bonds[i][1],1]/(frame)) / 2
-            midz  = (self.geo[bonds[i][0]][2] + self.norm[vib][bonds[i][0],2]/(nframes) + self.geo[bonds[i][1]][2] + self.norm[vib][bonds[i][1],2]/(frame)) / 2
-
-            bond_color_1= atoms_colors[self.sym[bonds[i][0]]][0]
-            bond_color_2= atoms_colors[self.sym[bonds[i][1]]][0]
-
-            bond_x_1 = [self.geo[:,0][bonds[i][0]] + self.norm[vib][bonds[i][0],0]/(frame), midx]
-            bond_y_1 = [self.geo[:,1][bonds[i][0]] + self.norm[vib][bonds[i][0],1]/(frame), midy]
-            bond_z_1 = [self.geo[:,2][bonds[i][0]] + self.norm[vib][bonds[i][0],2]/(frame), midz]
-
-            bond_x_2 = [self.geo[:,0][bonds[i][1]] + self.norm[vib][bonds[i][1],0]/(frame), midx]
-            bond_y_2 = [self.geo[:,1][bonds[i][1]] + self.norm[vib][bonds[i][1],1]/(frame), midy]
-            bond_z_2 = [self.geo[:,2][bonds[i][1]] + self.norm[vib][bonds[i][1],2]/(frame), midz]
-
-            # midx  = (self.geo[bonds[i][0]][0] + self.geo[bonds[i][1]][0]) / 2
-            # midy  = (self.geo[bonds[i][0]][1] + self.geo[bonds[i][1]][1]) / 2
-            # midz  = (self.geo[bonds[i][0]][2] + self.geo[bonds[i][1]][2]) / 2
-
-            # bond_color_1= atoms_colors[self.sym[bonds[i][0]]][0]
-            # bond_color_2= atoms_colors[self.sym[bonds[i][1]]][0]
-
-            # bond_x_1 = [self.geo[bonds[i][0]][0], midx]
-            # bond_y_1 = [self.geo[bonds[i][0]][1], midy]
-            # bond_z_1 = [self.geo[bonds[i][0]][2], midz]
-            # bond_x_2 = [self.geo[bonds[i][1]][0], midx]
-            # bond_y_2 = [self.geo[bonds[i][1]][1], midy]
-            # bond_z_2 = [self.geo[bonds[i][1]][2], midz]
-
-            data.append(go.Scatter3d(
-                        x=bond_x_1,
-                        y=bond_y_1,
-                        z=bond_z_1,
-                        mode="lines",
-                        line={
-                            "color": bond_color_1,
-                            "width": 7
-                        },
-                    ))
-
-            data.append(go.Scatter3d(
-                        x=bond_x_2,
-                        y=bond_y_2,
-                        z=bond_z_2,
-                        mode="lines",
-                        line={
-                            "color": bond_color_2,
-                            "width": 7
-                        },
-                    ))
+        positions = self.geo + norm_coord[vib] / nframes
+        data = [go.Scatter3d(x=positions[:, 0],
+                             y=positions[:, 1],
+                             z=positions[:, 2],
+                             mode='markers',
+                             marker={"showscale": False,
+                                     "color": self.info["color"],
+                                     "size": self.info["size"] * size / 1.0,
+                                     "opacity": 1.0,
+                                     "line": {
+                                         "width": 2,
+                                         "color": "black"
+                                     }}),
+                blobs.bond_trace(positions, bonds, colors, width=7 * size)]
           
         fig = go.Figure(data=data, 
             
@@ -210,6 +136,33 @@ class Freq():
 
         #layout = go.layout.Template(layout=go.Layout(title_font=dict(family="Rockwell", size=24)))
 
+        self._layout(fig, size)
+
+        if filename is not None:
+            fig.write_html(filename)
+        else:
+            fig.show(config={'scrollZoom': False})
+
+    def view(self, vib=0, size=1, amplitude=0.5):
+        """
+        Show a normal mode in one persistent FreqViewer.
+
+        The first call creates and displays the figure widget, later calls
+        only move the atoms and bonds to the new mode.
+
+        Returns
+        --------
+        viewer: FreqViewer
+
+        """
+        if self.viewer is None:
+            from IPython.display import display
+            self.viewer = blobs.FreqViewer(self, size, amplitude)
+            display(self.viewer.figure)
+        return self.viewer.update(vib, amplitude)
+
+    def _layout(self, fig, size=1):
+        """Scene layout of the vibration plots, with axes fitted around the molecule."""
         fig.update_layout(scene_xaxis_showticklabels=False,
                           scene_yaxis_showticklabels=False,
                           scene_zaxis_showticklabels=False,
@@ -256,8 +209,6 @@ class Freq():
                               }
                           })
 
-        fig.show(config={'scrollZoom': False})
-
 
 
 def calculate_distance(rA, rB):
@@ -0,0 +1,257 @@
+"""
+isosurface.py
+Vectorized marching cubes extraction of isosurfaces from cube grids
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Corner c of a cell sits at offset (c & 1, c >> 1 & 1, c >> 2 & 1)
+_CORNERS = np.array([[c & 1, c >> 1 & 1, c >> 2 & 1] for c in range(8)])
+
+# Cell edges as pairs of corners that differ along one axis
+_EDGES = [(a, a | 1 << axis) for axis in range(3) for a in range(8) if not a & 1 << axis]
+_EDGE_AXIS = np.array([(b ^ a).bit_length() - 1 for a, b in _EDGES])
+_EDGE_BASE = _CORNERS[[a for a, b in _EDGES]]
+
+
+def _faces():
+    """The six faces of a cell, each as its four corners in cyclic order."""
+    faces = []
+    for axis in range(3):
+        u, v = [k for k in range(3) if k != axis]
+        for side in range(2):
+            cycle = [(0, 0), (1, 0), (1, 1), (0, 1)]
+            faces.append([side << axis | du << u | dv << v for du, dv in cycle])
+    return faces
+
+
+def _case_triangles(case):
+    """
+    Triangles of one marching cubes case, as triples of cell edges.
+
+    The crossed edges on every face are joined into segments. On faces
+    with four crossed edges, each inside corner is cut off on its own, a
+    rule that only depends on the face, so neighbouring cells agree and
+    the surface is closed. The segments form loops that are oriented so
+    their normal points towards lower values, and are triangulated as
+    fans.
+
+    """
+    inside = [case >> c & 1 for c in range(8)]
+    edge_index = {edge: e for e, edge in enumerate(_EDGES)}
+    links = {}
+
+    for corners in _faces():
+        edges = [tuple(sorted((corners[i], corners[(i + 1) % 4]))) for i in range(4)]
+        crossed = [i for i in range(4) if inside[edges[i][0]] != inside[edges[i][1]]]
+        if len(crossed) == 2:
+            pairs = [crossed]
+        elif len(crossed) == 4:
+            pairs = [((i - 1) % 4, i) for i in range(4) if inside[corners[i]]]
+        else:
+            pairs = []
+        for i, j in pairs:
+            a, b = edge_index[edges[i]], edge_index[edges[j]]
+            links.setdefault(a, []).append(b)
+            links.setdefault(b, []).append(a)
+
+    triangles = []
+    while links:
+        loop = [next(iter(links))]
+        previous = None
+        while True:
+            options = [e for e in links[loop[-1]] if e != previous] or links[loop[-1]]
+            previous, following = loop[-1], options[0]
+            if following == loop[0]:
+                break
+            loop.append(following)
+        for e in loop:
+            del links[e]
+
+        points = np.array([_CORNERS[a] + _CORNERS[b] for a, b in (_EDGES[e] for e in loop)]) / 2.0
+        normal = np.cross(points - points.mean(axis=0), np.roll(points, -1, axis=0) - points.mean(axis=0)).sum(axis=0)
+        outward = sum((_CORNERS[b] - _CORNERS[a]) * (1 if inside[a] else -1) for a, b in (_EDGES[e] for e in loop))
+        if np.dot(normal, outward) < 0:
+            loop.reverse()
+        triangles += [(loop[0], loop[i], loop[i + 1]) for i in range(1, len(loop) - 1)]
+
+    return triangles
+
+
+def _build_tables():
+    cases = [_case_triangles(case) for case in range(256)]
+    counts = np.array([len(triangles) for triangles in cases])
+    table = np.zeros((256, counts.max(), 3), dtype=np.int64)
+    for case, triangles in enumerate(cases):
+        if triangles:
+            table[case, :len(triangles)] = triangles
+    return table, counts
+
+
+_TRI_TABLE, _TRI_COUNT = _build_tables()
+
+
+def _shifted(array, axis, shift):
+    """View of array without its last (shift=0) or first (shift=1) plane along axis."""
+    index = [slice(None)] * 3
+    index[axis] = slice(shift, array.shape[axis] - 1 + shift)
+    return array[tuple(index)]
+
+
+def _place(vertices, origin, axes):
+    """Move vertices from voxel index units to the frame given by origin and voxel vectors."""
+    if origin is None and axes is None:
+        return vertices
+    origin = np.zeros(3) if origin is None else np.asarray(origin, dtype=np.float64)
+    axes = np.eye(3) if axes is None else np.asarray(axes, dtype=np.float64)
+    return origin + vertices @ axes
+
+
+def isosurfaces(data, levels, origin=None, axes=None, workers=1):
+    """
+    Extract the isosurfaces of a grid at several levels in one pass.
+
+    The grid is swept once to find, for every voxel, how many levels lie
+    below its value. Grid edges and cells whose corners fall in different
+    bands are collected in the same sweep, and each level then only
+    triangulates the cells and edges it crosses. Positive and negative
+    lobes of an orbital, or nested density levels, therefore cost one
+    traversal of the grid.
+
+    Parameters
+    ----------
+    data: np.array with shape (nx, ny, nz)
+    levels: list<float>
+        Isovalues, in any order and of any sign.
+    origin: np.array, optional
+        Position of the first voxel. Vertices are in voxel index units
+        unless origin and axes are given.
+    axes: np.array, optional
+        Voxel vectors as the rows of a 3x3 array.
+    workers: int, optional
+        Number of threads triangulating levels at the same time, None
+        uses one per CPU. The sweep of the grid is shared. Default is 1.
+
+    Returns
+    --------
+    meshes: list<(vertices: np.array (n, 3), faces: np.array (m, 3))>, one per level
+        Triangles are wound so that their normals point away from the
+        lobe they enclose: towards lower values for positive levels and
+        towards higher values for negative ones.
+
+    """
+    data = np.asarray(data)
+    levels = np.atleast_1d(np.asarray(levels, dtype=np.float64))
+    order = np.argsort(levels)
+    nx, ny, nz = data.shape
+
+    # Number of levels below each voxel: the voxel is above level l when band > l
+    band = np.searchsorted(levels[order], data, side='left').astype(np.min_scalar_type(len(levels)))
+
+    # Grid edges whose ends fall in different bands, sorted by edge id
+    edges = []
+    for axis in range(3):
+        low_band, high_band = _shifted(band, axis, 0), _shifted(band, axis, 1)
+        i, j, k = np.nonzero(low_band != high_band)
+        a, b = low_band[i, j, k], high_band[i, j, k]
+        edges.append({
+            "axis": axis,
+            "index": np.stack([i, j, k], axis=1),
+            "id": axis * data.size + (i * ny + j) * nz + k,
+            "low": _shifted(data, axis, 0)[i, j, k],
+            "high": _shifted(data, axis, 1)[i, j, k],
+            "min": np.minimum(a, b),
+            "max": np.maximum(a, b),
+        })
+
+    # Cells whose corners fall in different bands, with the band of every corner
+    cell_shape = (nx - 1, ny - 1, nz - 1)
+    corners = [band[di:nx - 1 + di, dj:ny - 1 + dj, dk:nz - 1 + dk] for di, dj, dk in _CORNERS]
+    cell_min = np.minimum.reduce(corners)
+    cell_max = np.maximum.reduce(corners)
+    cells = np.flatnonzero(cell_min != cell_max)
+    cell_min, cell_max = cell_min.ravel()[cells], cell_max.ravel()[cells]
+    corner_band = np.stack([corner.ravel()[cells] for corner in corners], axis=1)
+    del corners
+
+    def triangulate(rank):
+        iso = levels[order[rank]]
+
+        edge_ids = []
+        vertices = []
+        for edge in edges:
+            crossed = (edge["min"] <= rank) & (rank < edge["max"])
+            points = edge["index"][crossed].astype(np.float64)
+            low, high = edge["low"][crossed], edge["high"][crossed]
+            points[:, edge["axis"]] += (iso - low) / (high - low)
+            edge_ids.append(edge["id"][crossed])
+            vertices.append(points)
+        edge_ids = np.concatenate(edge_ids)
+        vertices = np.concatenate(vertices)
+
+        active = (cell_min <= rank) & (rank < cell_max)
+        case = np.zeros(active.sum(), dtype=np.uint8)
+        for c in range(8):
+            case |= (corner_band[active, c] > rank).astype(np.uint8) << np.uint8(c)
+
+        counts = _TRI_COUNT[case]
+        case_cells = np.repeat(np.arange(case.size), counts)
+        nth = np.arange(case_cells.size) - np.repeat(np.cumsum(counts) - counts, counts)
+        triangle_edges = _TRI_TABLE[case[case_cells], nth]
+
+        ci, cj, ck = np.unravel_index(cells[active][case_cells], cell_shape)
+        base = _EDGE_BASE[triangle_edges]
+        ids = (_EDGE_AXIS[triangle_edges] * data.size
+               + ((ci[:, None] + base[..., 0]) * ny + cj[:, None] + base[..., 1]) * nz
+               + ck[:, None] + base[..., 2])
+        faces = np.searchsorted(edge_ids, ids)
+        if iso < 0:
+            # Negative lobes lie below their level, turn their normals outwards too
+            faces = faces[:, [0, 2, 1]]
+
+        return _place(vertices, origin, axes), faces
+
+    if workers == 1 or len(levels) == 1:
+        by_rank = [triangulate(rank) for rank in range(len(levels))]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            by_rank = list(executor.map(triangulate, range(len(levels))))
+
+    meshes = [None] * len(levels)
+    for rank, level in enumerate(order):
+        meshes[level] = by_rank[rank]
+    return meshes
+
+
+def marching_cubes(data, iso, origin=None, axes=None):
+    """
+    Extract the isosurface of a grid as a triangle mesh.
+
+    Every step works on whole arrays: the case of each cell is built from
+    shifted views of the grid, the crossing point of each grid edge is
+    interpolated once, and the triangles of all cells are looked up in a
+    precomputed case table. Cells share their crossing points, so the
+    mesh has no duplicated vertices. See isosurfaces to extract several
+    levels at once.
+
+    Parameters
+    ----------
+    data: np.array with shape (nx, ny, nz)
+    iso: float
+        Isovalue. Cells with values on both sides of iso are triangulated.
+    origin: np.array, optional
+        Position of the first voxel. Vertices are in voxel index units
+        unless origin and axes are given.
+    axes: np.array, optional
+        Voxel vectors as the rows of a 3x3 array.
+
+    Returns
+    --------
+    (vertices: np.array (n, 3), faces: np.array (m, 3))
+        Triangles are wound so that their normals point away from the
+        lobe they enclose, see isosurfaces.
+
+    """
+    return isosurfaces(data, [iso], origin=origin, axes=axes)[0]
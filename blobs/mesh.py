@@ -0,0 +1,378 @@
+"""
+mesh.py
+Post-processing of isosurface meshes: decimation, smoothing, normals and export
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def _edges(faces):
+    """Unique undirected edges of a triangle mesh and the number of faces sharing each."""
+    edges = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])
+    edges.sort(axis=1)
+    stride = int(edges.max()) + 1 if len(edges) else 1
+    keys, counts = np.unique(edges[:, 0] * stride + edges[:, 1], return_counts=True)
+    return np.stack([keys // stride, keys % stride], axis=1), counts
+
+
+def _boundary_vertices(faces, nvertices):
+    """Mask of the vertices on edges that belong to a single face."""
+    edges, counts = _edges(faces)
+    boundary = np.zeros(nvertices, dtype=bool)
+    boundary[edges[counts == 1].ravel()] = True
+    return boundary
+
+
+def _neighbour_mean(vertices, edges, degree):
+    """Mean position of the neighbours of every vertex."""
+    src = np.concatenate([edges[:, 0], edges[:, 1]])
+    dst = np.concatenate([edges[:, 1], edges[:, 0]])
+    total = np.stack([np.bincount(src, weights=vertices[dst, c], minlength=len(vertices)) for c in range(3)],
+                     axis=1)
+    return total / np.maximum(degree, 1)[:, None]
+
+
+def face_normals(vertices, faces):
+    """Unnormalized face normals, with a length of twice the face area."""
+    v0, v1, v2 = vertices[faces[:, 0]], vertices[faces[:, 1]], vertices[faces[:, 2]]
+    return np.cross(v1 - v0, v2 - v0)
+
+
+def vertex_normals(vertices, faces):
+    """
+    Unit normals at the vertices of a triangle mesh.
+
+    Each vertex normal is the area weighted mean of the normals of the
+    faces around it.
+
+    Parameters
+    ----------
+    vertices: np.array (n, 3)
+    faces: np.array (m, 3)
+
+    Returns
+    --------
+    normals: np.array (n, 3)
+
+    """
+    normals = face_normals(vertices, faces)
+    total = np.stack([np.bincount(faces.ravel(), weights=np.repeat(normals[:, c], 3), minlength=len(vertices))
+                      for c in range(3)], axis=1)
+    length = np.linalg.norm(total, axis=1, keepdims=True)
+    return total / np.where(length > 0, length, 1.0)
+
+
+def smooth(vertices, faces, iterations=10, method="taubin", lamb=0.5, mu=-0.53):
+    """
+    Smooth a triangle mesh by moving vertices towards their neighbours.
+
+    Every step is one array operation over all vertices. Laplacian
+    smoothing shrinks closed surfaces, Taubin smoothing alternates a
+    shrinking and an inflating step to keep their volume. Vertices on
+    open boundaries stay in place.
+
+    Parameters
+    ----------
+    vertices: np.array (n, 3)
+    faces: np.array (m, 3)
+    iterations: int, optional
+        Number of smoothing steps. Default is 10.
+    method: str, optional
+        "taubin" or "laplacian". Default is "taubin".
+    lamb: float, optional
+        Weight of the shrinking step. Default is 0.5.
+    mu: float, optional
+        Weight of the inflating Taubin step. Default is -0.53.
+
+    Returns
+    --------
+    vertices: np.array (n, 3)
+
+    """
+    if method not in ("taubin", "laplacian"):
+        raise ValueError(f"Unknown smoothing method {method!r}, use 'taubin' or 'laplacian'")
+
+    vertices = np.array(vertices, dtype=np.float64)
+    edges, counts = _edges(faces)
+    degree = np.bincount(edges.ravel(), minlength=len(vertices))
+    free = ~_boundary_vertices(faces, len(vertices))
+
+    steps = [lamb, mu] if method == "taubin" else [lamb]
+    for i in range(iterations):
+        for factor in steps:
+            move = _neighbour_mean(vertices, edges, degree) - vertices
+            vertices[free] += factor * move[free]
+    return vertices
+
+
+def postprocess_meshes(meshes, simplify=None, smoothing=0, workers=1):
+    """
+    Decimate and smooth meshes with the settings of Cube.plot.
+
+    Parameters
+    ----------
+    meshes: list<(vertices: np.array (n, 3), faces: np.array (m, 3))>
+    simplify: int or float, optional
+        Target of decimate: a number of faces, or a fraction of them.
+        Default is None, no decimation.
+    smoothing: int, optional
+        Number of smooth iterations. Default is 0.
+    workers: int, optional
+        Number of threads processing meshes at the same time, None uses
+        one per CPU. Default is 1.
+
+    Returns
+    --------
+    meshes: list<(vertices: np.array, faces: np.array)>
+
+    """
+    def process(mesh):
+        vertices, faces = mesh
+        if simplify is not None and len(faces):
+            vertices, faces = decimate(vertices, faces, target=simplify)
+        if smoothing:
+            vertices = smooth(vertices, faces, iterations=smoothing)
+        return vertices, faces
+
+    if workers == 1 or (simplify is None and not smoothing):
+        return [process(mesh) for mesh in meshes]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(process, meshes))
+
+
+def _quadrics(vertices, faces):
+    """Sum of the squared distance quadrics of the faces around every vertex, as (n, 4, 4)."""
+    normals = face_normals(vertices, faces)
+    length = np.linalg.norm(normals, axis=1, keepdims=True)
+    normals = normals / np.where(length > 0, length, 1.0)
+    planes = np.concatenate([normals, -np.einsum('ij,ij->i', normals, vertices[faces[:, 0]])[:, None]], axis=1)
+    face_quadrics = (planes[:, :, None] * planes[:, None, :]).reshape(-1, 16)
+    quadrics = np.stack([np.bincount(faces.ravel(), weights=np.repeat(face_quadrics[:, c], 3),
+                                     minlength=len(vertices)) for c in range(16)], axis=1)
+    return quadrics.reshape(-1, 4, 4)
+
+
+def _collapse_targets(quadrics, vertices, a, b):
+    """Position minimizing the quadric error of each edge collapse, and that error."""
+    q = quadrics[a] + quadrics[b]
+    A, linear, constant = q[:, :3, :3], q[:, :3, 3], q[:, 3, 3]
+    candidates = [vertices[a], vertices[b], (vertices[a] + vertices[b]) / 2]
+
+    # Solve A x = -linear in closed form, the columns of the inverse of A are cross products of its rows
+    columns = np.stack([np.cross(A[:, 1], A[:, 2]), np.cross(A[:, 2], A[:, 0]), np.cross(A[:, 0], A[:, 1])], axis=2)
+    det = np.einsum('ij,ij->i', A[:, 0], columns[:, :, 0])
+    solvable = np.abs(det) > 1e-12
+    optimum = candidates[2].copy()
+    optimum[solvable] = -np.einsum('ijk,ik->ij', columns[solvable], linear[solvable]) / det[solvable, None]
+    candidates.append(optimum)
+
+    errors = np.array([np.einsum('ij,ijk,ik->i', position, A, position) + 2 * np.einsum('ij,ij->i', linear, position)
+                       + constant for position in candidates])
+    best = errors.argmin(axis=0)
+    positions = np.array(candidates)[best, np.arange(len(a))]
+    return positions, np.maximum(errors[best, np.arange(len(a))], 0)
+
+
+def _independent(a, b, rank, edges, nvertices):
+    """
+    Candidate edges (a, b) that are the cheapest candidate touching their end points or
+    any neighbour of them, so no two of them share a vertex or a triangle. rank orders
+    the candidates by cost, without ties.
+    """
+    first = np.full(nvertices, np.iinfo(np.int64).max)
+    np.minimum.at(first, a, rank)
+    np.minimum.at(first, b, rank)
+    ring = first.copy()
+    np.minimum.at(ring, edges[:, 0], first[edges[:, 1]])
+    np.minimum.at(ring, edges[:, 1], first[edges[:, 0]])
+    return np.flatnonzero((ring[a] == rank) & (ring[b] == rank))
+
+
+def _neighbour_keys(edges, nvertices):
+    """Sorted keys source * nvertices + neighbour of both directions of unique edges."""
+    return np.sort(np.concatenate([edges[:, 0] * nvertices + edges[:, 1], edges[:, 1] * nvertices + edges[:, 0]]))
+
+
+def _keeps_manifold(keys, a, b, nvertices):
+    """True for the edges (a, b) whose end points share exactly two neighbours, with keys of _neighbour_keys."""
+    src = keys // nvertices
+    start = np.searchsorted(src, a)
+    count = np.searchsorted(src, a, side='right') - start
+    owner = np.repeat(np.arange(len(a)), count)
+    neighbour = keys[np.repeat(start, count) + np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)]
+    neighbour = neighbour % nvertices
+    wanted = b[owner] * nvertices + neighbour
+    found = keys[np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)] == wanted
+    return np.bincount(owner[found], minlength=len(a)) == 2
+
+
+def _flips(vertices, faces, order, a, b, positions):
+    """
+    True for the collapses of (a, b) into positions that would flip a triangle around a or b.
+    order sorts the corners of faces.ravel() by vertex.
+    """
+    sorted_corners = faces.ravel()[order]
+
+    owners, around = [], []
+    for end in (a, b):
+        start = np.searchsorted(sorted_corners, end)
+        count = np.searchsorted(sorted_corners, end, side='right') - start
+        owners.append(np.repeat(np.arange(len(end)), count))
+        offsets = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+        around.append(order[np.repeat(start, count) + offsets] // 3)
+    owner = np.concatenate(owners)
+    triangles = faces[np.concatenate(around)]
+
+    ends = (triangles == a[owner, None]) | (triangles == b[owner, None])
+    before = vertices[triangles]
+    after = np.where(ends[..., None], positions[owner, None, :], before)
+    normal_before = np.cross(before[:, 1] - before[:, 0], before[:, 2] - before[:, 0])
+    normal_after = np.cross(after[:, 1] - after[:, 0], after[:, 2] - after[:, 0])
+    flipped = (np.einsum('ij,ij->i', normal_before, normal_after) <= 0) & (ends.sum(axis=1) < 2) \
+        & normal_before.any(axis=1)
+    return np.bincount(owner[flipped], minlength=len(a)) > 0
+
+
+def decimate(vertices, faces, target=None, max_error=None, max_passes=100):
+    """
+    Reduce the number of triangles of a mesh by quadric error edge collapses.
+
+    Each pass scores the edges with the quadric error of collapsing them,
+    picks a set of cheap edges that share no triangle, and collapses them
+    all at once with array operations. Only the edges at the vertices
+    moved by a pass are scored again in the next one. Collapses that
+    would make the surface non-manifold or flip a triangle are skipped,
+    and vertices on open boundaries are kept. Passes repeat until the
+    target count or the error bound is reached.
+
+    Parameters
+    ----------
+    vertices: np.array (n, 3)
+    faces: np.array (m, 3)
+    target: int or float, optional
+        Number of triangles to keep, or a fraction of the current number
+        when below 1.
+    max_error: float, optional
+        Bound, in the units of vertices, on the distance from a collapsed
+        vertex to the plane of every original triangle merged into it.
+        The quadric error of a collapse is the sum of the squared
+        distances to these planes, and collapses whose error exceeds
+        max_error**2 are skipped.
+    max_passes: int, optional
+        Upper bound on the number of passes. Default is 100.
+
+    Returns
+    --------
+    (vertices: np.array (k, 3), faces: np.array (l, 3))
+
+    """
+    if target is None and max_error is None:
+        raise ValueError("Give a target triangle count or a max_error")
+
+    vertices = np.array(vertices, dtype=np.float64)
+    faces = np.array(faces, dtype=np.int64)
+    if target is not None and target < 1:
+        target = int(target * len(faces))
+    target = 0 if target is None else int(target)
+    limit = np.inf if max_error is None else max_error ** 2
+
+    quadrics = _quadrics(vertices, faces)
+    frozen = _boundary_vertices(faces, len(vertices))
+    moved = np.ones(len(vertices), dtype=bool)
+    scored = (np.empty(0, dtype=np.int64), np.empty((0, 3)), np.empty(0))
+
+    for i in range(max_passes):
+        if len(faces) <= target:
+            break
+
+        edges, counts = _edges(faces)
+        free = edges[~(frozen[edges[:, 0]] | frozen[edges[:, 1]])]
+        a, b = free[:, 0], free[:, 1]
+
+        # Only edges at the vertices moved by the last pass change, the others keep their score.
+        # Edges come sorted, and an edge between unmoved vertices was scored in the last pass.
+        keys = a * len(vertices) + b
+        stale = moved[a] | moved[b]
+        positions, cost = np.empty((len(a), 3)), np.empty(len(a))
+        positions[stale], cost[stale] = _collapse_targets(quadrics, vertices, a[stale], b[stale])
+        known = np.searchsorted(scored[0], keys[~stale])
+        positions[~stale], cost[~stale] = scored[1][known], scored[2][known]
+        scored = (keys, positions, cost)
+
+        keep = cost <= limit
+        a, b, positions, cost = a[keep], b[keep], positions[keep], cost[keep]
+        if len(a) == 0:
+            break
+
+        # Grow a set of cheap collapses that share no triangle, checking only the picked
+        # edges for non-manifold results and flipped triangles
+        need = max((len(faces) - target) // 2, 1)
+        keys = _neighbour_keys(edges, len(vertices))
+        rank = np.empty(len(cost), dtype=np.int64)
+        rank[np.argsort(cost, kind='stable')] = np.arange(len(cost))
+        order = np.argsort(faces.ravel(), kind='stable')
+        available = np.ones(len(a), dtype=bool)
+        near = np.zeros(len(vertices), dtype=bool)
+        chosen = []
+        for attempt in range(8):
+            candidates = np.flatnonzero(available & ~near[a] & ~near[b])
+            if len(candidates) == 0 or sum(len(c) for c in chosen) >= need:
+                break
+            picked = candidates[_independent(a[candidates], b[candidates], rank[candidates], edges, len(vertices))]
+            valid = _keeps_manifold(keys, a[picked], b[picked], len(vertices)) \
+                & ~_flips(vertices, faces, order, a[picked], b[picked], positions[picked])
+            available[picked[~valid]] = False
+            picked = picked[valid]
+            chosen.append(picked)
+
+            ends = np.zeros(len(vertices), dtype=bool)
+            ends[a[picked]] = True
+            ends[b[picked]] = True
+            near |= ends
+            near[edges[ends[edges[:, 0]], 1]] = True
+            near[edges[ends[edges[:, 1]], 0]] = True
+
+        chosen = np.concatenate(chosen)
+        chosen = chosen[np.argsort(cost[chosen], kind='stable')][:need]
+        if len(chosen) == 0:
+            break
+
+        vertices[a[chosen]] = positions[chosen]
+        quadrics[a[chosen]] += quadrics[b[chosen]]
+        moved[:] = False
+        moved[a[chosen]] = True
+        remap = np.arange(len(vertices))
+        remap[b[chosen]] = a[chosen]
+        faces = remap[faces]
+        faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 2] != faces[:, 0])]
+
+    used = np.unique(faces)
+    remap = np.zeros(len(vertices), dtype=np.int64)
+    remap[used] = np.arange(len(used))
+    return vertices[used], remap[faces]
+
+
+def write_obj(fname, meshes, names=None, precision=6):
+    """
+    Write triangle meshes to a Wavefront OBJ file, one object per mesh.
+
+    Parameters
+    ----------
+    fname: filename of the OBJ file
+    meshes: list<(vertices: np.array (n, 3), faces: np.array (m, 3))>
+    names: list<str>, optional
+        Names of the objects. Default is mesh_0, mesh_1, ...
+    precision: int, optional
+        Number of decimals of the vertex coordinates. Default is 6.
+
+    """
+    names = [f"mesh_{i}" for i in range(len(meshes))] if names is None else names
+    first = 1
+    with open(fname, 'w') as out:
+        for (vertices, faces), name in zip(meshes, names):
+            out.write(f"o {name}\n")
+            np.savetxt(out, vertices, fmt=f"v %.{precision}f %.{precision}f %.{precision}f")
+            np.savetxt(out, np.asarray(faces, dtype=np.int64) + first, fmt="f %d %d %d")
+            first += len(vertices)
@@ -0,0 +1,223 @@
+"""
+progressive.py
+Coarse-to-fine rendering of isosurfaces into notebook figure widgets
+"""
+
+import asyncio
+import queue
+import threading
+
+import numpy as np
+
+from .cube import CubeSlabs, cube_region_to_array, crop_to_significant
+from .encoding import compact_mesh
+from .isosurface import isosurfaces
+from .pyramid import grid_shape
+
+
+def progressive_steps(shape, preview_voxels=2**16, final_step=1):
+    """
+    Sampling steps of the preview stages of a grid, coarsest first.
+
+    The first step is the smallest power of two whose sampled grid has
+    at most preview_voxels voxels, so the first surface costs about the
+    same whatever the size of the grid. Each following stage halves the
+    step, down to twice final_step. Grids that fit the budget at
+    final_step need no preview.
+
+    Parameters
+    ----------
+    shape: tuple<int>
+    preview_voxels: int, optional
+        Voxel budget of the first stage. Default is 2**16.
+    final_step: int, optional
+        Step of the final stage, which is not included. Default is 1.
+
+    Returns
+    --------
+    steps: list<int>
+
+    """
+    def voxels(step):
+        return np.prod([-(-n // step) for n in shape], dtype=np.float64)
+
+    if voxels(final_step) <= preview_voxels:
+        return []
+    step = 2 * final_step
+    while voxels(step) > preview_voxels and any(step < n for n in shape):
+        step *= 2
+    steps = []
+    while step > final_step:
+        steps.append(step)
+        step //= 2
+    return steps
+
+
+def sampled_isosurfaces(fname, levels, step, dtype=None, crop=None):
+    """
+    Isosurfaces of a cube file sampled every step voxels.
+
+    Only every step-th plane of the file is parsed, see
+    cube_region_to_array. Files whose voxel lines are not fixed width
+    cannot be seeked by line and are streamed instead, like compressed
+    ones. Vertices are returned in voxel index units of
+    the full grid, so surfaces of every step line up.
+
+    Parameters
+    ----------
+    fname: filename of cube file
+    levels: list<float>
+    step: int
+    dtype: np.dtype, optional
+    crop: float, optional
+        Threshold of crop_to_significant, applied to the sampled grid.
+
+    Returns
+    --------
+    meshes: list<(vertices: np.array (n, 3), faces: np.array (m, 3))>
+
+    """
+    box = tuple((0, n) for n in grid_shape(fname))
+    try:
+        data, cube_details = cube_region_to_array(fname, box=box, dtype=dtype, step=step)
+    except ValueError:
+        data, cube_details = _streamed_sample(fname, step, dtype)
+    offset = np.zeros(3)
+    if crop is not None:
+        data, cube_details = crop_to_significant(data, cube_details, crop)
+        offset = np.array([lo for lo, hi in cube_details['box']])
+    return [((vertices + offset) * step, faces) for vertices, faces in isosurfaces(data, levels)]
+
+
+def _streamed_sample(fname, step, dtype=None):
+    """Every step-th voxel of a cube file, parsing the whole voxel block plane by plane."""
+    slabs = CubeSlabs(fname, dtype=np.float64 if dtype is None else dtype)
+    data = np.empty(tuple(len(range(0, n, step)) for n in slabs.shape), dtype=slabs.dtype)
+    for x, slab in slabs:
+        if x % step == 0:
+            data[x // step] = slab[0, ::step, ::step]
+    return data, slabs.cube_details
+
+
+class ProgressiveRender():
+    """
+    Replace the mesh traces of a figure with finer surfaces as they are computed.
+
+    Stages run one after the other in a background thread. Each returns
+    one (vertices, faces) mesh per trace. Plotly figures are not thread
+    safe, so the worker never touches the figure: finished stages are
+    queued and displayed on the thread that created the render. In a
+    notebook, that thread runs the event loop of the IPython kernel, and
+    each stage is scheduled on it as soon as it finishes, so a
+    FigureWidget sharpens while the user looks at it. Without a running
+    event loop, finished stages are displayed by show_finished or wait.
+    Cancelling stops the render before the next stage starts or is
+    displayed; a stage already running is not interrupted, but its
+    result is dropped. Other results of a stage, such as the metadata of
+    the grid it read, reach the owner through on_display in the same way.
+
+    Parameters
+    ----------
+    figure: plotly figure, usually a go.FigureWidget
+    traces: list<int>
+        Indices of the Mesh3d traces in figure.data, one per mesh.
+    stages: list<callable>
+        Functions without arguments returning the list of meshes.
+    loop: asyncio event loop, optional
+        Loop of the thread owning the figure. Default is the loop running
+        in the thread creating the render, if any.
+    on_display: callable, optional
+        When given, stages return (meshes, result) and on_display(result)
+        is called on the thread owning the figure once the meshes of the
+        stage are displayed.
+
+    Attributes
+    ----------
+    stage: int
+        Number of stages displayed so far.
+    error: Exception or None
+        Exception raised by a stage, which ends the render.
+
+    """
+    def __init__(self, figure, traces, stages, loop=None, on_display=None):
+        self.figure = figure
+        self.traces = list(traces)
+        self.stages = list(stages)
+        self.on_display = on_display
+        self.stage = 0
+        self.error = None
+        if loop is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+        self._loop = loop
+        self._finished = queue.Queue()
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """Stop after the stage being computed, without displaying it."""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def done(self):
+        """True once every stage is displayed, the render is cancelled or a stage failed."""
+        return not self._thread.is_alive() and (self.stage == len(self.stages) or self.cancelled
+                                                or self.error is not None)
+
+    def wait(self, timeout=None):
+        """
+        Block until the render ends and display the stages it finished.
+
+        Call it from the thread owning the figure. Returns True if the
+        render ended within timeout.
+
+        """
+        self._thread.join(timeout)
+        self.show_finished()
+        return not self._thread.is_alive()
+
+    def show_finished(self):
+        """Display the stages finished since the last call. Call it from the thread owning the figure."""
+        while True:
+            try:
+                meshes, result = self._finished.get_nowait()
+            except queue.Empty:
+                return
+            if self.cancelled:
+                continue
+            with self.figure.batch_update():
+                for trace, (vertices, faces) in zip(self.traces, meshes):
+                    self.figure.data[trace].update(x=vertices[:, 0], y=vertices[:, 1], z=vertices[:, 2],
+                                                   i=faces[:, 0], j=faces[:, 1], k=faces[:, 2])
+            self.stage += 1
+            if self.on_display is not None:
+                self.on_display(result)
+
+    def _run(self):
+        for stage in self.stages:
+            if self.cancelled:
+                return
+            try:
+                meshes, result = stage() if self.on_display is not None else (stage(), None)
+            except Exception as error:
+                self.error = error
+                return
+            if self.cancelled:
+                return
+            self._finished.put(([compact_mesh(vertices, faces) for vertices, faces in meshes], result))
+            if self._loop is not None:
+                try:
+                    self._loop.call_soon_threadsafe(self.show_finished)
+                except RuntimeError:
+                    # The loop was closed, wait displays what is left
+                    pass
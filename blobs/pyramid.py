@@ -0,0 +1,158 @@
+"""
+pyramid.py
+Downsampled copies of cube grids for coarse previews
+"""
+
+import numpy as np
+
+from .cube import CubeSlabs
+
+_METHODS = ("mean", "maxabs")
+
+
+def downsample(data, factor=2, method="mean"):
+    """
+    Reduce a grid by a whole factor along every axis.
+
+    Each block of factor**3 voxels becomes one voxel. Grids whose shape
+    is not a multiple of factor are padded by repeating their last
+    planes.
+
+    Parameters
+    ----------
+    data: np.array with shape (nx, ny, nz)
+    factor: int, optional
+        Block size. Default is 2.
+    method: str, optional
+        "mean" averages the block, which suits densities. "maxabs" keeps
+        the value of largest magnitude with its sign, so the lobes of an
+        orbital do not fade out. Default is "mean".
+
+    Returns
+    --------
+    data: np.array with shape (ceil(nx / factor), ceil(ny / factor), ceil(nz / factor))
+
+    """
+    if method not in _METHODS:
+        raise ValueError(f"Unknown method {method!r}, use 'mean' or 'maxabs'")
+    data = np.asarray(data)
+    factor = int(factor)
+    if factor == 1:
+        return data.copy()
+
+    pad = [(0, -n % factor) for n in data.shape]
+    if any(after for before, after in pad):
+        data = np.pad(data, pad, mode='edge')
+    nx, ny, nz = (n // factor for n in data.shape)
+    blocks = data.reshape(nx, factor, ny, factor, nz, factor)
+
+    if method == "mean":
+        return blocks.mean(axis=(1, 3, 5), dtype=np.float64).astype(data.dtype)
+    blocks = blocks.transpose(0, 2, 4, 1, 3, 5).reshape(nx, ny, nz, -1)
+    largest = np.abs(blocks).argmax(axis=3)
+    return np.take_along_axis(blocks, largest[..., None], axis=3)[..., 0]
+
+
+def coarse_details(cube_details, level):
+    """Header metadata of the grid downsampled 2**level times, with each voxel at the centre of its block."""
+    factor = 2 ** level
+    axes = np.array([cube_details['xvec'], cube_details['yvec'], cube_details['zvec']])
+    cube_details = dict(cube_details)
+    cube_details['org'] = (np.array(cube_details['org']) + (factor - 1) / 2 * axes.sum(axis=0)).tolist()
+    for name, vector in zip(['xvec', 'yvec', 'zvec'], axes):
+        cube_details[name] = (factor * vector).tolist()
+    return cube_details
+
+
+def to_full_grid(vertices, level):
+    """Move points from voxel index units of pyramid level to those of the full grid."""
+    factor = 2 ** level
+    return vertices * factor + (factor - 1) / 2
+
+
+def _slabs(fname, thickness, dtype=None):
+    """Shape, header metadata and an iterator of (x, slab) for a cube file or a container."""
+    from .store import CubeStore, is_store
+    if is_store(fname):
+        store = CubeStore(fname)
+        dtype = store.dtype if dtype is None else dtype
+        slabs = ((x, store[x:x + thickness].astype(dtype, copy=False)) for x in range(0, store.shape[0], thickness))
+        return store.shape, store.cube_details, slabs
+
+    slabs = CubeSlabs(fname, thickness=thickness, dtype=np.float64 if dtype is None else dtype)
+    return slabs.shape, slabs.cube_details, iter(slabs)
+
+
+def grid_shape(fname):
+    """Shape of the grid of a cube file or a container, read from its header only."""
+    from .store import CubeStore, is_store
+    if is_store(fname):
+        return CubeStore(fname).shape
+    return CubeSlabs(fname).shape
+
+
+def build_pyramid(fname, levels=3, method="mean", dtype=None):
+    """
+    Downsample a cube file 2, 4, ... 2**levels times in one streaming pass.
+
+    The file is read in slabs 2**levels planes thick, and every level is
+    built from each slab before the next is parsed, so the full grid is
+    never in memory.
+
+    Parameters
+    ----------
+    fname: filename of cube file, plain, compressed or a container
+    levels: int or list<int>, optional
+        Deepest level, or the list of levels to build. Default is 3.
+    method: str, optional
+        "mean" or "maxabs", see downsample. Default is "mean".
+    dtype: np.dtype, optional
+        Floating point type of the grids, see cube_to_array.
+
+    Returns
+    --------
+    pyramid: dict<int, (data: np.array, metadata: dict)>
+
+    """
+    if method not in _METHODS:
+        raise ValueError(f"Unknown method {method!r}, use 'mean' or 'maxabs'")
+    levels = sorted(set(range(1, levels + 1) if np.isscalar(levels) else levels))
+    if not levels or levels[0] < 1:
+        raise ValueError(f"Pyramid levels must be 1 or more, got {levels}")
+
+    thickness = 2 ** levels[-1]
+    shape, cube_details, slabs = _slabs(fname, thickness, dtype)
+    grids = {}
+    for x, slab in slabs:
+        for level in levels:
+            coarse = downsample(slab, 2 ** level, method)
+            if level not in grids:
+                grids[level] = np.empty((-(-shape[0] // 2 ** level),) + coarse.shape[1:], dtype=coarse.dtype)
+            start = x // 2 ** level
+            grids[level][start:start + len(coarse)] = coarse
+
+    return {level: (grids[level], coarse_details(cube_details, level)) for level in levels}
+
+
+def pick_level(shape, max_voxels, levels=3):
+    """
+    Finest pyramid level whose grid has at most max_voxels voxels.
+
+    Parameters
+    ----------
+    shape: tuple<int>
+        Shape of the full grid.
+    max_voxels: int
+        Voxel budget.
+    levels: int, optional
+        Deepest level available, used when none fits. Default is 3.
+
+    Returns
+    --------
+    level: int
+
+    """
+    for level in range(levels + 1):
+        if np.prod([-(-n // 2 ** level) for n in shape], dtype=np.float64) <= max_voxels:
+            return level
+    return levels
@@ -0,0 +1,430 @@
+"""
+raster.py
+Headless rendering of scenes into images with NumPy
+"""
+
+import itertools
+import struct
+import zlib
+
+import numpy as np
+
+from .mesh import vertex_normals
+from .pyramid import downsample
+from .render import _rgb, register_backend
+from .volume import ray_march, ray_span, transfer_function, volume_budget
+
+# Light shining from above left of the camera, in camera coordinates (x right, y up, z into the screen)
+_LIGHT = np.array([-0.35, 0.45, -1.0]) / np.linalg.norm([-0.35, 0.45, -1.0])
+
+# Largest number of candidate pixels tested at once
+_CHUNK = 2**22
+
+
+class Camera():
+    """
+    Orthographic camera looking at the centre of a scene, with z up.
+
+    Parameters
+    ----------
+    azimuth: float, optional
+        Angle of the camera around the z axis from the x axis, in degrees. Default is 45.
+    elevation: float, optional
+        Angle of the camera above the xy plane, in degrees. Default is 30.
+    zoom: float, optional
+        Magnification over the view fitting the whole scene. Default is 1.
+
+    """
+    def __init__(self, azimuth=45.0, elevation=30.0, zoom=1.0):
+        self.azimuth = azimuth
+        self.elevation = elevation
+        self.zoom = zoom
+
+    def axes(self):
+        """Right, up and forward unit vectors of the camera, as the rows of a (3, 3) array."""
+        azimuth, elevation = np.radians(self.azimuth), np.radians(self.elevation)
+        eye = np.array([np.cos(elevation) * np.cos(azimuth), np.cos(elevation) * np.sin(azimuth),
+                        np.sin(elevation)])
+        forward = -eye
+        right = np.cross(forward, [0.0, 0.0, 1.0])
+        if np.linalg.norm(right) < 1e-9:
+            right = np.array([np.sin(azimuth), -np.cos(azimuth), 0.0])
+        right /= np.linalg.norm(right)
+        return np.array([right, np.cross(right, forward), forward])
+
+
+def rasterize(scene, width=500, height=500, camera=None, background=(1.0, 1.0, 1.0), rate=None):
+    """
+    Render a scene into an RGBA image on the CPU.
+
+    Surfaces are drawn as shaded triangles, atoms as spheres and bonds as
+    cylinders in the colors of their atoms, through one fragment pipeline
+    vectorized over all primitives: every primitive lists the pixels of
+    its bounding box and keeps those it covers with their depth. Opaque
+    fragments go through a depth buffer first, which shades only the
+    nearest fragment of each pixel. The translucent fragments in front
+    of it are then shaded and blended front to back, so translucent
+    surfaces show the atoms behind them. Atom and bond sizes are in
+    pixels of a figure scene.size * 500 pixels wide, like plotly markers,
+    and scale with the image. A volume is ray marched in front of the
+    opaque fragments, with the level and samples of volume_budget.
+
+    Parameters
+    ----------
+    scene: Scene
+    width: int, optional
+    height: int, optional
+        Image size in pixels. Default is 500 x 500.
+    camera: Camera, optional
+        Default is Camera().
+    background: tuple<float> or None, optional
+        Red, green and blue between 0 and 1 behind the scene, or None
+        for a transparent background. Default is white.
+    rate: float, optional
+        Ray samples per second of the volume march, see volume_budget.
+
+    Returns
+    --------
+    image: np.array (height, width, 4) of np.uint8
+
+    """
+    camera = Camera() if camera is None else camera
+    axes = camera.axes()
+    atoms = scene.atoms
+
+    points = [mesh["vertices"] for mesh in scene.meshes if len(mesh["vertices"])]
+    if atoms is not None:
+        points.append(atoms["positions"])
+    if scene.volume is not None:
+        points.append(_volume_corners(scene.volume["data"].shape, scene.volume["level"]))
+    points = np.concatenate(points) if points else np.zeros((1, 3))
+    local = points @ axes.T
+    centre = (local.min(axis=0) + local.max(axis=0)) / 2 @ axes
+    extent = (points - centre) @ axes[:2].T
+    # Pixels per unit of length, leaving a margin for the atom spheres
+    pixels = min(width, height) / (scene.size * 500)
+    margin = 0.5 * float(atoms["sizes"].max()) * pixels if atoms is not None else 0.0
+    span = max(float(np.abs(extent).max()), 1e-9)
+    scale = camera.zoom * (min(width, height) / 2 - margin - 2) / span
+
+    def project(world):
+        """Pixel x, pixel y and depth of points."""
+        local = (np.asarray(world, dtype=np.float64) - centre) @ axes.T
+        return np.stack([width / 2 + local[..., 0] * scale, height / 2 - local[..., 1] * scale, local[..., 2]],
+                        axis=-1)
+
+    opaque, translucent = [], []
+    for mesh in scene.meshes:
+        vertices, faces = np.asarray(mesh["vertices"], dtype=np.float64), np.asarray(mesh["faces"])
+        if len(faces) == 0:
+            continue
+        normals = vertex_normals(vertices, faces) @ axes.T
+        color = np.array(_rgb(mesh["color"]))
+        (opaque if mesh["opacity"] >= 1 else translucent).append(
+            _triangles(project(vertices)[faces], normals[faces], np.broadcast_to(color, (len(faces), 3)),
+                       np.full(len(faces), mesh["opacity"]), width, height))
+
+    if atoms is not None:
+        colors = np.array([_rgb(color) for color in atoms["colors"]])
+        if scene.bonds is not None and len(scene.bonds):
+            opaque.append(_cylinders(project(atoms["positions"]), scene.bonds, colors,
+                                     scene.bond_width / 2 * pixels, width, height))
+        if atoms["visible"]:
+            opaque.append(_spheres(project(atoms["positions"]), atoms["sizes"] / 2 * pixels, colors, scale,
+                                   width, height))
+
+    stop, rgb = _depth_buffer(itertools.chain(*opaque), width, height)
+    fragments = _join([part for part in (_in_front(chunks, stop) for chunks in translucent) if len(part[0])])
+    layer = None
+    if scene.volume is not None:
+        layer = _volume_layer(scene.volume, stop, axes, centre, scale, width, height, rate)
+    return _composite(fragments, width, height, background, layer, (np.isfinite(stop), rgb))
+
+
+def _volume_corners(shape, level):
+    """Corners of the box of a grid at a pyramid level, in voxel index units of the full grid."""
+    factor = 2 ** level
+    lo = np.full(3, (factor - 1) / 2)
+    hi = lo + (np.array(shape) - 1) * factor
+    return np.array([[(lo, hi)[corner >> axis & 1][axis] for axis in range(3)] for corner in range(8)])
+
+
+def _volume_layer(volume, stop, axes, centre, scale, width, height, rate=None):
+    """Premultiplied color and transmittance of the volume in front of the opaque depth stop of every pixel."""
+    data, level = volume["data"], volume["level"]
+    signed = volume["negative"] is not None
+    peak = float(np.abs(data).max()) if data.size else 0.0
+
+    # Rays through the pixel centres, in voxel index units of the grid at a pyramid level
+    py, px = np.divmod(np.arange(width * height), width)
+    x, y = (px + 0.5 - width / 2) / scale, -(py + 0.5 - height / 2) / scale
+    plane = centre + x[:, None] * axes[0] + y[:, None] * axes[1]
+
+    def rays(level):
+        factor = 2 ** level
+        return (plane - (factor - 1) / 2) / factor, axes[2] / factor
+
+    enter, leave = ray_span(*rays(level), data.shape)
+    extra, samples = volume_budget(data.shape, np.count_nonzero(leave >= enter), volume["latency"], rate=rate)
+    if extra:
+        data = downsample(data, 2 ** extra, "maxabs" if signed else "mean")
+    origins, direction = rays(level + extra)
+    depths = (_volume_corners(data.shape, level + extra) - centre) @ axes[2]
+    tables = transfer_function(volume["colorscale"], volume["negative"])
+    return ray_march(data, origins, direction, depths.min(), depths.max(), samples, tables,
+                     volume["threshold"], peak, volume["opacity"], stop)
+
+
+def _shade(normals, colors):
+    """Colors lit by the headlight from both sides of a surface, with some ambient light."""
+    length = np.linalg.norm(normals, axis=-1, keepdims=True)
+    light = np.abs((normals / np.where(length > 0, length, 1.0)) @ _LIGHT)
+    return colors * (0.35 + 0.65 * light[..., None])
+
+
+def _candidates(lo_x, hi_x, lo_y, hi_y, width, height):
+    """Primitive index, pixel x and pixel y of the pixels centred in the bounding box of every primitive, in chunks."""
+    x0 = np.clip(np.ceil(lo_x - 0.5), 0, width).astype(np.int64)
+    x1 = np.clip(np.floor(hi_x - 0.5) + 1, 0, width).astype(np.int64)
+    y0 = np.clip(np.ceil(lo_y - 0.5), 0, height).astype(np.int64)
+    y1 = np.clip(np.floor(hi_y - 0.5) + 1, 0, height).astype(np.int64)
+    nx, ny = x1 - x0, y1 - y0
+    counts = nx * ny
+
+    ends = np.cumsum(counts)
+    start = 0
+    while start < len(counts):
+        stop = max(int(np.searchsorted(ends, (ends[start - 1] if start else 0) + _CHUNK, side="right")), start + 1)
+        block = np.arange(start, stop)
+        primitive = np.repeat(block, counts[block])
+        offset = np.arange(len(primitive)) - np.repeat(np.cumsum(counts[block]) - counts[block], counts[block])
+        yield primitive, x0[primitive] + offset % nx[primitive], y0[primitive] + offset // nx[primitive]
+        start = stop
+
+
+def _triangles(screen, normals, colors, alpha, width, height):
+    """
+    Fragments of triangles given by the pixel x, pixel y and depth of their corners, and their corner normals.
+    Yields chunks of (pixel, depth, alpha, shade), where shade(keep) is the rgb of the fragments kept by a mask.
+    """
+    (x0, y0), (x1, y1), (x2, y2) = (screen[:, k, :2].T for k in range(3))
+    area = (y1 - y2) * (x0 - x2) + (x2 - x1) * (y0 - y2)
+    keep = np.abs(area) > 1e-12
+    screen, normals, colors, alpha, area = screen[keep], normals[keep], colors[keep], alpha[keep], area[keep]
+    (x0, y0), (x1, y1), (x2, y2) = (screen[:, k, :2].T for k in range(3))
+
+    # Barycentric coordinates are linear in the pixel position, relative to the third corner
+    a0, b0 = (y1 - y2) / area, (x2 - x1) / area
+    a1, b1 = (y2 - y0) / area, (x0 - x2) / area
+
+    for tri, px, py in _candidates(screen[:, :, 0].min(axis=1), screen[:, :, 0].max(axis=1),
+                                   screen[:, :, 1].min(axis=1), screen[:, :, 1].max(axis=1), width, height):
+        cx, cy = px + 0.5 - x2[tri], py + 0.5 - y2[tri]
+        l0 = a0[tri] * cx + b0[tri] * cy
+        l1 = a1[tri] * cx + b1[tri] * cy
+        inside = (l0 >= -1e-9) & (l1 >= -1e-9) & (l0 + l1 <= 1 + 1e-9)
+        l0, l1 = l0[inside], l1[inside]
+        tri, px, py = tri[inside], px[inside], py[inside]
+        weights = np.stack([l0, l1, 1 - l0 - l1], axis=1)
+        depth = np.einsum('fk,fk->f', weights, screen[tri, :, 2])
+
+        def shade(keep, tri=tri, weights=weights):
+            normal = np.einsum('fk,fkc->fc', weights[keep], normals[tri[keep]])
+            return _shade(normal, colors[tri[keep]])
+        yield py * width + px, depth, alpha[tri], shade
+
+
+def _spheres(centres, radii, colors, scale, width, height):
+    """
+    Fragments of spheres given by the pixel x, pixel y and depth of their centres and their radii in pixels,
+    in chunks like _triangles. scale is the number of pixels per unit of depth.
+    """
+    radii = np.broadcast_to(np.asarray(radii, dtype=np.float64), (len(centres),))
+    for atom, px, py in _candidates(centres[:, 0] - radii, centres[:, 0] + radii, centres[:, 1] - radii,
+                                    centres[:, 1] + radii, width, height):
+        dx = (px + 0.5 - centres[atom, 0]) / radii[atom]
+        dy = -(py + 0.5 - centres[atom, 1]) / radii[atom]
+        inside = dx * dx + dy * dy <= 1
+        atom, px, py, dx, dy = atom[inside], px[inside], py[inside], dx[inside], dy[inside]
+        dz = -np.sqrt(np.maximum(1 - dx * dx - dy * dy, 0))
+        depth = centres[atom, 2] + dz * radii[atom] / scale
+
+        def shade(keep, atom=atom, normal=np.stack([dx, dy, dz], axis=1)):
+            return _shade(normal[keep], colors[atom[keep]])
+        yield py * width + px, depth, np.ones(len(atom)), shade
+
+
+def _cylinders(centres, bonds, colors, radius, width, height):
+    """
+    Fragments of bonds drawn as cylinders from each atom to the middle of the bond.
+
+    Each half-bond is a strip of four triangles facing the camera, from
+    one edge through the axis to the other edge, whose normals turn from
+    sideways to facing the camera so it is shaded like a cylinder.
+    """
+    pairs = np.array([bond[:2] for bond in bonds], dtype=np.int64).reshape(-1, 2)
+    start = centres[pairs.T.ravel()]
+    end = np.concatenate([(centres[pairs[:, 0]] + centres[pairs[:, 1]]) / 2] * 2)
+    color = colors[pairs.T.ravel()]
+
+    direction = end[:, :2] - start[:, :2]
+    length = np.linalg.norm(direction, axis=1)
+    keep = length > 1e-9
+    start, end, color, direction = start[keep], end[keep], color[keep], direction[keep] / length[keep, None]
+    side = np.stack([-direction[:, 1], direction[:, 0], np.zeros(len(direction))], axis=1)
+
+    offset = side * radius
+    rails = [start + offset, start, start - offset, end + offset, end, end - offset]
+    flat = np.stack([[0.0, 0.0, -1.0]] * len(side))
+    rail_normals = [side * [1, -1, 1], flat, -side * [1, -1, 1]] * 2
+    strip = [(0, 1, 3), (1, 4, 3), (1, 2, 4), (2, 5, 4)]
+    screen = np.concatenate([np.stack([rails[a], rails[b], rails[c]], axis=1) for a, b, c in strip])
+    normals = np.concatenate([np.stack([rail_normals[a], rail_normals[b], rail_normals[c]], axis=1)
+                              for a, b, c in strip])
+    return _triangles(screen, normals, np.concatenate([color] * 4), np.ones(len(screen)), width, height)
+
+
+def _depth_buffer(chunks, width, height):
+    """
+    Depth and color of the nearest opaque fragment of every pixel, inf and black where there is none.
+    Only the fragments nearest so far are shaded.
+    """
+    depths = np.full(width * height, np.inf)
+    rgb = np.zeros((width * height, 3))
+    for pixel, depth, _, shade in chunks:
+        np.minimum.at(depths, pixel, depth)
+        front = depth <= depths[pixel]
+        rgb[pixel[front]] = shade(front)
+    return depths, rgb
+
+
+def _in_front(chunks, stop):
+    """(pixel, depth, rgb, alpha) of the fragments in front of the depth stop of their pixel, shaded."""
+    out = []
+    for pixel, depth, alpha, shade in chunks:
+        keep = depth < stop[pixel]
+        out.append((pixel[keep], depth[keep], shade(keep), alpha[keep]))
+    return _join(out)
+
+
+def _join(parts):
+    """One (pixel, depth, rgb, alpha) tuple of arrays from a list of them."""
+    if not parts:
+        return np.zeros(0, np.int64), np.zeros(0), np.zeros((0, 3)), np.zeros(0)
+    return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+
+def _composite(fragments, width, height, background, layer=None, opaque=None):
+    """
+    Blend the fragments of every pixel front to back into an RGBA image,
+    behind a layer of premultiplied color and transmittance and in front
+    of a (covered, rgb) opaque layer from the depth buffer when given.
+    """
+    pixel, depth, rgb, alpha = fragments
+    # Sort by pixel then depth with one key, the pixel plus the depth scaled into [0, 1)
+    lo, span = (depth.min(), np.ptp(depth)) if len(depth) else (0.0, 0.0)
+    order = np.argsort(pixel + (depth - lo) / (span * (1 + 1e-6) or 1.0))
+    pixel, rgb, alpha = pixel[order], rgb[order], np.clip(alpha[order], 0, 1)
+
+    # Transmittance in front of each fragment: product of 1 - alpha of the fragments before it in its pixel
+    opacity = np.log(np.maximum(1 - alpha, 1e-30))
+    before = np.cumsum(opacity) - opacity
+    starts = np.r_[True, pixel[1:] != pixel[:-1]] if len(pixel) else np.zeros(0, bool)
+    group = np.cumsum(starts) - 1
+    weight = np.exp(before - before[np.flatnonzero(starts)][group]) * alpha
+
+    size = width * height
+    # Floats even without fragments, where bincount returns integers
+    coverage = np.bincount(pixel, weights=weight, minlength=size).astype(np.float64)
+    color = np.stack([np.bincount(pixel, weights=weight * rgb[:, c], minlength=size) for c in range(3)],
+                     axis=1).astype(np.float64)
+    if opaque is not None:
+        covered, behind = opaque
+        # What the translucent fragments of a pixel let through, 1 - coverage, reaches the opaque layer
+        through = np.where(covered, 1 - coverage, 0.0)
+        color += through[:, None] * behind
+        coverage += through
+    if layer is not None:
+        front, transmittance = layer
+        color = front + transmittance[:, None] * color
+        coverage = 1 - transmittance * (1 - coverage)
+    if background is None:
+        color /= np.where(coverage > 0, coverage, 1.0)[:, None]
+        image = np.concatenate([color, coverage[:, None]], axis=1)
+    else:
+        color += (1 - coverage)[:, None] * np.asarray(background, dtype=np.float64)
+        image = np.concatenate([color, np.ones((size, 1))], axis=1)
+    return np.round(np.clip(image, 0, 1) * 255).astype(np.uint8).reshape(height, width, 4)
+
+
+def png_bytes(image):
+    """
+    Encode an RGBA or RGB image of np.uint8 as PNG, with the standard library only.
+
+    Parameters
+    ----------
+    image: np.array (height, width, 4 or 3) of np.uint8
+
+    Returns
+    --------
+    png: bytes
+
+    """
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    height, width, channels = image.shape
+    # Every row starts with filter type 0, no filter
+    rows = np.concatenate([np.zeros((height, 1), np.uint8), image.reshape(height, -1)], axis=1)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, {3: 2, 4: 6}[channels], 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows.tobytes(), 6))
+            + chunk(b"IEND", b""))
+
+
+def write_png(fname, image):
+    """Write an image of np.uint8 to a PNG file, see png_bytes."""
+    with open(fname, "wb") as out:
+        out.write(png_bytes(image))
+
+
+class RasterBackend():
+    """
+    Draw scenes into PNG images on the CPU, without a browser, see rasterize.
+
+    Parameters
+    ----------
+    width: int, optional
+    height: int, optional
+        Image size in pixels. Default is the size of the plotly figure, scene.size * 500.
+    camera: Camera, optional
+    background: tuple<float> or None, optional
+    rate: float, optional
+        See rasterize.
+
+    """
+    def __init__(self, width=None, height=None, camera=None, background=(1.0, 1.0, 1.0), rate=None):
+        self.width = width
+        self.height = height
+        self.camera = camera
+        self.background = background
+        self.rate = rate
+
+    def image(self, scene):
+        """RGBA image of a scene, as np.array (height, width, 4) of np.uint8."""
+        default = int(round(scene.size * 500))
+        return rasterize(scene, self.width or default, self.height or default, self.camera, self.background,
+                         self.rate)
+
+    def show(self, scene, filename=None):
+        """Show the image of a scene in the notebook, or write it to a PNG file."""
+        image = self.image(scene)
+        if filename is not None:
+            write_png(filename, image)
+            return
+        from IPython.display import Image, display
+        display(Image(data=png_bytes(image), format="png"))
+
+
+register_backend("png", RasterBackend())
@@ -0,0 +1,599 @@
+"""
+render.py
+Render backends drawing a scene of surfaces, atoms and bonds
+"""
+
+import html
+import json
+import re
+
+import numpy as np
+import plotly.graph_objects as go
+
+from .bonds import bond_lines, bond_trace
+from .cube import mesh_trace
+from .encoding import encode_array, index_dtype, quantize
+
+
+class Scene():
+    """
+    Everything a figure shows, independent of the library that draws it.
+
+    Parameters
+    ----------
+    size: int, optional
+        Figure size, the figure is size * 500 pixels wide. Default is 1.
+    title: str, optional
+
+    Attributes
+    ----------
+    meshes: list<dict>
+        vertices, faces, color and opacity of every surface.
+    atoms: dict or None
+        positions, colors, sizes, outline and visible.
+    bonds: list<[atom1, atom2, distance]> or None
+    bond_width: float
+    frames: list<np.array (natom, 3)>
+        Atom positions of the animation frames, bonds follow the atoms.
+    volume: dict or None
+        Grid drawn as a translucent volume, see add_volume.
+
+    """
+    def __init__(self, size=1, title=None):
+        self.size = size
+        self.title = title
+        self.meshes = []
+        self.atoms = None
+        self.bonds = None
+        self.bond_width = 7
+        self.frames = []
+        self.volume = None
+
+    def add_mesh(self, vertices, faces, color, opacity=0.2):
+        self.meshes.append({"vertices": np.asarray(vertices), "faces": np.asarray(faces), "color": color,
+                            "opacity": opacity})
+
+    def add_atoms(self, positions, colors, sizes, outline=2, visible=True):
+        """Atoms drawn as markers. Invisible atoms only anchor the bonds."""
+        self.atoms = {"positions": np.asarray(positions, dtype=np.float64), "colors": list(colors),
+                      "sizes": np.asarray(sizes, dtype=np.float64), "outline": outline, "visible": visible}
+
+    def add_bonds(self, bonds, width=7):
+        """Bonds between the atoms, given as build_bond_list output."""
+        if self.atoms is None:
+            raise ValueError("Add the atoms of a scene before its bonds")
+        self.bonds = bonds
+        self.bond_width = width
+
+    def add_frame(self, positions):
+        self.frames.append(np.asarray(positions, dtype=np.float64))
+
+    def add_volume(self, data, level=0, colorscale="Blues", negative=None, threshold=0.0, latency=1.0,
+                   opacity=0.1):
+        """
+        Grid drawn as a translucent volume, see volume_traces and ray_march.
+
+        Parameters
+        ----------
+        data: np.array (nx, ny, nz)
+        level: int, optional
+            Pyramid level of data, its voxels are placed in units of the full grid.
+        colorscale: str or list, optional
+        negative: str or list, optional
+            Colorscales of the positive and negative values, negative
+            values are transparent when negative is None.
+        threshold: float, optional
+            Magnitude below which the volume is transparent.
+        latency: float, optional
+            Time budget of drawing the volume in seconds.
+        opacity: float, optional
+            Extinction per voxel of the strongest values, for ray marching.
+
+        """
+        self.volume = {"data": np.asarray(data), "level": level, "colorscale": colorscale, "negative": negative,
+                       "threshold": threshold, "latency": latency, "opacity": opacity}
+
+
+class PlotlyBackend():
+    """Draw scenes as validated plotly figures, the way blobs always has."""
+
+    def figure(self, scene):
+        """
+        Build the plotly figure of a scene.
+
+        Returns
+        --------
+        fig: go.Figure
+
+        """
+        data = [mesh_trace(mesh["vertices"], mesh["faces"], mesh["color"], mesh["opacity"])
+                for mesh in scene.meshes]
+        if scene.volume is not None:
+            from .volume import volume_traces
+            volume = scene.volume
+            data += volume_traces(volume["data"], volume["level"], volume["colorscale"], volume["negative"],
+                                  volume["threshold"], volume["latency"])
+        atoms = scene.atoms
+        moving = []
+        if atoms is not None and atoms["visible"]:
+            moving.append(len(data))
+            data.append(go.Scatter3d(x=atoms["positions"][:, 0],
+                                     y=atoms["positions"][:, 1],
+                                     z=atoms["positions"][:, 2],
+                                     mode="markers",
+                                     marker={"showscale": False,
+                                             "color": atoms["colors"],
+                                             "size": atoms["sizes"],
+                                             "opacity": 1.0,
+                                             "line": {"width": atoms["outline"], "color": "black"}}))
+        if scene.bonds is not None:
+            moving.append(len(data))
+            data.append(bond_trace(atoms["positions"], scene.bonds, atoms["colors"], scene.bond_width))
+
+        frames = []
+        for positions in scene.frames:
+            frame = []
+            if atoms is not None and atoms["visible"]:
+                frame.append(go.Scatter3d(x=positions[:, 0], y=positions[:, 1], z=positions[:, 2]))
+            if scene.bonds is not None:
+                points, _ = bond_lines(positions, scene.bonds)
+                frame.append(go.Scatter3d(x=points[:, 0], y=points[:, 1], z=points[:, 2]))
+            frames.append(go.Frame(data=frame, traces=moving))
+
+        fig = go.Figure(data=data, frames=frames)
+        hidden = {"showgrid": False, "zeroline": False, "showline": False, "title": "", "ticks": '',
+                  "showticklabels": False, "showbackground": False, "showspikes": False}
+        fig.update_layout(dragmode="orbit",
+                          width=scene.size * 500,
+                          height=scene.size * 500,
+                          template="plotly_white",
+                          showlegend=False,
+                          hovermode=False,
+                          title=scene.title,
+                          scene={"xaxis": hidden, "yaxis": hidden, "zaxis": hidden, "aspectmode": "data"})
+        if frames:
+            fig.update_layout(updatemenus=[dict(
+                type="buttons",
+                buttons=[dict(label="Play", method="animate",
+                              args=[None, {"frame": {"duration": 0, "redraw": True}}]),
+                         dict(label="Stop", method="animate",
+                              args=[[None], {"frame": {"duration": 0, "redraw": False}, "mode": "immediate",
+                                             "transition": {"duration": 0}}])])])
+        return fig
+
+    def show(self, scene, filename=None):
+        """Show the figure of a scene, or write it to an HTML file."""
+        fig = self.figure(scene)
+        if filename is not None:
+            fig.write_html(filename)
+        else:
+            fig.show(config={'scrollZoom': False})
+
+
+class WebGLBackend():
+    """
+    Draw scenes with a small WebGL2 page, without building plotly objects.
+
+    The scene is written straight into a self-contained HTML template,
+    so nothing is validated and the cost grows only with the size of the
+    arrays. Arrays are stored as base64 typed arrays, see encode_array:
+    float32 coordinates and uint16 or uint32 indices. Surfaces are shaded from
+    both sides, atoms are drawn as round sprites and bonds as thin lines
+    in the colors of their atoms. Dragging rotates the view and the
+    mouse wheel zooms.
+
+    Parameters
+    ----------
+    quantize: float, optional
+        Store surface vertices as 8 or 16 bit integers, at most this far
+        from their exact position, see quantize. Default is None, float32.
+
+    """
+    def __init__(self, quantize=None):
+        self.quantize = quantize
+
+    def payload(self, scene):
+        """The scene as a JSON-ready dict of encoded arrays."""
+        if scene.volume is not None:
+            raise ValueError("The webgl backend does not draw volumes, use the plotly or png backend")
+        payload = {"width": scene.size * 500, "height": scene.size * 500, "title": scene.title or "",
+                   "meshes": [], "atoms": None, "bonds": None, "frames": []}
+        for mesh in scene.meshes:
+            vertices = mesh["vertices"]
+            if self.quantize is None:
+                positions = encode_array(vertices, np.float32)
+            else:
+                positions = quantize(vertices, self.quantize)
+            payload["meshes"].append({"positions": positions,
+                                      "indices": encode_array(mesh["faces"], index_dtype(len(vertices))),
+                                      "color": _rgb(mesh["color"]), "opacity": mesh["opacity"]})
+        atoms = scene.atoms
+        if atoms is not None:
+            payload["atoms"] = {"positions": encode_array(atoms["positions"], np.float32),
+                                "colors": encode_array([_rgb(color) for color in atoms["colors"]], np.float32),
+                                "sizes": encode_array(atoms["sizes"], np.float32),
+                                "visible": bool(atoms["visible"])}
+        if scene.bonds is not None:
+            pairs = np.array([bond[:2] for bond in scene.bonds], dtype=np.int64).reshape(-1, 2)
+            payload["bonds"] = {"pairs": encode_array(pairs, index_dtype(len(atoms["positions"])))}
+        payload["frames"] = [encode_array(positions, np.float32) for positions in scene.frames]
+        return payload
+
+    def html(self, scene):
+        """
+        The self-contained HTML page of a scene.
+
+        Returns
+        --------
+        page: str
+
+        """
+        payload = json.dumps(self.payload(scene), separators=(',', ':')).replace("</", "<\\/")
+        return _TEMPLATE.replace("/*SCENE*/", payload)
+
+    def show(self, scene, filename=None):
+        """Show a scene in the notebook, in an iframe, or write it to an HTML file."""
+        page = self.html(scene)
+        if filename is not None:
+            with open(filename, "w") as out:
+                out.write(page)
+            return
+        from IPython.display import HTML, display
+        width, height = scene.size * 500, scene.size * 500 + 40
+        display(HTML(f'<iframe srcdoc="{html.escape(page)}" width="{width}" height="{height}" '
+                     f'style="border: none"></iframe>'))
+
+
+_BACKENDS = {"plotly": PlotlyBackend(), "webgl": WebGLBackend()}
+
+
+def register_backend(name, backend):
+    """
+    Make a backend available to the backend option of Cube.plot and Freq.plot.
+
+    Parameters
+    ----------
+    name: str
+    backend: object with a show(scene, filename=None) method
+
+    """
+    _BACKENDS[name] = backend
+
+
+def get_backend(name):
+    """The backend registered under name."""
+    if name not in _BACKENDS:
+        raise ValueError(f"Unknown backend {name!r}, use one of {sorted(_BACKENDS)}")
+    return _BACKENDS[name]
+
+
+# CSS named colors accepted by plotly, as hexadecimal red, green and blue
+_NAMED_COLORS = {
+    "aliceblue": "f0f8ff", "antiquewhite": "faebd7", "aqua": "00ffff", "aquamarine": "7fffd4", "azure": "f0ffff",
+    "beige": "f5f5dc", "bisque": "ffe4c4", "black": "000000", "blanchedalmond": "ffebcd", "blue": "0000ff",
+    "blueviolet": "8a2be2", "brown": "a52a2a", "burlywood": "deb887", "cadetblue": "5f9ea0", "chartreuse": "7fff00",
+    "chocolate": "d2691e", "coral": "ff7f50", "cornflowerblue": "6495ed", "cornsilk": "fff8dc", "crimson": "dc143c",
+    "cyan": "00ffff", "darkblue": "00008b", "darkcyan": "008b8b", "darkgoldenrod": "b8860b", "darkgray": "a9a9a9",
+    "darkgrey": "a9a9a9", "darkgreen": "006400", "darkkhaki": "bdb76b", "darkmagenta": "8b008b",
+    "darkolivegreen": "556b2f", "darkorange": "ff8c00", "darkorchid": "9932cc", "darkred": "8b0000",
+    "darksalmon": "e9967a", "darkseagreen": "8fbc8f", "darkslateblue": "483d8b", "darkslategray": "2f4f4f",
+    "darkslategrey": "2f4f4f", "darkturquoise": "00ced1", "darkviolet": "9400d3", "deeppink": "ff1493",
+    "deepskyblue": "00bfff", "dimgray": "696969", "dimgrey": "696969", "dodgerblue": "1e90ff", "firebrick": "b22222",
+    "floralwhite": "fffaf0", "forestgreen": "228b22", "fuchsia": "ff00ff", "gainsboro": "dcdcdc",
+    "ghostwhite": "f8f8ff", "gold": "ffd700", "goldenrod": "daa520", "gray": "808080", "grey": "808080",
+    "green": "008000", "greenyellow": "adff2f", "honeydew": "f0fff0", "hotpink": "ff69b4", "indianred": "cd5c5c",
+    "indigo": "4b0082", "ivory": "fffff0", "khaki": "f0e68c", "lavender": "e6e6fa", "lavenderblush": "fff0f5",
+    "lawngreen": "7cfc00", "lemonchiffon": "fffacd", "lightblue": "add8e6", "lightcoral": "f08080",
+    "lightcyan": "e0ffff", "lightgoldenrodyellow": "fafad2", "lightgray": "d3d3d3", "lightgrey": "d3d3d3",
+    "lightgreen": "90ee90", "lightpink": "ffb6c1", "lightsalmon": "ffa07a", "lightseagreen": "20b2aa",
+    "lightskyblue": "87cefa", "lightslategray": "778899", "lightslategrey": "778899", "lightsteelblue": "b0c4de",
+    "lightyellow": "ffffe0", "lime": "00ff00", "limegreen": "32cd32", "linen": "faf0e6", "magenta": "ff00ff",
+    "maroon": "800000", "mediumaquamarine": "66cdaa", "mediumblue": "0000cd", "mediumorchid": "ba55d3",
+    "mediumpurple": "9370db", "mediumseagreen": "3cb371", "mediumslateblue": "7b68ee", "mediumspringgreen": "00fa9a",
+    "mediumturquoise": "48d1cc", "mediumvioletred": "c71585", "midnightblue": "191970", "mintcream": "f5fffa",
+    "mistyrose": "ffe4e1", "moccasin": "ffe4b5", "navajowhite": "ffdead", "navy": "000080", "oldlace": "fdf5e6",
+    "olive": "808000", "olivedrab": "6b8e23", "orange": "ffa500", "orangered": "ff4500", "orchid": "da70d6",
+    "palegoldenrod": "eee8aa", "palegreen": "98fb98", "paleturquoise": "afeeee", "palevioletred": "db7093",
+    "papayawhip": "ffefd5", "peachpuff": "ffdab9", "peru": "cd853f", "pink": "ffc0cb", "plum": "dda0dd",
+    "powderblue": "b0e0e6", "purple": "800080", "rebeccapurple": "663399", "red": "ff0000", "rosybrown": "bc8f8f",
+    "royalblue": "4169e1", "saddlebrown": "8b4513", "salmon": "fa8072", "sandybrown": "f4a460", "seagreen": "2e8b57",
+    "seashell": "fff5ee", "sienna": "a0522d", "silver": "c0c0c0", "skyblue": "87ceeb", "slateblue": "6a5acd",
+    "slategray": "708090", "slategrey": "708090", "snow": "fffafa", "springgreen": "00ff7f", "steelblue": "4682b4",
+    "tan": "d2b48c", "teal": "008080", "thistle": "d8bfd8", "tomato": "ff6347", "turquoise": "40e0d0",
+    "violet": "ee82ee", "wheat": "f5deb3", "white": "ffffff", "whitesmoke": "f5f5f5", "yellow": "ffff00",
+    "yellowgreen": "9acd32"
+}
+
+
+def _rgb(color):
+    """Red, green and blue between 0 and 1 of a CSS named, '#rrggbb', 'rgb(...)' or 'rgba(...)' color."""
+    color = color.strip()
+    if color.lower() in _NAMED_COLORS:
+        color = "#" + _NAMED_COLORS[color.lower()]
+    if color.startswith("#"):
+        digits = color[1:]
+        if len(digits) == 3:
+            digits = "".join(digit * 2 for digit in digits)
+        return [round(int(digits[i:i + 2], 16) / 255, 4) for i in (0, 2, 4)]
+    match = re.fullmatch(r"rgba?\(([^)]*)\)", color)
+    if match is None:
+        raise ValueError(f"Cannot read color {color!r}, use a CSS name, '#rrggbb', 'rgb(...)' or 'rgba(...)'")
+    return [round(float(value) / 255, 4) for value in match.group(1).split(",")[:3]]
+
+
+_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>blobs</title>
+<style>
+  body { margin: 0; font-family: sans-serif; background: white; }
+  #title { height: 32px; line-height: 32px; text-align: center; }
+  #play { position: absolute; top: 4px; left: 4px; }
+  canvas { display: block; cursor: grab; }
+</style>
+</head>
+<body>
+<button id="play" hidden>Play</button>
+<div id="title"></div>
+<canvas id="view"></canvas>
+<script>
+const scene = /*SCENE*/;
+(function () {
+  "use strict";
+  // Arrays arrive as base64 little-endian typed arrays, quantized ones with an offset and scale per axis
+  const types = {f4: Float32Array, f8: Float64Array, u1: Uint8Array, u2: Uint16Array, u4: Uint32Array,
+                 i1: Int8Array, i2: Int16Array, i4: Int32Array};
+  function decode(array) {
+    const text = atob(array.bdata), bytes = new Uint8Array(text.length);
+    for (let i = 0; i < text.length; i++) bytes[i] = text.charCodeAt(i);
+    const values = new types[array.dtype](bytes.buffer);
+    if (!array.scale) return values;
+    const out = new Float32Array(values.length), width = array.scale.length;
+    for (let i = 0; i < values.length; i++) out[i] = values[i] * array.scale[i % width] + array.offset[i % width];
+    return out;
+  }
+  for (const mesh of scene.meshes) {
+    mesh.positions = decode(mesh.positions);
+    mesh.indices = decode(mesh.indices);
+  }
+  if (scene.atoms) {
+    for (const name of ["positions", "colors", "sizes"]) scene.atoms[name] = decode(scene.atoms[name]);
+  }
+  if (scene.bonds) scene.bonds.pairs = decode(scene.bonds.pairs);
+  scene.frames = scene.frames.map(decode);
+  const canvas = document.getElementById("view");
+  const ratio = window.devicePixelRatio || 1;
+  canvas.style.width = scene.width + "px";
+  canvas.style.height = scene.height + "px";
+  canvas.width = scene.width * ratio;
+  canvas.height = scene.height * ratio;
+  document.getElementById("title").textContent = scene.title;
+
+  const gl = canvas.getContext("webgl2", {antialias: true});
+  if (!gl) {
+    document.getElementById("title").textContent = "WebGL2 is not available in this browser";
+    return;
+  }
+
+  function program(vertex, fragment) {
+    const prog = gl.createProgram();
+    for (const [type, source] of [[gl.VERTEX_SHADER, vertex], [gl.FRAGMENT_SHADER, fragment]]) {
+      const shader = gl.createShader(type);
+      gl.shaderSource(shader, "#version 300 es\\nprecision highp float;\\n" + source);
+      gl.compileShader(shader);
+      if (!gl.getShaderParameter(shader, gl.COMPILE_STATUS)) throw new Error(gl.getShaderInfoLog(shader));
+      gl.attachShader(prog, shader);
+    }
+    gl.linkProgram(prog);
+    return prog;
+  }
+
+  const surfaceProgram = program(
+    "in vec3 position; in vec3 normal; uniform mat4 projection, view; out vec3 vnormal;" +
+    "void main() { vnormal = mat3(view) * normal; gl_Position = projection * view * vec4(position, 1.0); }",
+    "in vec3 vnormal; uniform vec4 color; out vec4 fragment;" +
+    "void main() { float light = 0.45 + 0.55 * abs(normalize(vnormal).z);" +
+    " fragment = vec4(color.rgb * light, color.a); }");
+  const atomProgram = program(
+    "in vec3 position; in vec3 color; in float size; uniform mat4 projection, view; uniform float scale;" +
+    "out vec3 vcolor; void main() { vcolor = color; gl_PointSize = size * scale;" +
+    " gl_Position = projection * view * vec4(position, 1.0); }",
+    "in vec3 vcolor; out vec4 fragment; void main() { vec2 d = 2.0 * gl_PointCoord - 1.0; float r = dot(d, d);" +
+    " if (r > 1.0) discard; fragment = r > 0.8 ? vec4(0.0, 0.0, 0.0, 1.0)" +
+    " : vec4(vcolor * (0.6 + 0.4 * sqrt(1.0 - r)), 1.0); }");
+  const bondProgram = program(
+    "in vec3 position; in vec3 color; uniform mat4 projection, view; out vec3 vcolor;" +
+    "void main() { vcolor = color; gl_Position = projection * view * vec4(position, 1.0); }",
+    "in vec3 vcolor; out vec4 fragment; void main() { fragment = vec4(vcolor, 1.0); }");
+
+  function buffer(data, target) {
+    const buf = gl.createBuffer();
+    gl.bindBuffer(target || gl.ARRAY_BUFFER, buf);
+    gl.bufferData(target || gl.ARRAY_BUFFER, data, gl.DYNAMIC_DRAW);
+    return buf;
+  }
+
+  let enabled = [];
+  function attribute(prog, name, buf, width) {
+    const location = gl.getAttribLocation(prog, name);
+    if (location < 0) return;
+    gl.bindBuffer(gl.ARRAY_BUFFER, buf);
+    gl.enableVertexAttribArray(location);
+    enabled.push(location);
+    gl.vertexAttribPointer(location, width, gl.FLOAT, false, 0, 0);
+  }
+
+  function normals(p, index) {
+    const n = new Float32Array(p.length);
+    for (let t = 0; t < index.length; t += 3) {
+      const a = 3 * index[t], b = 3 * index[t + 1], c = 3 * index[t + 2];
+      const ux = p[b] - p[a], uy = p[b + 1] - p[a + 1], uz = p[b + 2] - p[a + 2];
+      const vx = p[c] - p[a], vy = p[c + 1] - p[a + 1], vz = p[c + 2] - p[a + 2];
+      const nx = uy * vz - uz * vy, ny = uz * vx - ux * vz, nz = ux * vy - uy * vx;
+      for (const v of [a, b, c]) { n[v] += nx; n[v + 1] += ny; n[v + 2] += nz; }
+    }
+    return n;
+  }
+
+  const surfaces = scene.meshes.map(function (mesh) {
+    const positions = mesh.positions, indices = mesh.indices;
+    return {positions: buffer(positions), normals: buffer(normals(positions, indices)),
+            indices: buffer(indices, gl.ELEMENT_ARRAY_BUFFER), count: indices.length,
+            type: indices instanceof Uint16Array ? gl.UNSIGNED_SHORT : gl.UNSIGNED_INT,
+            color: mesh.color.concat([mesh.opacity])};
+  });
+
+  const atoms = scene.atoms;
+  let atomBuffers = null, bondBuffers = null;
+  function bondVertices(p) {
+    const pairs = scene.bonds.pairs, out = new Float32Array(pairs.length * 6);
+    for (let b = 0; b < pairs.length; b += 2) {
+      const i = 3 * pairs[b], j = 3 * pairs[b + 1], o = 6 * b;
+      for (let k = 0; k < 3; k++) {
+        const middle = (p[i + k] + p[j + k]) / 2;
+        out[o + k] = p[i + k]; out[o + 3 + k] = middle; out[o + 6 + k] = p[j + k]; out[o + 9 + k] = middle;
+      }
+    }
+    return out;
+  }
+  if (atoms) {
+    atomBuffers = {positions: buffer(atoms.positions), colors: buffer(atoms.colors), sizes: buffer(atoms.sizes)};
+  }
+  if (scene.bonds) {
+    const pairs = scene.bonds.pairs, colors = new Float32Array(pairs.length * 6);
+    for (let b = 0; b < pairs.length; b++) {
+      for (let k = 0; k < 3; k++) {
+        colors[6 * b + k] = atoms.colors[3 * pairs[b] + k];
+        colors[6 * b + 3 + k] = atoms.colors[3 * pairs[b] + k];
+      }
+    }
+    bondBuffers = {positions: buffer(bondVertices(atoms.positions)), colors: buffer(colors),
+                   count: 2 * pairs.length};
+  }
+
+  // Camera orbiting around the centre of the scene, z up
+  const lo = [Infinity, Infinity, Infinity], hi = [-Infinity, -Infinity, -Infinity];
+  for (const p of scene.meshes.map(m => m.positions).concat(atoms ? [atoms.positions] : [])) {
+    for (let i = 0; i < p.length; i++) {
+      lo[i % 3] = Math.min(lo[i % 3], p[i]);
+      hi[i % 3] = Math.max(hi[i % 3], p[i]);
+    }
+  }
+  const centre = lo.map((v, k) => isFinite(v) ? (v + hi[k]) / 2 : 0);
+  const radius = Math.max(1e-3, Math.hypot(...lo.map((v, k) => isFinite(v) ? hi[k] - v : 0)) / 2);
+  const camera = {theta: 0.8, phi: 0.5, distance: 3 * radius};
+
+  function matrices() {
+    const c = Math.cos(camera.phi), eye = [centre[0] + camera.distance * c * Math.cos(camera.theta),
+                                           centre[1] + camera.distance * c * Math.sin(camera.theta),
+                                           centre[2] + camera.distance * Math.sin(camera.phi)];
+    const f = centre.map((v, k) => v - eye[k]), fl = Math.hypot(...f);
+    for (let k = 0; k < 3; k++) f[k] /= fl;
+    const s = [f[1], -f[0], 0], sl = Math.hypot(...s);
+    for (let k = 0; k < 3; k++) s[k] /= sl;
+    const u = [s[1] * f[2] - s[2] * f[1], s[2] * f[0] - s[0] * f[2], s[0] * f[1] - s[1] * f[0]];
+    const dot = (a, b) => a[0] * b[0] + a[1] * b[1] + a[2] * b[2];
+    const view = new Float32Array([s[0], u[0], -f[0], 0, s[1], u[1], -f[1], 0, s[2], u[2], -f[2], 0,
+                                   -dot(s, eye), -dot(u, eye), dot(f, eye), 1]);
+    const near = Math.max(camera.distance - 2 * radius, radius * 0.01), far = camera.distance + 2 * radius;
+    const t = 1 / Math.tan(Math.PI / 8), nf = 1 / (near - far), aspect = canvas.width / canvas.height;
+    const projection = new Float32Array([t / aspect, 0, 0, 0, 0, t, 0, 0, 0, 0, (far + near) * nf, -1,
+                                         0, 0, 2 * far * near * nf, 0]);
+    return {view: view, projection: projection};
+  }
+
+  function uniforms(prog, m) {
+    // Attributes of the previous program must not outlive it
+    enabled.forEach(location => gl.disableVertexAttribArray(location));
+    enabled = [];
+    gl.useProgram(prog);
+    gl.uniformMatrix4fv(gl.getUniformLocation(prog, "view"), false, m.view);
+    gl.uniformMatrix4fv(gl.getUniformLocation(prog, "projection"), false, m.projection);
+  }
+
+  function draw() {
+    const m = matrices();
+    gl.viewport(0, 0, canvas.width, canvas.height);
+    gl.clearColor(1, 1, 1, 1);
+    gl.clear(gl.COLOR_BUFFER_BIT | gl.DEPTH_BUFFER_BIT);
+    gl.enable(gl.DEPTH_TEST);
+    gl.depthMask(true);
+    gl.disable(gl.BLEND);
+    if (bondBuffers) {
+      uniforms(bondProgram, m);
+      attribute(bondProgram, "position", bondBuffers.positions, 3);
+      attribute(bondProgram, "color", bondBuffers.colors, 3);
+      gl.drawArrays(gl.LINES, 0, bondBuffers.count);
+    }
+    if (atoms && atoms.visible) {
+      uniforms(atomProgram, m);
+      gl.uniform1f(gl.getUniformLocation(atomProgram, "scale"), ratio);
+      attribute(atomProgram, "position", atomBuffers.positions, 3);
+      attribute(atomProgram, "color", atomBuffers.colors, 3);
+      attribute(atomProgram, "size", atomBuffers.sizes, 1);
+      gl.drawArrays(gl.POINTS, 0, atoms.sizes.length);
+    }
+    // Translucent surfaces last, without writing depth so those behind stay visible
+    gl.enable(gl.BLEND);
+    gl.blendFunc(gl.SRC_ALPHA, gl.ONE_MINUS_SRC_ALPHA);
+    gl.depthMask(false);
+    uniforms(surfaceProgram, m);
+    for (const surface of surfaces) {
+      gl.uniform4fv(gl.getUniformLocation(surfaceProgram, "color"), surface.color);
+      attribute(surfaceProgram, "position", surface.positions, 3);
+      attribute(surfaceProgram, "normal", surface.normals, 3);
+      gl.bindBuffer(gl.ELEMENT_ARRAY_BUFFER, surface.indices);
+      gl.drawElements(gl.TRIANGLES, surface.count, surface.type, 0);
+    }
+  }
+
+  let drag = null;
+  canvas.addEventListener("mousedown", e => { drag = [e.clientX, e.clientY]; });
+  window.addEventListener("mouseup", () => { drag = null; });
+  window.addEventListener("mousemove", function (e) {
+    if (!drag) return;
+    camera.theta -= (e.clientX - drag[0]) * 0.01;
+    camera.phi = Math.max(-1.5, Math.min(1.5, camera.phi + (e.clientY - drag[1]) * 0.01));
+    drag = [e.clientX, e.clientY];
+    requestAnimationFrame(draw);
+  });
+  canvas.addEventListener("wheel", function (e) {
+    e.preventDefault();
+    camera.distance *= Math.exp(e.deltaY * 0.001);
+    requestAnimationFrame(draw);
+  }, {passive: false});
+
+  // Animation frames move the atoms, and the bonds with them
+  if (scene.frames.length) {
+    const play = document.getElementById("play");
+    let timer = null, frame = 0;
+    play.hidden = false;
+    play.addEventListener("click", function () {
+      if (timer) {
+        clearInterval(timer);
+        timer = null;
+        play.textContent = "Play";
+        return;
+      }
+      play.textContent = "Stop";
+      timer = setInterval(function () {
+        const p = scene.frames[frame];
+        gl.bindBuffer(gl.ARRAY_BUFFER, atomBuffers.positions);
+        gl.bufferSubData(gl.ARRAY_BUFFER, 0, p);
+        if (bondBuffers) {
+          gl.bindBuffer(gl.ARRAY_BUFFER, bondBuffers.positions);
+          gl.bufferSubData(gl.ARRAY_BUFFER, 0, bondVertices(p));
+        }
+        frame = (frame + 1) % scene.frames.length;
+        draw();
+      }, 50);
+    });
+  }
+
+  draw();
+})();
+</script>
+</body>
+</html>
+"""
@@ -0,0 +1,177 @@
+"""
+store.py
+Chunked and compressed binary storage of cube files
+"""
+
+import json
+import zipfile
+
+import numpy as np
+
+from .cube import CubeSlabs, bounds_to_box, move_to_box
+
+_COMPRESSION = {
+    None: zipfile.ZIP_STORED,
+    "deflate": zipfile.ZIP_DEFLATED,
+    "bz2": zipfile.ZIP_BZIP2,
+    "lzma": zipfile.ZIP_LZMA,
+}
+
+
+def is_store(fname):
+    """True if fname is a CubeStore container rather than a text cube file."""
+    with open(fname, 'rb') as handle:
+        return handle.read(4) == b'PK\x03\x04'
+
+
+def _chunk_name(index):
+    return "chunks/" + ".".join(str(i) for i in index)
+
+
+def _encode(chunk, shuffle):
+    """Raw bytes of a chunk, with the bytes of each value grouped by significance when shuffle is set."""
+    chunk = np.ascontiguousarray(chunk)
+    if shuffle:
+        return chunk.view(np.uint8).reshape(-1, chunk.itemsize).T.tobytes()
+    return chunk.tobytes()
+
+
+def _decode(raw, dtype, shape, shuffle):
+    dtype = np.dtype(dtype)
+    values = np.frombuffer(raw, dtype=np.uint8)
+    if shuffle:
+        values = values.reshape(dtype.itemsize, -1).T.copy()
+    return values.view(dtype).reshape(shape)
+
+
+def cube_to_store(fname, store, chunks=(32, 32, 32), dtype=np.float64, compression="deflate", level=6,
+                  shuffle=True):
+    """
+    Convert a cube file to a chunked, compressed binary container.
+
+    The grid is cut into chunks that are compressed on their own and
+    written as members of a zip archive, next to a ``meta.json`` member
+    with the shape, dtype, chunk size and header metadata. The cube file
+    is streamed in slabs one chunk thick, so the whole grid is never in
+    memory.
+
+    Parameters
+    ----------
+    fname: filename of cube file, plain or compressed
+    store: filename of the container to write
+    chunks: tuple<int>, optional
+        Chunk shape. Default is (32, 32, 32).
+    dtype: np.dtype, optional
+        Data type of the stored values. Default is float64.
+    compression: str, optional
+        One of "deflate", "bz2", "lzma" or None. Default is "deflate".
+    level: int, optional
+        Compression level. Default is 6.
+    shuffle: bool, optional
+        Group the bytes of the values by significance before compressing,
+        which compresses floating point grids much better. Default is True.
+
+    Returns
+    --------
+    store: CubeStore
+
+    """
+    chunks = tuple(int(c) for c in chunks)
+    slabs = CubeSlabs(fname, thickness=chunks[0], dtype=dtype)
+    nx, ny, nz = slabs.shape
+    meta = {
+        "shape": [nx, ny, nz],
+        "chunks": list(chunks),
+        "dtype": np.dtype(dtype).str,
+        "shuffle": shuffle,
+        "cube_details": slabs.cube_details,
+    }
+
+    with zipfile.ZipFile(store, 'w', compression=_COMPRESSION[compression], compresslevel=level) as archive:
+        archive.writestr("meta.json", json.dumps(meta))
+        for x, slab in slabs:
+            for y in range(0, ny, chunks[1]):
+                for z in range(0, nz, chunks[2]):
+                    chunk = slab[:, y:y + chunks[1], z:z + chunks[2]]
+                    index = (x // chunks[0], y // chunks[1], z // chunks[2])
+                    archive.writestr(_chunk_name(index), _encode(chunk, shuffle))
+
+    return CubeStore(store)
+
+
+class CubeStore():
+    """
+    Read access to a container written by cube_to_store.
+
+    Indexing with slices decompresses only the chunks the selection
+    touches. ``data`` loads the whole grid.
+
+    Parameters
+    ----------
+    fname: filename of the container
+
+    """
+    def __init__(self, fname):
+        self.fname = fname
+        with zipfile.ZipFile(fname, 'r') as archive:
+            meta = json.loads(archive.read("meta.json"))
+        self.shape = tuple(meta["shape"])
+        self.chunks = tuple(meta["chunks"])
+        self.dtype = np.dtype(meta["dtype"])
+        self.shuffle = meta["shuffle"]
+        self.cube_details = meta["cube_details"]
+        self.cube_details['atoms'] = [tuple(atom) for atom in self.cube_details['atoms']]
+
+    @property
+    def data(self):
+        return self[:, :, :]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (3 - len(key))
+        ranges = []
+        for k, n in zip(key, self.shape):
+            if not isinstance(k, slice) or k.step not in (None, 1):
+                raise IndexError("CubeStore supports contiguous slices only")
+            ranges.append(k.indices(n)[:2])
+        return self._read_box(ranges)
+
+    def _read_box(self, box):
+        """Values in the half-open index box, decompressing only the chunks it overlaps."""
+        lower = np.array([lo for lo, hi in box])
+        upper = np.maximum(np.array([hi for lo, hi in box]), lower)
+        out = np.empty(upper - lower, dtype=self.dtype)
+        if out.size == 0:
+            return out
+
+        chunks = np.array(self.chunks)
+        first = lower // chunks
+        last = (upper - 1) // chunks
+        with zipfile.ZipFile(self.fname, 'r') as archive:
+            for index in np.ndindex(*(last - first + 1)):
+                index = first + np.array(index)
+                start = index * chunks
+                stop = np.minimum(start + chunks, self.shape)
+                chunk = _decode(archive.read(_chunk_name(index)), self.dtype, stop - start, self.shuffle)
+
+                src_lo = np.maximum(lower, start)
+                src_hi = np.minimum(upper, stop)
+                out[tuple(slice(a, b) for a, b in zip(src_lo - lower, src_hi - lower))] = \
+                    chunk[tuple(slice(a, b) for a, b in zip(src_lo - start, src_hi - start))]
+        return out
+
+    def region(self, box=None, bounds=None):
+        """
+        Read a subvolume given as an index box or a real-space bounding box,
+        with the same arguments and return values as cube_region_to_array.
+
+        """
+        if (box is None) == (bounds is None):
+            raise ValueError("Give exactly one of box or bounds")
+        if bounds is not None:
+            box = bounds_to_box(bounds, self.cube_details, self.shape)
+        box = tuple((max(int(lo), 0), min(int(hi), n)) for (lo, hi), n in zip(box, self.shape))
+        if any(hi <= lo for lo, hi in box):
+            raise ValueError(f"Empty region {box} for grid of shape {self.shape}")
+        return self._read_box(box), move_to_box(self.cube_details, box)
@@ -3,6 +3,12 @@ Unit and regression test for the blobs package.
 """
 
 # Import package, test suite, and other packages as needed
+import bz2
+import gzip
+import lzma
+import os
+
+import numpy as np
 import blobs
 import pytest
 import sys
@@ -10,3 +16,956 @@ import sys
 def test_blobs_imported():
     """Sample test, will always pass so long as import statement worked"""
     assert "blobs" in sys.modules
+
+
+TUTORIAL = os.path.join(os.path.dirname(blobs.__file__), "tutorial")
+DA_CUBE = os.path.join(TUTORIAL, "Da.cube")
+
+
+@pytest.fixture(autouse=True)
+def cache_home(tmp_path, monkeypatch):
+    """Default caches of the tests live in their temporary directory."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "xdg"))
+
+
+def read_lines(fname):
+    with open(fname) as handle:
+        return handle.readlines()
+
+
+def test_cube_to_array():
+    data, meta = blobs.cube_to_array(DA_CUBE)
+    assert data.shape == (59, 45, 59)
+    assert data.dtype == np.float64
+    assert meta["org"] == [-5.164228, -4.344111, -5.545709]
+    assert meta["xvec"] == [0.2, 0.0, 0.0]
+    assert [atom[0] for atom in meta["atoms"]] == [1, 6, 1, 8]
+    assert data[0, 0, 0] == 9.60691E-14
+    assert data[-1, -1, -1] == float(open(DA_CUBE).read().split()[-1])
+
+
+def test_cube_to_array_truncated(tmp_path):
+    lines = open(DA_CUBE).readlines()
+    truncated = tmp_path / "truncated.cube"
+    truncated.write_text("".join(lines[:-3]))
+    with pytest.raises(ValueError):
+        blobs.cube_to_array(str(truncated))
+
+
+@pytest.mark.parametrize("workers", [2, 5, None])
+def test_cube_to_array_workers(workers):
+    serial, meta = blobs.cube_to_array(DA_CUBE)
+    parallel, parallel_meta = blobs.cube_to_array(DA_CUBE, workers=workers)
+    assert parallel.tobytes() == serial.tobytes()
+    assert parallel_meta == meta
+
+
+def test_cube_to_array_workers_chunks(tmp_path, monkeypatch):
+    # Small chunks split the block in many pieces, each read and parsed by the thread that places it
+    monkeypatch.setattr(blobs.cube, "_CHUNK_BYTES", 4096)
+    data, meta = blobs.cube_to_array(DA_CUBE)
+    assert blobs.cube_to_array(DA_CUBE, workers=3)[0].tobytes() == data.tobytes()
+
+    # Lines of different lengths are placed by counting the line breaks before each chunk
+    lines = read_lines(DA_CUBE)[:10]
+    values = data.ravel()
+    for i in range(0, values.size, 6):
+        lines.append(" ".join(f"{val:g}" for val in values[i:i + 6]) + "\n")
+    ragged = tmp_path / "ragged.cube"
+    ragged.write_text("".join(lines))
+    assert blobs.cube_to_array(str(ragged), workers=3)[0].tobytes() == data.tobytes()
+
+
+def test_cube_to_array_workers_column_breaks(tmp_path):
+    data, meta = blobs.cube_to_array(DA_CUBE)
+    lines = open(DA_CUBE).readlines()[:10]
+    for column in data.reshape(-1, data.shape[2]):
+        for i in range(0, len(column), 6):
+            lines.append("".join(f" {val:.5E}" for val in column[i:i + 6]) + "\n")
+    columns = tmp_path / "columns.cube"
+    columns.write_text("".join(lines))
+
+    parallel, _ = blobs.cube_to_array(str(columns), workers=3)
+    assert parallel.tobytes() == data.tobytes()
+
+    region, _ = blobs.cube_region_to_array(str(columns), box=((3, 9), (40, 45), (7, 8)))
+    assert np.array_equal(region, data[3:9, 40:45, 7:8])
+
+
+def test_cube_cache(tmp_path):
+    cache = blobs.CubeCache(str(tmp_path / "cache"))
+    data, meta = blobs.cube_to_array(DA_CUBE)
+
+    cached, cached_meta = cache.load(DA_CUBE)
+    assert isinstance(cached, np.memmap)
+    assert np.array_equal(cached, data)
+    assert cached_meta == meta
+
+    again, _ = cache.load(DA_CUBE)
+    assert len(cache.info()) == 1
+    assert cache.nbytes() == data.nbytes
+
+    cache.clear()
+    assert cache.info() == []
+
+
+def test_cube_cache_eviction(tmp_path):
+    cache = blobs.CubeCache(str(tmp_path / "cache"), max_bytes=3 * 59 * 45 * 59 * 8)
+    for name in ["Da.cube", "Db.cube", "Ds.cube", "Dt.cube"]:
+        cache.load(os.path.join(TUTORIAL, name))
+    sources = [os.path.basename(entry["source"]) for entry in cache.info()]
+    assert sorted(sources) == ["Db.cube", "Ds.cube", "Dt.cube"]
+
+
+@pytest.mark.parametrize("thickness", [1, 4, 59, 100])
+def test_cube_slabs(thickness):
+    data, meta = blobs.cube_to_array(DA_CUBE)
+    slabs = blobs.CubeSlabs(DA_CUBE, thickness=thickness, block=4096)
+    assert slabs.shape == data.shape
+    assert slabs.cube_details == meta
+
+    starts = []
+    for x, slab in slabs:
+        starts.append(x)
+        assert slab.shape[1:] == data.shape[1:]
+        assert np.array_equal(slab, data[x:x + thickness])
+    assert len(starts) == len(slabs)
+
+
+def test_cube_volume_lazy():
+    data, meta = blobs.cube_to_array(DA_CUBE)
+    volume = blobs.CubeVolume(DA_CUBE)
+    assert not volume.loaded
+    assert volume.shape == (59, 45, 59)
+    assert volume.cube_details == meta
+    assert np.allclose(volume.axes, 0.2 * np.eye(3))
+    assert len(volume.atoms) == 4
+
+    with open(DA_CUBE, 'rb') as cube:
+        cube.seek(volume.offset)
+        assert float(cube.readline().split()[0]) == data[0, 0, 0]
+
+    assert np.array_equal(volume.data, data)
+    assert volume.loaded
+
+
+@pytest.mark.parametrize("box", [((0, 59), (0, 45), (0, 59)),
+                                 ((10, 20), (5, 6), (30, 41)),
+                                 ((58, 59), (44, 45), (50, 59))])
+def test_cube_region_to_array(box):
+    data, meta = blobs.cube_to_array(DA_CUBE)
+    region, region_meta = blobs.cube_region_to_array(DA_CUBE, box=box)
+    assert np.array_equal(region, data[tuple(slice(lo, hi) for lo, hi in box)])
+    assert region_meta["box"] == box
+    assert np.allclose(region_meta["org"], np.array(meta["org"]) + 0.2 * np.array([lo for lo, hi in box]))
+
+
+def test_cube_region_to_array_bounds():
+    data, meta = blobs.cube_to_array(DA_CUBE)
+    org = np.array(meta["org"])
+    bounds = [(org[k] + 1.05, org[k] + 2.05) for k in range(3)]
+    region, region_meta = blobs.cube_region_to_array(DA_CUBE, bounds=bounds)
+    assert region_meta["box"] == ((5, 12), (5, 12), (5, 12))
+    assert np.array_equal(region, data[5:12, 5:12, 5:12])
+
+
+@pytest.mark.parametrize("module", [gzip, bz2, lzma])
+def test_compressed_cube(tmp_path, module):
+    data, meta = blobs.cube_to_array(DA_CUBE)
+    compressed = tmp_path / "Da.cube.z"
+    with open(DA_CUBE, 'rb') as cube, module.open(str(compressed), 'wb') as out:
+        out.write(cube.read())
+
+    for workers in [1, 2]:
+        decompressed, decompressed_meta = blobs.cube_to_array(str(compressed), workers=workers)
+        assert decompressed.tobytes() == data.tobytes()
+        assert decompressed_meta == meta
+
+    slabs = [slab for x, slab in blobs.CubeSlabs(str(compressed), thickness=7)]
+    assert np.array_equal(np.concatenate(slabs), data)
+
+    region, _ = blobs.cube_region_to_array(str(compressed), box=((3, 9), (40, 45), (7, 8)))
+    assert np.array_equal(region, data[3:9, 40:45, 7:8])
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_cube_store(tmp_path, dtype):
+    data, meta = blobs.cube_to_array(DA_CUBE)
+    fname = str(tmp_path / "Da.blob")
+    store = blobs.cube_to_store(DA_CUBE, fname, chunks=(16, 20, 24), dtype=dtype)
+    assert store.shape == data.shape
+    assert store.cube_details == meta
+    assert os.path.getsize(fname) < data.astype(dtype).nbytes
+
+    loaded, loaded_meta = blobs.cube_to_array(fname)
+    assert loaded.dtype == dtype
+    assert np.array_equal(loaded, data.astype(dtype))
+    assert loaded_meta == meta
+
+    assert np.array_equal(store[10:40, 3:4, 50:], data[10:40, 3:4, 50:].astype(dtype))
+    box = ((10, 20), (5, 6), (30, 41))
+    region, region_meta = blobs.cube_region_to_array(fname, box=box)
+    expected, expected_meta = blobs.cube_region_to_array(DA_CUBE, box=box)
+    assert np.array_equal(region, expected.astype(dtype))
+    assert region_meta == expected_meta
+
+
+def test_float32_accuracy(tmp_path):
+    data, meta = blobs.cube_to_array(DA_CUBE)
+    single, single_meta = blobs.cube_to_array(DA_CUBE, dtype=np.float32)
+    assert single.dtype == np.float32
+    assert single.nbytes == data.nbytes // 2
+    assert single_meta == meta
+    assert np.allclose(single, data, rtol=2**-24, atol=0)
+    assert np.isclose(single.sum(dtype=np.float64), data.sum(), rtol=1e-6)
+
+    parallel, _ = blobs.cube_to_array(DA_CUBE, workers=3, dtype=np.float32)
+    assert parallel.tobytes() == single.tobytes()
+    slabs = [slab for x, slab in blobs.CubeSlabs(DA_CUBE, thickness=8, dtype=np.float32)]
+    assert np.concatenate(slabs).tobytes() == single.tobytes()
+    region, _ = blobs.cube_region_to_array(DA_CUBE, box=((3, 9), (40, 45), (7, 8)), dtype=np.float32)
+    assert np.array_equal(region, single[3:9, 40:45, 7:8])
+
+    cache = blobs.CubeCache(str(tmp_path / "cache"))
+    cached, _ = cache.load(DA_CUBE, dtype=np.float32)
+    assert cached.dtype == np.float32
+    assert np.array_equal(cached, single)
+    assert cache.load(DA_CUBE)[0].dtype == np.float64
+    assert len(cache.info()) == 2
+    # Cube files read without a dtype are float64 and share its entry
+    cache.load(DA_CUBE, dtype=np.float64)
+    assert len(cache.info()) == 2
+    assert cache.key(DA_CUBE) == cache.key(DA_CUBE, np.float64)
+
+
+def test_array_to_cube_round_trip(tmp_path):
+    data, meta = blobs.cube_to_array(DA_CUBE)
+    fname = str(tmp_path / "Da.cube")
+    blobs.array_to_cube(fname, data, meta)
+    written, written_meta = blobs.cube_to_array(fname)
+    assert written_meta == meta
+    assert np.array_equal(written, data)
+    assert read_lines(fname)[10:-1] == read_lines(DA_CUBE)[10:-1]
+
+    streamed = str(tmp_path / "streamed.cube.gz")
+    blobs.array_to_cube(streamed, blobs.CubeSlabs(DA_CUBE, thickness=7), meta)
+    assert blobs.cube_to_array(streamed)[0].tobytes() == data.tobytes()
+
+
+def test_array_to_cube_precision(tmp_path):
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(5, 4, 7))
+    meta = {"org": [-1.0 / 3.0, 0.5, 2.25], "xvec": [0.1, 0.0, 0.0], "yvec": [0.0, 0.1, 0.0],
+            "zvec": [0.0, 0.0, 0.1], "atoms": [(8, [8.0, 0.1234567891, 0.0, -1.0])]}
+    fname = str(tmp_path / "random.cube")
+    blobs.array_to_cube(fname, data, meta, precision=10)
+    written, written_meta = blobs.cube_to_array(fname)
+    assert written_meta == meta
+    assert np.allclose(written, data, rtol=1e-10, atol=0)
+
+
+def test_array_to_cube_formatting(tmp_path):
+    # Rounding ties, carries into the next power of ten, signed zeros, three digit exponents and non-finite values
+    values = [0.0, -0.0, 1.5, 9.999995, -9.9999949999, 0.125, 2.5e-5, 1e-100, -1e100, 5e-324, np.inf, np.nan]
+    values += [10.0 ** k for k in range(-99, 100, 7)]
+    data = np.array(values + [-1.0] * (-len(values) % 4)).reshape(1, 2, -1)
+    meta = {"org": [0.0, 0.0, 0.0], "xvec": [0.1, 0.0, 0.0], "yvec": [0.0, 0.1, 0.0], "zvec": [0.0, 0.0, 0.1],
+            "atoms": [(1, [1.0, 0.0, 0.0, 0.0])]}
+    fname = str(tmp_path / "edges.cube")
+    blobs.array_to_cube(fname, data, meta, block=5)
+    expected = [f"{value:12.5E}" for value in data.ravel()]
+    assert " ".join(read_lines(fname)[7:]).split() == [text.strip() for text in expected]
+
+
+def sphere_grid(n=40, scale=5.0):
+    x, y, z = np.mgrid[:n, :n, :n] - (n - 1) / 2
+    return np.exp(-np.sqrt(x * x + y * y + z * z) / scale)
+
+
+def closed_surface(faces):
+    """True if every directed edge of the mesh has its reverse in another triangle."""
+    edges = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])
+    directed = set(map(tuple, edges.tolist()))
+    return len(directed) == len(edges) and all((b, a) in directed for a, b in directed)
+
+
+def test_marching_cubes_sphere():
+    vertices, faces = blobs.marching_cubes(sphere_grid(), np.exp(-2))
+    assert closed_surface(faces)
+    assert len(vertices) - len(faces) * 3 // 2 + len(faces) == 2
+
+    radius = np.linalg.norm(vertices - 19.5, axis=1)
+    assert np.allclose(radius, 10, atol=0.2)
+
+    volume = np.einsum('ij,ij->i', vertices[faces[:, 0]], np.cross(vertices[faces[:, 1]], vertices[faces[:, 2]]))
+    assert np.isclose(volume.sum() / 6, 4 / 3 * np.pi * 10**3, rtol=0.01)
+
+
+def test_marching_cubes_cube_file():
+    data, meta = blobs.cube_to_array(DA_CUBE)
+    vertices, faces = blobs.marching_cubes(data, 0.03)
+    assert closed_surface(faces)
+    assert faces.max() == len(vertices) - 1
+
+    volume = blobs.CubeVolume(DA_CUBE)
+    placed, _ = blobs.marching_cubes(data, 0.03, origin=volume.origin, axes=volume.axes)
+    assert np.allclose(placed, volume.origin + 0.2 * vertices)
+
+
+def test_isosurfaces_levels():
+    # A positive sphere next to a negative one, each lobe's levels are spheres of known radius
+    sphere = sphere_grid()
+    data = np.concatenate([sphere, -sphere])
+    levels = [np.exp(-1), -np.exp(-2), np.exp(-2), -np.exp(-1)]
+    meshes = blobs.isosurfaces(data, levels)
+    assert len(meshes) == len(levels)
+    for (vertices, faces), level in zip(meshes, levels):
+        radius = -5 * np.log(abs(level))
+        centre = np.array([19.5 if level > 0 else 59.5, 19.5, 19.5])
+        assert closed_surface(faces)
+        assert np.allclose(np.linalg.norm(vertices - centre, axis=1), radius, atol=0.2)
+        # Normals point out of the lobe, so the signed volume is positive for both signs
+        assert np.isclose(mesh_volume(vertices, faces), 4 / 3 * np.pi * radius**3, rtol=0.03)
+
+
+def mesh_volume(vertices, faces):
+    a, b, c = (vertices[faces[:, n]] for n in range(3))
+    return np.einsum('ij,ij->i', a, np.cross(b, c)).sum() / 6
+
+
+def test_decimate_sphere():
+    vertices, faces = blobs.marching_cubes(sphere_grid(), np.exp(-2))
+    small_vertices, small_faces = blobs.decimate(vertices, faces, target=0.25)
+    assert len(small_faces) <= len(faces) // 4
+    assert closed_surface(small_faces)
+    assert len(small_vertices) - len(small_faces) * 3 // 2 + len(small_faces) == 2
+    assert np.isclose(mesh_volume(small_vertices, small_faces), mesh_volume(vertices, faces), rtol=0.01)
+
+    bounded_vertices, bounded_faces = blobs.decimate(vertices, faces, max_error=1e-3)
+    assert len(bounded_faces) < len(faces)
+    assert np.allclose(np.linalg.norm(bounded_vertices - 19.5, axis=1), 10, atol=0.25)
+
+    # Collapsed vertices stay within max_error of the planes of the faces they replace
+    deviation = np.abs(np.linalg.norm(vertices - 19.5, axis=1) - 10).max()
+    for max_error in [0.05, 0.2]:
+        bounded_vertices, bounded_faces = blobs.decimate(vertices, faces, max_error=max_error)
+        assert len(bounded_faces) < len(faces)
+        assert np.abs(np.linalg.norm(bounded_vertices - 19.5, axis=1) - 10).max() <= deviation + max_error
+
+    with pytest.raises(ValueError):
+        blobs.decimate(vertices, faces)
+
+
+def test_smooth_and_normals():
+    vertices, faces = blobs.marching_cubes(sphere_grid(), np.exp(-2))
+    volume = mesh_volume(vertices, faces)
+    taubin = blobs.smooth(vertices, faces, iterations=20)
+    laplacian = blobs.smooth(vertices, faces, iterations=20, method="laplacian")
+    assert abs(mesh_volume(taubin, faces) / volume - 1) < 0.01
+    assert mesh_volume(laplacian, faces) < 0.95 * volume
+
+    # Normals point towards lower values, away from the centre of the sphere
+    normals = blobs.vertex_normals(vertices, faces)
+    assert np.allclose(np.linalg.norm(normals, axis=1), 1)
+    outward = (vertices - 19.5) / np.linalg.norm(vertices - 19.5, axis=1, keepdims=True)
+    assert np.einsum('ij,ij->i', normals, outward).min() > 0.9
+
+
+def test_mesh_cache(tmp_path):
+    fname = os.path.join(TUTORIAL, "Psi_a_8_8-A.cube")
+    cache = blobs.MeshCache(directory=str(tmp_path), max_entries=2)
+    meshes, meta = cache.isosurfaces(fname, [0.03, -0.03])
+    assert cache.stats() == {"hits": 0, "disk_hits": 0, "misses": 2, "entries": 2}
+    assert meta == blobs.cube_to_array(fname)[1]
+    for (vertices, faces), level in zip(meshes, [0.03, -0.03]):
+        assert np.array_equal(faces, blobs.marching_cubes(blobs.cube_to_array(fname)[0], level)[1])
+
+    again, _ = cache.isosurfaces(fname, [-0.03, 0.03])
+    assert cache.hits == 2 and cache.misses == 2
+    assert np.array_equal(again[0][1], meshes[1][1])
+
+    # Different settings are different entries, and the oldest drops out of memory
+    cache.isosurfaces(fname, [0.03], simplify=0.5)
+    assert cache.misses == 3 and cache.stats()["entries"] == 2
+
+    fresh = blobs.MeshCache(directory=str(tmp_path))
+    stored, stored_meta = fresh.isosurfaces(fname, [0.03, -0.03])
+    assert fresh.stats() == {"hits": 0, "disk_hits": 2, "misses": 0, "entries": 2}
+    assert stored_meta == meta
+    assert np.array_equal(stored[0][0], meshes[0][0])
+
+    fresh.clear()
+    assert not os.listdir(str(tmp_path))
+
+
+def test_downsample():
+    data = np.arange(5 * 4 * 3, dtype=np.float64).reshape(5, 4, 3)
+    coarse = blobs.downsample(data, 2)
+    assert coarse.shape == (3, 2, 2)
+    assert coarse[0, 0, 0] == data[:2, :2, :2].mean()
+    padded = np.pad(data, [(0, 1), (0, 0), (0, 1)], mode='edge')
+    assert coarse[2, 1, 1] == padded[4:, 2:, 2:].mean()
+
+    signed = np.zeros((2, 2, 2))
+    signed[1, 0, 1] = -3.0
+    signed[0, 1, 1] = 2.0
+    assert blobs.downsample(signed, 2, method="maxabs")[0, 0, 0] == -3.0
+    with pytest.raises(ValueError):
+        blobs.downsample(signed, 2, method="median")
+
+
+def test_pyramid(tmp_path):
+    fname = os.path.join(TUTORIAL, "Psi_a_8_8-A.cube")
+    data, meta = blobs.cube_to_array(fname)
+    pyramid = blobs.build_pyramid(fname, levels=3, method="maxabs")
+    assert sorted(pyramid) == [1, 2, 3]
+    for level, (coarse, coarse_meta) in pyramid.items():
+        assert np.array_equal(coarse, blobs.downsample(data, 2**level, method="maxabs"))
+        assert np.allclose(coarse_meta['xvec'], 2**level * np.array(meta['xvec']))
+        assert coarse_meta['atoms'] == meta['atoms']
+
+    # The origin of a coarse grid is the centre of its first block
+    origin = np.array(pyramid[1][1]['org'])
+    block = 0.5 * np.sum([meta['xvec'], meta['yvec'], meta['zvec']], axis=0)
+    assert np.allclose(origin, np.array(meta['org']) + block)
+    assert np.allclose(blobs.to_full_grid(np.zeros(3), 1), 0.5)
+
+    shape = blobs.grid_shape(fname)
+    assert shape == data.shape
+    assert blobs.pick_level(shape, data.size) == 0
+    assert blobs.pick_level(shape, pyramid[1][0].size) == 1
+    assert blobs.pick_level(shape, pyramid[1][0].size - 1) == 2
+    assert blobs.pick_level(shape, 1) == 3
+
+    cache = blobs.CubeCache(directory=str(tmp_path))
+    cached, cached_meta = cache.load(fname, level=2, method="maxabs")
+    assert np.array_equal(cached, pyramid[2][0])
+    assert cached_meta == pyramid[2][1]
+    assert len(cache.info()) == 3
+
+    # Levels stored after the requested one do not evict it, even when the cap only holds that level
+    small = blobs.CubeCache(directory=str(tmp_path / "small"), max_bytes=180000)
+    cached, cached_meta = small.load(DA_CUBE, level=1)
+    assert np.array_equal(cached, blobs.build_pyramid(DA_CUBE, levels=1)[1][0])
+    assert small.nbytes() <= 180000
+
+
+def test_load_grid_default_cache(tmp_path, monkeypatch):
+    builds = []
+    build = blobs.cache.build_pyramid
+    monkeypatch.setattr(blobs.cache, "build_pyramid",
+                        lambda *args, **kwargs: builds.append(args) or build(*args, **kwargs))
+
+    # Coarse levels are saved on first use, so zooming does not parse the file again
+    for level in [1, 2, 1, 3]:
+        data, meta = blobs.load_grid(DA_CUBE, level=level)
+        assert np.array_equal(data, blobs.build_pyramid(DA_CUBE, levels=[level])[level][0])
+    assert len(builds) == 1
+    assert len(blobs.CubeCache(str(tmp_path / "xdg" / "blobs")).info()) == 3
+
+    data, meta = blobs.load_grid(DA_CUBE, level=1, cache=False)
+    assert not isinstance(data, np.memmap) and len(builds) == 1
+    assert not isinstance(blobs.load_grid(DA_CUBE)[0], np.memmap)
+
+
+def test_crop_to_significant():
+    data, meta = blobs.cube_to_array(os.path.join(TUTORIAL, "Psi_a_8_8-A.cube"))
+    box = blobs.significant_box(data, 0.03)
+    assert all(hi - lo < n for (lo, hi), n in zip(box, data.shape))
+    significant = np.abs(data) >= 0.03
+    inside = np.zeros_like(significant)
+    inside[tuple(slice(lo, hi) for lo, hi in box)] = True
+    assert not (significant & ~inside).any()
+    assert blobs.significant_box(data, 1e3) == tuple((0, n) for n in data.shape)
+
+    cropped, cropped_meta = blobs.crop_to_significant(data, meta, 0.03)
+    assert cropped_meta['box'] == box
+    assert meta.get('box') is None
+    axes = np.array([meta['xvec'], meta['yvec'], meta['zvec']])
+    assert np.allclose(cropped_meta['org'], np.array(meta['org']) + np.array([lo for lo, hi in box]) @ axes)
+
+    # Surfaces of the cropped grid are the full surfaces moved by the box corner
+    for level in (0.03, -0.03):
+        vertices, faces = blobs.marching_cubes(data, level)
+        cropped_vertices, cropped_faces = blobs.marching_cubes(cropped, level)
+        assert len(cropped_faces) == len(faces)
+        assert np.allclose(np.sort(cropped_vertices + [lo for lo, hi in box], axis=0), np.sort(vertices, axis=0))
+
+
+def test_cube_region_to_array_step():
+    data, meta = blobs.cube_to_array(DA_CUBE)
+    box = ((3, 50), (0, 45), (10, 59))
+    sampled, sampled_meta = blobs.cube_region_to_array(DA_CUBE, box=box, step=4)
+    assert np.array_equal(sampled, data[3:50:4, 0:45:4, 10:59:4])
+    assert sampled_meta["step"] == 4
+    assert np.allclose(sampled_meta["xvec"], 4 * np.array(meta["xvec"]))
+
+
+def test_progressive_steps():
+    assert blobs.progressive_steps((59, 45, 59), preview_voxels=10**6) == []
+    steps = blobs.progressive_steps((59, 45, 59), preview_voxels=2000)
+    assert steps == [8, 4, 2]
+    assert np.prod([-(-n // 8) for n in (59, 45, 59)]) <= 2000
+    assert blobs.progressive_steps((500, 500, 500), preview_voxels=2**16, final_step=2) == [16, 8, 4]
+
+
+def test_sampled_isosurfaces():
+    fname = os.path.join(TUTORIAL, "Psi_a_8_8-A.cube")
+    data, meta = blobs.cube_to_array(fname)
+    vertices, faces = blobs.marching_cubes(data, 0.03)
+    for crop in [None, 0.03]:
+        coarse, coarse_faces = blobs.sampled_isosurfaces(fname, [0.03], 2, crop=crop)[0]
+        assert closed_surface(coarse_faces)
+        assert np.allclose(coarse.mean(axis=0), vertices.mean(axis=0), atol=0.5)
+
+
+def test_sampled_isosurfaces_ragged(tmp_path):
+    data, meta = blobs.cube_to_array(DA_CUBE)
+    lines = open(DA_CUBE).readlines()[:10]
+    values = data.ravel()
+    for i in range(0, values.size, 6):
+        lines.append(" ".join(f"{val:g}" for val in values[i:i + 6]) + "\n")
+    ragged = tmp_path / "ragged.cube"
+    ragged.write_text("".join(lines))
+    with pytest.raises(ValueError, match="not fixed width"):
+        blobs.cube_region_to_array(str(ragged), box=((0, 59), (0, 45), (0, 59)), step=2)
+
+    for crop in [None, 0.01]:
+        expected = blobs.sampled_isosurfaces(DA_CUBE, [0.01, 0.1], 2, crop=crop)
+        for (vertices, faces), (expected_vertices, expected_faces) in \
+                zip(blobs.sampled_isosurfaces(str(ragged), [0.01, 0.1], 2, crop=crop), expected):
+            assert len(faces) > 0
+            assert np.allclose(vertices, expected_vertices)
+            assert np.array_equal(faces, expected_faces)
+
+
+def test_progressive_render():
+    import asyncio
+    import threading
+    import plotly.graph_objects as go
+
+    def mesh(scale):
+        vertices, faces = blobs.marching_cubes(sphere_grid(12), np.exp(-1))
+        return [(vertices * scale, faces)]
+
+    figure = go.Figure(data=[go.Mesh3d(x=[], y=[], z=[], i=[], j=[], k=[])])
+    render = blobs.ProgressiveRender(figure, [0], [lambda: mesh(1), lambda: mesh(2)]).start()
+    assert render.wait(10) and render.done
+    assert render.stage == 2
+    assert np.allclose(figure.data[0].x, mesh(2)[0][0][:, 0])
+
+    # A cancelled render drops the stage it was computing and runs no more
+    release = threading.Event()
+
+    def slow():
+        release.wait(10)
+        return mesh(3)
+
+    render = blobs.ProgressiveRender(figure, [0], [slow, lambda: mesh(4)]).start()
+    render.cancel()
+    release.set()
+    assert render.wait(10) and render.done
+    assert render.stage == 0
+    assert np.allclose(figure.data[0].x, mesh(2)[0][0][:, 0])
+
+    render = blobs.ProgressiveRender(figure, [0], [lambda: 1 / 0]).start()
+    render.wait(10)
+    assert isinstance(render.error, ZeroDivisionError)
+
+    # Inside a running event loop, stages are displayed by the thread of the loop, not by the worker
+    async def in_loop():
+        render = blobs.ProgressiveRender(figure, [0], [lambda: mesh(5)])
+        shown = []
+        show_finished = render.show_finished
+        render.show_finished = lambda: shown.append(threading.get_ident()) or show_finished()
+        render.start()
+        while not render.done:
+            await asyncio.sleep(0.01)
+        return shown
+
+    assert asyncio.run(asyncio.wait_for(in_loop(), 10)) == [threading.get_ident()]
+    assert np.allclose(figure.data[0].x, mesh(5)[0][0][:, 0])
+
+    # Results other than the meshes are handed over on the thread owning the figure too
+    results = []
+    render = blobs.ProgressiveRender(figure, [0], [lambda: (mesh(6), "coarse"), lambda: (mesh(7), "fine")],
+                                     on_display=lambda result: results.append((result, threading.get_ident())))
+    assert render.start().wait(10)
+    assert results == [("coarse", threading.get_ident()), ("fine", threading.get_ident())]
+
+
+def test_cube_plot_progressive(monkeypatch):
+    import IPython.display
+    import plotly.graph_objects as go
+
+    shown = []
+    monkeypatch.setattr(go, "FigureWidget", go.Figure)
+    monkeypatch.setattr(IPython.display, "display", shown.append)
+    fname = os.path.join(TUTORIAL, "Psi_a_8_8-A.cube")
+    cube = bare_cube()
+    cube.plot(fname, cube_type="orbital", plot_bonds=False, crop=True, progressive=True, preview_voxels=2000)
+    figure, = shown
+    # The first preview has no metadata, the final stage sets it on this thread
+    assert cube.meta is None
+    assert cube.render.wait(10) and cube.render.stage == len(cube.render.stages)
+    levels, colors = blobs.surface_levels(0.03, "orbital")
+    assert cube.meta == blobs.surface_meshes(fname, levels, method="maxabs", crop=0.03, uncrop=True)[1]
+    vertices = blobs.marching_cubes(blobs.cube_to_array(fname)[0], 0.03)[0]
+    assert np.allclose(np.mean(figure.data[0].x), vertices[:, 0].mean(), atol=1e-3)
+
+    with pytest.raises(ValueError):
+        cube.plot(fname, mode="volume", progressive=True)
+    with pytest.raises(ValueError):
+        cube.plot(fname, mode="slices")
+
+
+def test_isosurfaces_workers():
+    data, meta = blobs.cube_to_array(os.path.join(TUTORIAL, "Psi_a_8_8-A.cube"))
+    levels = list(np.linspace(-0.1, 0.1, 9))
+    serial = blobs.isosurfaces(data, levels)
+    threaded = blobs.isosurfaces(data, levels, workers=4)
+    for (vertices, faces), (threaded_vertices, threaded_faces) in zip(serial, threaded):
+        assert np.array_equal(vertices, threaded_vertices)
+        assert np.array_equal(faces, threaded_faces)
+
+    simplified = blobs.postprocess_meshes(serial[:2], simplify=0.5, workers=2)
+    assert [len(faces) for vertices, faces in simplified] == \
+        [len(blobs.decimate(vertices, faces, target=0.5)[1]) for vertices, faces in serial[:2]]
+
+
+def bare_cube():
+    """Cube without a wavefunction, with one atom placed at voxel (30, 20, 30)."""
+    cube = blobs.Cube.__new__(blobs.Cube)
+    cube.info = {"x": np.array([30]), "y": np.array([20]), "z": np.array([30]), "sym": ["O"],
+                 "color": ["red"], "size": np.array([20])}
+    cube.bonds = []
+    cube.meta = cube.render = cube.viewer = None
+    return cube
+
+
+def test_cube_slider(monkeypatch):
+    import plotly.graph_objects as go
+
+    shown = []
+    monkeypatch.setattr(go.Figure, "show", lambda figure, *args, **kwargs: shown.append(figure))
+    fname = os.path.join(TUTORIAL, "Psi_a_8_8-A.cube")
+    bare_cube().slider(fname, [0.03, 0.1], cube_type="orbital", plot_bonds=False, workers=1)
+    figure, = shown
+
+    data, meta = blobs.cube_to_array(fname)
+    steps = figure.layout.sliders[0].steps
+    assert [step.label for step in steps] == ["0.03", "0.1"]
+    for step, iso in zip(steps, [0.03, 0.1]):
+        restyle, traces = step.args
+        assert step.method == "restyle" and list(traces) == [0, 1]
+        assert sorted(restyle) == ["i", "j", "k", "x", "y", "z"]
+        for trace, level in zip(traces, [iso, -iso]):
+            vertices, faces = blobs.marching_cubes(data, level)
+            assert len(restyle["x"][trace]) == len(vertices)
+            assert np.array_equal(np.stack([restyle[name][trace] for name in "ijk"], axis=1), faces)
+
+    # The figure opens on the first step
+    assert np.allclose(figure.data[0].x, steps[0].args[0]["x"][0])
+    assert np.array_equal(figure.data[1].i, steps[0].args[0]["i"][1])
+
+
+def test_cube_viewer():
+    fname = os.path.join(TUTORIAL, "Psi_a_8_8-A.cube")
+    viewer = blobs.CubeViewer(bare_cube(), plot_bonds=False, widget=False)
+    atoms = viewer.figure.data[0]
+    viewer.update(cube_file=fname, iso=0.03, cube_type="orbital")
+    assert viewer.extractions == 1
+    assert len(viewer.figure.data) == 3
+    assert viewer.figure.data[0] is atoms
+
+    viewer.update(colorscale="Greens")
+    assert viewer.extractions == 1
+    assert viewer.figure.data[1].color != viewer.figure.data[2].color
+
+    viewer.update(iso=0.03)
+    assert viewer.extractions == 1
+    viewer.update(iso=[0.03, 0.1], cube_type="density")
+    assert viewer.extractions == 2
+    assert len(viewer.figure.data) == 3
+    expected = blobs.marching_cubes(blobs.cube_to_array(fname)[0], 0.1)[1]
+    assert np.array_equal(viewer.figure.data[2].i, expected[:, 0])
+
+    viewer.update(iso=0.05, crop=True)
+    assert len(viewer.figure.data) == 2
+    vertices = blobs.marching_cubes(blobs.cube_to_array(fname)[0], 0.05)[0]
+    assert np.allclose(np.mean(viewer.figure.data[1].x), vertices[:, 0].mean())
+
+    with pytest.raises(ValueError):
+        viewer.update(isovalue=0.1)
+
+
+def test_bond_lines():
+    positions = np.array([[0.0, 0.0, 0.0], [1.8, 0.0, 0.0], [-0.5, 1.7, 0.0]])
+    bonds = blobs.build_bond_list(positions)
+    points, atoms = blobs.bond_lines(positions, bonds)
+
+    assert points.shape == (6 * len(bonds), 3)
+    segments = points.reshape(-1, 3, 3)
+    assert np.isnan(segments[:, 2]).all()
+    assert np.allclose(segments[:, 0], positions[[0, 0, 1, 2]])
+    assert np.allclose(segments[:2, 1], segments[2:, 1])
+    assert np.allclose(segments[0, 1], [0.9, 0.0, 0.0])
+    assert atoms.tolist() == [0] * 6 + [1] * 3 + [2] * 3
+
+    trace = blobs.bond_trace(positions, bonds, ["red", "white", "red"], width=3)
+    assert trace.mode == "lines" and trace.line.width == 3
+    assert len(trace.x) == len(points)
+    assert [color for value, color in trace.line.colorscale] == ["red", "white"]
+    assert trace.line.color.tolist() == [0] * 6 + [1] * 3 + [0] * 3
+
+
+def test_encoding():
+    points = np.random.default_rng(0).uniform(-3, 7, size=(500, 3))
+    encoded = blobs.encode_array(points, np.float32)
+    assert encoded["dtype"] == "f4"
+    assert np.array_equal(blobs.decode_array(encoded), points.astype(np.float32).ravel())
+
+    for max_error, dtype in [(0.1, "u1"), (1e-3, "u2")]:
+        quantized = blobs.quantize(points, max_error)
+        assert quantized["dtype"] == dtype
+        assert np.abs(blobs.decode_array(quantized).reshape(-1, 3) - points).max() <= max_error
+    with pytest.raises(ValueError):
+        blobs.quantize(points, 1e-6)
+
+    assert blobs.index_dtype(2**16) == np.uint16 and blobs.index_dtype(2**16 + 1) == np.uint32
+    vertices, faces = blobs.compact_mesh(points, np.array([[0, 1, 2]]))
+    assert vertices.dtype == np.float32 and faces.dtype == np.uint16
+    trace = blobs.mesh_trace(points, np.array([[0, 1, 2]]), "red")
+    assert trace.x.dtype == np.float32 and trace.i.dtype == np.uint16
+
+
+def test_render_backends(tmp_path):
+    import json
+
+    vertices, faces = blobs.marching_cubes(sphere_grid(12), np.exp(-1))
+    positions = np.array([[0.0, 0.0, 0.0], [1.8, 0.0, 0.0], [-0.5, 1.7, 0.0]])
+    scene = blobs.Scene(title="water")
+    scene.add_mesh(vertices, faces, "rgb(8, 48, 107)")
+    scene.add_atoms(positions, ["#ff0000", "rgba(232, 232, 232, 1.0)", "#fff"], [30, 20, 20])
+    scene.add_bonds(blobs.build_bond_list(positions))
+    scene.add_frame(positions + 0.1)
+
+    fig = blobs.get_backend("plotly").figure(scene)
+    assert [trace.type for trace in fig.data] == ["mesh3d", "scatter3d", "scatter3d"]
+    assert len(fig.frames) == 1 and list(fig.frames[0].traces) == [1, 2]
+
+    page = blobs.get_backend("webgl").html(scene)
+    payload = json.loads(page.split("const scene = ")[1].split(";\n(function")[0])
+    assert payload["title"] == "water"
+    mesh = payload["meshes"][0]
+    assert mesh["positions"]["dtype"] == "f4" and mesh["indices"]["dtype"] == "u2"
+    assert np.allclose(blobs.decode_array(mesh["positions"]), vertices.ravel(), atol=1e-5)
+    assert np.array_equal(blobs.decode_array(mesh["indices"]), faces.ravel())
+    colors = blobs.decode_array(payload["atoms"]["colors"])
+    assert np.allclose(colors[:6], [1, 0, 0, 232 / 255, 232 / 255, 232 / 255], atol=1e-4)
+    assert blobs.decode_array(payload["bonds"]["pairs"]).tolist() == [0, 1, 0, 2]
+
+    quantized = blobs.WebGLBackend(quantize=0.01).payload(scene)["meshes"][0]["positions"]
+    assert quantized["dtype"] == "u2"
+    assert np.abs(blobs.decode_array(quantized) - vertices.ravel()).max() <= 0.01
+    assert len(payload["frames"]) == 1
+
+    fname = str(tmp_path / "scene.html")
+    blobs.get_backend("webgl").show(scene, filename=fname)
+    with open(fname) as html:
+        assert html.read() == page
+
+    # Cube.plot hands its scene to any registered backend
+    class Recorder():
+        def show(self, scene, filename=None):
+            self.scene = scene
+
+    recorder = Recorder()
+    blobs.register_backend("recorder", recorder)
+    cube = bare_cube()
+    cube.plot(os.path.join(TUTORIAL, "Psi_a_8_8-A.cube"), cube_type="orbital", plot_bonds=False,
+              backend="recorder")
+    assert len(recorder.scene.meshes) == 2
+    assert recorder.scene.atoms["positions"].tolist() == [[30, 20, 30]]
+    with pytest.raises(ValueError):
+        cube.plot(os.path.join(TUTORIAL, "Psi_a_8_8-A.cube"), mode="isosurface", backend="recorder")
+    with pytest.raises(ValueError):
+        blobs.get_backend("povray")
+
+
+def test_rasterize(tmp_path):
+    import struct
+    import zlib
+
+    vertices, faces = blobs.marching_cubes(sphere_grid(20), np.exp(-1))
+    scene = blobs.Scene()
+    scene.add_mesh(vertices, faces, "rgb(0, 0, 255)", opacity=1.0)
+    centre = vertices.mean(axis=0)
+    scene.add_atoms(centre + [[0, 0, 0], [0, 8, 0]], ["Red", "#00ff00"], [30, 30])
+    scene.add_bonds([[0, 1, 8.0]])
+
+    # Seen from above, the opaque surface hides the atom at its centre, the other atom lies outside of it
+    image = blobs.rasterize(scene, 120, 100, blobs.Camera(elevation=90))
+    assert image.shape == (100, 120, 4) and image.dtype == np.uint8
+    assert image[0, 0].tolist() == [255, 255, 255, 255]
+    middle = image[50, 60]
+    assert middle[2] > 100 and middle[0] < 50
+    green = image[..., 1].astype(int) - image[..., 0] - image[..., 2]
+    assert (green > 100).any()
+
+    # A translucent surface behind the opaque one does not show through it
+    scene.add_mesh(vertices - [0, 0, 5], faces, "Red", opacity=0.5)
+    assert np.array_equal(blobs.rasterize(scene, 120, 100, blobs.Camera(elevation=90))[50, 60], middle)
+    scene.add_mesh(vertices + [0, 0, 5], faces, "Red", opacity=0.5)
+    assert blobs.rasterize(scene, 120, 100, blobs.Camera(elevation=90))[50, 60, 0] > middle[0]
+    del scene.meshes[1:]
+
+    scene.meshes[0]["opacity"] = 0.2
+    middle = blobs.rasterize(scene, 120, 100, blobs.Camera(elevation=90))[50, 60]
+    assert middle[0] > middle[1] and middle[0] > 100
+
+    assert blobs.get_backend("png").image(blobs.Scene(size=0.25)).shape == (125, 125, 4)
+    clear = blobs.rasterize(scene, 120, 100, background=None)
+    assert clear[0, 0, 3] == 0 and clear[..., 3].max() == 255
+
+    png = blobs.png_bytes(image)
+    assert png[:8] == b"\x89PNG\r\n\x1a\n"
+    assert struct.unpack(">II", png[16:24]) == (120, 100)
+    length = struct.unpack(">I", png[33:37])[0]
+    rows = np.frombuffer(zlib.decompress(png[41:41 + length]), np.uint8).reshape(100, -1)
+    assert np.array_equal(rows[:, 1:].reshape(100, 120, 4), image)
+
+    fname = str(tmp_path / "orbital.png")
+    bare_cube().plot(os.path.join(TUTORIAL, "Psi_a_8_8-A.cube"), cube_type="orbital", plot_bonds=False,
+                     backend="png", filename=fname)
+    with open(fname, "rb") as out:
+        assert out.read(8) == png[:8]
+
+
+def test_freq_viewer():
+    freq = blobs.Freq.__new__(blobs.Freq)
+    freq.geo = np.array([[0.0, 0.0, 0.0], [1.8, 0.0, 0.0], [-0.5, 1.7, 0.0]])
+    freq.sym = ["O", "H", "H"]
+    freq.info = {"color": ["red", "white", "white"], "size": np.array([30, 20, 20])}
+    freq.frequencies = np.array([1600.0, 3700.0])
+    norm = np.zeros((2, 3, 3))
+    norm[1, 1, 0] = 1.0
+    freq.get_norm = lambda: norm
+
+    viewer = blobs.FreqViewer(freq, widget=False)
+    traces = list(viewer.figure.data)
+    assert len(traces) == 2
+    viewer.update(1, amplitude=0.5)
+    assert all(a is b for a, b in zip(viewer.figure.data, traces))
+    assert viewer.figure.data[0].x[1] == 2.3
+    assert viewer.figure.data[1].x[6] == 2.3
+    assert viewer.figure.layout.title.text == "Frequency: 3700.00 1/cm"
+
+
+def test_volume(tmp_path):
+    grid = sphere_grid(24)
+    tables = blobs.transfer_function("Blues")
+    assert tables[0].shape == (256, 3) and tables[1] is None
+
+    # Rays through the centre cross more of the sphere than rays near its edge
+    origins = np.array([[11.5, 11.5, -5.0], [11.5, 2.0, -5.0], [40.0, 40.0, -5.0]])
+    color, transmittance = blobs.ray_march(grid, origins, np.array([0.0, 0.0, 1.0]), 0, 40, 64, tables,
+                                           0.05, 1.0, opacity=1.0)
+    assert transmittance[0] < transmittance[1] < transmittance[2] == 1
+    assert color[2].tolist() == [0, 0, 0]
+    hidden = blobs.ray_march(grid, origins[:1], np.array([0.0, 0.0, 1.0]), 0, 40, 64, tables, 0.05, 1.0,
+                             opacity=1.0, stop=np.array([2.0]))[1]
+    assert hidden[0] == 1
+
+    # Bigger grids and tighter budgets go to coarser levels
+    assert blobs.volume_budget((24, 24, 24), 100, latency=10) == (0, 42)
+    assert blobs.volume_budget((512, 512, 512), 10**6, latency=0.1)[0] == 3
+    level, samples = blobs.volume_budget((64, 64, 64), 10**4, latency=1)
+    assert blobs.volume_budget((64, 64, 64), 10**4, latency=0.01)[0] >= level
+    # A slower machine than the one measured with march_rate goes to a coarser level
+    rate = blobs.march_rate()
+    assert rate > 0
+    assert blobs.volume_budget((128, 128, 128), 1000, rate=rate / 1000)[0] > \
+        blobs.volume_budget((128, 128, 128), 1000, rate=rate)[0]
+
+    scene = blobs.Scene()
+    scene.add_volume(grid, threshold=0.05, latency=0.1)
+    image = blobs.rasterize(scene, 60, 60)
+    assert image[0, 0].tolist() == [255, 255, 255, 255]
+    middle = image[30, 30].astype(int)
+    assert middle[2] > middle[0] and middle[0] < 200
+
+    traces = blobs.get_backend("plotly").figure(scene).data
+    assert [trace.type for trace in traces] == ["volume"]
+    assert traces[0].value.max() <= 1 and len(traces[0].x) == grid.size // 8
+
+    fname = str(tmp_path / "orbital.png")
+    bare_cube().plot(os.path.join(TUTORIAL, "Psi_a_8_8-A.cube"), cube_type="orbital", mode="volume",
+                     plot_bonds=False, backend="png", filename=fname, latency=0.1)
+    assert os.path.getsize(fname) > 0
+    with pytest.raises(ValueError):
+        blobs.get_backend("webgl").html(scene)
+
+
+def test_cli(tmp_path):
+    import csv
+    from blobs.cli import main
+
+    fname = os.path.join(TUTORIAL, "Da.cube")
+    cube = blobs.Cube.from_file(fname)
+    assert cube.info["sym"] == ["H", "C", "H", "O"]
+    assert [bond[:2] for bond in cube.bonds] == [[0, 1], [1, 2], [1, 3]]
+    data, cube_details = blobs.cube_to_array(fname)
+    assert np.isclose(cube.origin[0] + cube.info["x"][3] * cube.spacing[0], cube_details["atoms"][3][1][1])
+
+    inputs, out = tmp_path / "in", tmp_path / "out"
+    inputs.mkdir()
+    for name in ("Da.cube", "Psi_a_8_8-A.cube"):
+        with open(os.path.join(TUTORIAL, name), "rb") as source:
+            (inputs / name).write_bytes(source.read())
+    (inputs / "broken.cube").write_text("not a cube file\n")
+
+    assert main([str(inputs), "-o", str(out), "-j", "1", "--size", "0.2"]) == 1
+    with open(out / "timings.csv") as summary:
+        rows = {os.path.basename(row["file"]): row for row in csv.DictReader(summary)}
+    assert [rows[name]["status"] for name in sorted(rows)] == ["rendered", "rendered", "failed"]
+    assert (out / "Da.png").read_bytes()[:8] == b"\x89PNG\r\n\x1a\n"
+    assert sorted(name for name in os.listdir(out) if not name.startswith(".")) == \
+        ["Da.png", "Psi_a_8_8-A.png", "timings.csv"]
+
+    # Up to date outputs are skipped until their cube file or their options change
+    jobs = [(str(inputs / name), str(out / name.replace(".cube", ".png")), {"size": 0.2})
+            for name in ("Da.cube", "Psi_a_8_8-A.cube")]
+    assert [row[2] for row in blobs.cli.render_batch(jobs, workers=1)] == ["rendered", "rendered"]
+    assert [row[2] for row in blobs.cli.render_batch(jobs, workers=1)] == ["skipped", "skipped"]
+    os.utime(out / "Da.png", (os.path.getmtime(inputs / "Da.cube") - 10,) * 2)
+    assert [row[2] for row in blobs.cli.render_batch(jobs, workers=1)] == ["skipped", "rendered"]
+    assert main([str(inputs / "D*"), "-o", str(out), "-j", "1", "--size", "0.2"]) == 0
+    assert main([str(inputs / "D*"), "-o", str(out), "-j", "1", "--size", "0.2", "--summary",
+                 str(tmp_path / "same.csv")]) == 0
+    with open(tmp_path / "same.csv") as summary:
+        assert [row["status"] for row in csv.DictReader(summary)] == ["skipped"]
+    assert main([str(inputs / "D*"), "-o", str(out), "-j", "1", "--size", "0.2", "--iso", "0.05", "--summary",
+                 str(tmp_path / "iso.csv")]) == 0
+    with open(tmp_path / "iso.csv") as summary:
+        assert [row["status"] for row in csv.DictReader(summary)] == ["rendered"]
+
+    # A worker that dies fails its job instead of aborting the batch
+    class Crash():
+        def __reduce__(self):
+            return os._exit, (1,)
+
+    rows = blobs.cli.render_batch([(str(inputs / "Da.cube"), str(tmp_path / "crash.png"), {"size": Crash()})],
+                                  workers=2, force=True)
+    assert [row[2] for row in rows] == ["failed"] and "BrokenProcessPool" in rows[0][4]
+
+    assert main([str(inputs / "Psi*"), "-o", str(out), "-f", "obj", "--cube-type", "orbital",
+                 "--summary", str(tmp_path / "obj.csv")]) == 0
+    with open(out / "Psi_a_8_8-A.obj") as obj:
+        lines = obj.read().splitlines()
+    assert [line for line in lines if line.startswith("o ")] == ["o iso_0.03", "o iso_-0.03"]
+    vertices = np.array([line.split()[1:] for line in lines if line.startswith("v ")], dtype=float)
+    faces = np.array([line.split()[1:] for line in lines if line.startswith("f ")], dtype=int)
+    assert faces.min() == 1 and faces.max() == len(vertices)
+    origin = np.array(cube_details["org"])
+    assert (vertices.min(axis=0) > origin).all()
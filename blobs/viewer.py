@@ -0,0 +1,176 @@
+"""
+viewer.py
+Persistent figure widgets that are updated in place
+"""
+
+import numpy as np
+import plotly.graph_objects as go
+
+from .bonds import bond_lines, bond_trace
+from .colors import get_colors
+from .cube import mesh_trace, surface_levels, surface_meshes
+from .encoding import compact_mesh
+from .frequencies import build_bond_list
+
+
+def _differs(old, new):
+    """True if a setting changed, comparing arrays and lists by value."""
+    if isinstance(old, (list, tuple, np.ndarray)) or isinstance(new, (list, tuple, np.ndarray)):
+        return np.shape(old) != np.shape(new) or not np.array_equal(old, new)
+    return old is not new and old != new
+
+
+class CubeViewer():
+    """
+    One figure showing the surfaces of the cube files of a Cube.
+
+    The atoms and bonds are drawn once, when the viewer is created.
+    update compares the new settings with the current ones and only
+    touches the surface traces: a new colorscale restyles their colors,
+    while a new cube file, isovalue or extraction setting replaces their
+    mesh data. Surfaces stay in voxel index units of the full grid, also
+    when cropped, so the atoms never move.
+
+    Parameters
+    ----------
+    cube: Cube
+    size: int, optional
+    plot_geometry: bool, optional
+    plot_bonds: bool, optional
+        See Cube.plot.
+    widget: bool, optional
+        Build a go.FigureWidget, which needs ipywidgets, rather than a
+        go.Figure. Default is True.
+
+    Attributes
+    ----------
+    figure: go.FigureWidget
+    settings: dict
+        Current cube_file, iso, cube_type and colorscale, and the cache,
+        mesh_cache, dtype, simplify, smoothing, level and crop options of
+        Cube.plot.
+    extractions: int
+        Number of times the surfaces were recomputed.
+
+    """
+    _MESH_SETTINGS = {"cube_file", "iso", "cube_type", "cache", "mesh_cache", "dtype", "simplify", "smoothing",
+                      "level", "crop"}
+
+    def __init__(self, cube, size=1, plot_geometry=True, plot_bonds=True, widget=True):
+        self.cube = cube
+        self.figure = cube._figure([], cube.info, size, plot_geometry, plot_bonds, widget=widget)
+        self.static = len(self.figure.data)
+        self.settings = {"cube_file": None, "iso": 0.03, "cube_type": "density", "colorscale": "Blues",
+                         "cache": None, "mesh_cache": None, "dtype": None, "simplify": None, "smoothing": 0,
+                         "level": 0, "crop": False}
+        self.extractions = 0
+
+    def update(self, **settings):
+        """
+        Change some settings and update the traces they affect.
+
+        Returns
+        --------
+        viewer: CubeViewer
+
+        """
+        unknown = set(settings) - set(self.settings)
+        if unknown:
+            raise ValueError(f"Unknown settings {sorted(unknown)}")
+        changed = {name for name, value in settings.items() if _differs(self.settings[name], value)}
+        self.settings.update(settings)
+        current = self.settings
+        if current["cube_file"] is None:
+            raise ValueError("Give a cube_file to view")
+
+        levels, colors = surface_levels(current["iso"], current["cube_type"], current["colorscale"])
+        surfaces = self.figure.data[self.static:]
+
+        if changed & self._MESH_SETTINGS or not surfaces:
+            crop = current["crop"]
+            meshes, self.cube.meta = surface_meshes(
+                current["cube_file"], levels, cache=current["cache"], dtype=current["dtype"], level=current["level"],
+                method="maxabs" if current["cube_type"] == "orbital" else "mean",
+                crop=np.min(np.abs(current["iso"])) if crop is True else (crop or None),
+                simplify=current["simplify"], smoothing=current["smoothing"], mesh_cache=current["mesh_cache"],
+                uncrop=True)
+            self.extractions += 1
+
+            if len(surfaces) > len(meshes):
+                self.figure.data = self.figure.data[:self.static + len(meshes)]
+            with self.figure.batch_update():
+                for trace, (vertices, faces), color in zip(self.figure.data[self.static:], meshes, colors):
+                    vertices, faces = compact_mesh(vertices, faces)
+                    trace.update(x=vertices[:, 0], y=vertices[:, 1], z=vertices[:, 2],
+                                 i=faces[:, 0], j=faces[:, 1], k=faces[:, 2], color=color)
+            for (vertices, faces), color in list(zip(meshes, colors))[len(surfaces):]:
+                self.figure.add_trace(mesh_trace(vertices, faces, color))
+
+        elif "colorscale" in changed:
+            with self.figure.batch_update():
+                for trace, color in zip(surfaces, colors):
+                    trace.color = color
+
+        return self
+
+
+class FreqViewer():
+    """
+    One figure showing the normal modes of a Freq.
+
+    The atom and bond traces are created once. Showing another mode or
+    amplitude only moves their coordinates and changes the title.
+
+    Parameters
+    ----------
+    freq: Freq
+    size: int, optional
+        See Freq.plot.
+    amplitude: float, optional
+        Scale of the displacement drawn along the normal mode. Default is 0.5.
+    widget: bool, optional
+        Build a go.FigureWidget, which needs ipywidgets, rather than a
+        go.Figure. Default is True.
+
+    """
+    def __init__(self, freq, size=1, amplitude=0.5, widget=True):
+        self.freq = freq
+        self.amplitude = amplitude
+        self.norm = freq.get_norm()
+        self.bonds = build_bond_list(freq.geo)
+        self.vib = None
+
+        atoms_colors = get_colors()
+        data = [go.Scatter3d(x=freq.geo[:, 0], y=freq.geo[:, 1], z=freq.geo[:, 2],
+                             mode='markers',
+                             marker={"showscale": False,
+                                     "color": freq.info["color"],
+                                     "size": freq.info["size"] * size / 1.0,
+                                     "opacity": 1.0,
+                                     "line": {"width": 2, "color": "black"}}),
+                bond_trace(freq.geo, self.bonds, [atoms_colors[sym][0] for sym in freq.sym], width=7 * size)]
+
+        self.figure = go.FigureWidget(data=data) if widget else go.Figure(data=data)
+        freq._layout(self.figure, size)
+
+    def update(self, vib=0, amplitude=None):
+        """
+        Show the displacement along normal mode vib.
+
+        Returns
+        --------
+        viewer: FreqViewer
+
+        """
+        if amplitude is not None:
+            self.amplitude = amplitude
+        self.vib = vib
+        positions = self.freq.geo + self.amplitude * self.norm[vib]
+
+        with self.figure.batch_update():
+            self.figure.data[0].update(x=positions[:, 0], y=positions[:, 1], z=positions[:, 2])
+            points, _ = bond_lines(positions, self.bonds)
+            self.figure.data[1].update(x=points[:, 0], y=points[:, 1], z=points[:, 2])
+            self.figure.layout.title = F"Frequency: {self.freq.frequencies[vib].real:.2f} 1/cm"
+
+        return self
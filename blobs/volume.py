@@ -0,0 +1,286 @@
+"""
+volume.py
+Direct volume rendering of cube grids by ray marching
+"""
+
+import time
+
+import numpy as np
+import plotly.express as px
+import plotly.graph_objects as go
+
+from .pyramid import downsample, pick_level, to_full_grid
+from .render import _rgb
+
+# Rays whose transmittance falls below this stop marching
+_OPAQUE = 0.01
+
+# Ray samples per second of ray_march on a typical machine, measure a machine with march_rate
+_MARCH_RATE = 2**21
+
+# Rough number of voxels per second plotly.js turns into the slices of a Volume trace
+_BROWSER_RATE = 2**17
+
+
+def transfer_function(colorscale="Blues", negative=None, resolution=256):
+    """
+    Lookup tables from normalized magnitude to color of a volume.
+
+    Parameters
+    ----------
+    colorscale: str or list, optional
+        Plotly colorscale of the positive values. Default is "Blues".
+    negative: str or list, optional
+        Colorscale of the negative values, which are transparent when None.
+    resolution: int, optional
+        Number of entries of the tables. Default is 256.
+
+    Returns
+    --------
+    (positive: np.array (resolution, 3), negative: np.array (resolution, 3) or None)
+        Red, green and blue between 0 and 1, from the faintest to the strongest values.
+
+    """
+    def table(scale):
+        # Faint values take the light end of the scale, like the outer isosurfaces of Cube.plot
+        colors = px.colors.sample_colorscale(scale, np.linspace(0.4, 1.0, resolution).tolist())
+        return np.array([_rgb(color) for color in colors])
+
+    return table(colorscale), None if negative is None else table(negative)
+
+
+def _trilinear(data, points):
+    """Values of a grid at points in voxel index units, zero outside of it."""
+    shape = np.array(data.shape)
+    base = np.floor(points).astype(np.int64)
+    inside = ((base >= 0) & (base < shape - 1)).all(axis=1)
+    base = base[inside]
+    fx, fy, fz = (points[inside] - base).T
+
+    flat = data.ravel()
+    sx, sy = shape[1] * shape[2], shape[2]
+    index = base[:, 0] * sx + base[:, 1] * sy + base[:, 2]
+
+    def lerp_z(offset):
+        low = flat[index + offset]
+        return low + fz * (flat[index + offset + 1] - low)
+
+    # Interpolate along z on the four edges of the cell, then along y, then along x
+    low_x = lerp_z(0) + fy * (lerp_z(sy) - lerp_z(0))
+    high_x = lerp_z(sx) + fy * (lerp_z(sx + sy) - lerp_z(sx))
+    values = np.zeros(len(points))
+    values[inside] = low_x + fx * (high_x - low_x)
+    return values
+
+
+def _strength(values, threshold, peak):
+    """
+    Magnitudes mapped to [0, 1] between threshold and peak, on a log scale
+    when threshold is positive since densities and orbitals span decades.
+    """
+    magnitude = np.abs(values)
+    if threshold > 0:
+        with np.errstate(divide="ignore"):
+            return np.clip(np.log(magnitude / threshold) / np.log(max(peak / threshold, 1 + 1e-9)), 0, 1)
+    return np.clip(magnitude / max(peak, 1e-30), 0, 1)
+
+
+def ray_span(origins, direction, shape):
+    """
+    Depths at which rays enter and leave the box of a grid.
+
+    Parameters
+    ----------
+    origins: np.array (nrays, 3)
+    direction: np.array (3,)
+        See ray_march.
+    shape: tuple<int>
+
+    Returns
+    --------
+    (enter: np.array (nrays,), leave: np.array (nrays,))
+        Rays missing the box have leave < enter.
+
+    """
+    enter, leave = np.full(len(origins), -np.inf), np.full(len(origins), np.inf)
+    for axis in range(3):
+        low, high = 0.0, shape[axis] - 1.0
+        if direction[axis] == 0:
+            outside = (origins[:, axis] < low) | (origins[:, axis] > high)
+            leave[outside] = -np.inf
+            continue
+        t0 = (low - origins[:, axis]) / direction[axis]
+        t1 = (high - origins[:, axis]) / direction[axis]
+        enter = np.maximum(enter, np.minimum(t0, t1))
+        leave = np.minimum(leave, np.maximum(t0, t1))
+    return enter, leave
+
+
+def ray_march(data, origins, direction, near, far, samples, tables, threshold, peak, opacity=0.1,
+              stop=None):
+    """
+    Composite a grid along parallel rays, front to back.
+
+    All rays advance together, one array operation per step, and only
+    while they are inside the box of the grid. Rays that became opaque,
+    or passed the depth at which an opaque object hides the volume, are
+    dropped from the following steps.
+
+    Parameters
+    ----------
+    data: np.array (nx, ny, nz)
+    origins: np.array (nrays, 3)
+        Points of the rays at depth zero, in voxel index units of data.
+    direction: np.array (3,)
+        Move of the rays per unit of depth, in voxel index units of data.
+    near: float
+    far: float
+        Depth range of the march.
+    samples: int
+        Number of samples per ray.
+    tables: (np.array, np.array or None)
+        Positive and negative color tables, see transfer_function.
+    threshold: float
+        Magnitude below which the volume is transparent.
+    peak: float
+        Magnitude of the strongest color. Colors and opacity grow with the
+        log of the magnitude from threshold to peak, linearly from zero
+        when threshold is zero.
+    opacity: float, optional
+        Extinction per voxel of the strongest values. Default is 0.1.
+    stop: np.array (nrays,), optional
+        Depth of the opaque object behind each ray.
+
+    Returns
+    --------
+    (color: np.array (nrays, 3), transmittance: np.array (nrays,))
+        Premultiplied color of the volume and the fraction of light it lets through.
+
+    """
+    positive, negative = tables
+    nrays = len(origins)
+    color = np.zeros((nrays, 3))
+    transmittance = np.ones(nrays)
+    step = (far - near) / samples
+
+    enter, leave = ray_span(origins, direction, data.shape)
+    if stop is not None:
+        leave = np.minimum(leave, stop)
+    active = np.flatnonzero(leave >= enter)
+    for k in range(samples):
+        depth = near + (k + 0.5) * step
+        active = active[(transmittance[active] > _OPAQUE) & (leave[active] >= depth)]
+        if len(active) == 0:
+            break
+        rays = active[enter[active] <= depth]
+        values = _trilinear(data, origins[rays] + depth * direction)
+        if negative is None:
+            values = np.maximum(values, 0)
+        strength = _strength(values, threshold, peak)
+        hit = strength > 0
+        if not hit.any():
+            continue
+        rays, values, strength = rays[hit], values[hit], strength[hit]
+
+        entry = np.minimum((strength * (len(positive) - 1)).astype(np.int64), len(positive) - 1)
+        rgb = positive[entry] if negative is None else np.where((values < 0)[:, None], negative[entry],
+                                                                positive[entry])
+        alpha = 1 - np.exp(-opacity * strength * step)
+        color[rays] += (transmittance[rays] * alpha)[:, None] * rgb
+        transmittance[rays] *= 1 - alpha
+    return color, transmittance
+
+
+def march_rate():
+    """
+    Measure the ray samples per second of ray_march on this machine, on a small grid.
+
+    The result can be passed as the rate of volume_budget, rasterize or
+    RasterBackend, which otherwise assume a typical machine.
+
+    Returns
+    --------
+    rate: float
+
+    """
+    grid = np.linspace(0, 1, 32**3).reshape(32, 32, 32)
+    tables = transfer_function()
+    origins = np.stack(np.meshgrid(np.linspace(1, 30, 64), np.linspace(1, 30, 64), [0.0]), axis=-1).reshape(-1, 3)
+    ray_march(grid, origins[:16], np.array([0.0, 0.0, 1.0]), 0, 31, 2, tables, 0.0, 1.0)
+    start = time.perf_counter()
+    ray_march(grid, origins, np.array([0.0, 0.0, 1.0]), 0, 31, 32, tables, 0.0, 1.0, opacity=1e-9)
+    return len(origins) * 32 / max(time.perf_counter() - start, 1e-6)
+
+
+def volume_budget(shape, rays, latency=1.0, levels=3, rate=None):
+    """
+    Pyramid level and samples per ray of a volume render that fits a latency target.
+
+    One sample per voxel crossed is enough, so the finest level whose
+    grid can be sampled that densely within latency is chosen. When even
+    the coarsest level is too slow the samples are cut to fit.
+
+    Parameters
+    ----------
+    shape: tuple<int>
+        Shape of the grid.
+    rays: int
+        Number of rays crossing the grid.
+    latency: float, optional
+        Time budget of the march in seconds. Default is 1.
+    levels: int, optional
+        Deepest level allowed. Default is 3.
+    rate: float, optional
+        Ray samples per second of the march, see march_rate. Default is
+        that of a typical machine.
+
+    Returns
+    --------
+    (level: int, samples: int)
+
+    """
+    rate = _MARCH_RATE if rate is None else rate
+    affordable = latency * rate / max(rays, 1)
+    for level in range(levels + 1):
+        samples = int(np.ceil(np.linalg.norm([-(-n // 2 ** level) for n in shape])))
+        if samples <= affordable:
+            return level, samples
+    return levels, max(int(affordable), 8)
+
+
+def volume_traces(data, level=0, colorscale="Blues", negative=None, threshold=0.0, latency=1.0):
+    """
+    Plotly Volume traces of a grid, downsampled to what the browser draws within a latency target.
+
+    Parameters
+    ----------
+    data: np.array (nx, ny, nz)
+    level: int, optional
+        Pyramid level of data, voxels are placed in units of the full grid. Default is 0.
+    colorscale: str or list, optional
+    negative: str or list, optional
+        Colorscales of the positive and negative values, see transfer_function.
+    threshold: float, optional
+        Magnitude below which the volume is transparent. Default is 0.
+    latency: float, optional
+        Time budget in seconds. Default is 1.
+
+    Returns
+    --------
+    traces: list<go.Volume>
+
+    """
+    extra = pick_level(data.shape, latency * _BROWSER_RATE, levels=6)
+    if extra:
+        data = downsample(data, 2 ** extra, "mean" if negative is None else "maxabs")
+    X, Y, Z = (to_full_grid(grid, level + extra).astype(np.float32).ravel() for grid in np.indices(data.shape))
+    peak = max(float(np.abs(data).max()), threshold)
+
+    # Values are sent as the strength of ray_march so both renders look alike
+    signs = [(1, colorscale)] + ([] if negative is None else [(-1, negative)])
+    traces = []
+    for sign, scale in signs:
+        value = _strength(np.maximum(sign * data, 0), threshold, peak).astype(np.float32).ravel()
+        traces.append(go.Volume(x=X, y=Y, z=Z, value=value, isomin=1e-3, isomax=1.0, opacity=0.1, surface_count=12,
+                                colorscale=scale, showscale=False, hoverinfo="skip"))
+    return traces
@@ -0,0 +1,113 @@
+"""
+Benchmarks for the cube file readers in blobs.
+
+Usage:
+    python devtools/scripts/benchmark_cube.py [cube files] [--repeat N]
+
+Without arguments the tutorial cubes shipped with blobs are used.
+"""
+
+import argparse
+import bz2
+import glob
+import gzip
+import lzma
+import os
+import tempfile
+import timeit
+
+import numpy as np
+import blobs
+from blobs.cube import _getline
+
+
+def cube_to_array_loop(fname):
+    """Reference reader parsing one value at a time (the original implementation)."""
+    cube_details = {}
+    with open(fname, 'r') as cube:
+        cube.readline()
+        cube.readline()
+        natm, cube_details['org'] = _getline(cube)
+        nx, cube_details['xvec'] = _getline(cube)
+        ny, cube_details['yvec'] = _getline(cube)
+        nz, cube_details['zvec'] = _getline(cube)
+        cube_details['atoms'] = [_getline(cube) for i in range(natm)]
+        data = np.zeros((nx * ny * nz))
+        idx = 0
+        for line in cube:
+            for val in line.strip().split():
+                data[idx] = float(val)
+                idx += 1
+    data = np.reshape(data, (nx, ny, nz))
+    return data, cube_details
+
+
+def array_to_cube_loop(fname, data):
+    """Reference writer formatting one value at a time."""
+    with open(fname, 'w') as out:
+        for i, val in enumerate(data.ravel()):
+            out.write(f"{val:12.5E} ")
+            if i % 6 == 5:
+                out.write("\n")
+
+
+def bench(label, func, repeat):
+    """Return the best wall time in seconds of func over repeat runs."""
+    best = min(timeit.repeat(func, number=1, repeat=repeat))
+    print(f"  {label:<24s} {best * 1e3:10.2f} ms")
+    return best
+
+
+def benchmark_file(fname, repeat, workers):
+    size = os.path.getsize(fname) / 2**20
+    print(f"{os.path.basename(fname)} ({size:.1f} MiB)")
+
+    reference, _ = cube_to_array_loop(fname)
+    data, meta = blobs.cube_to_array(fname)
+    assert np.array_equal(reference, data), "bulk parser does not match the reference loop"
+
+    t_loop = bench("per-value loop", lambda: cube_to_array_loop(fname), repeat)
+    t_bulk = bench("cube_to_array", lambda: blobs.cube_to_array(fname), repeat)
+    print(f"  speedup {t_loop / t_bulk:.1f}x")
+
+    if workers > 1:
+        parallel, _ = blobs.cube_to_array(fname, workers=workers)
+        assert parallel.tobytes() == data.tobytes(), "threaded parser does not match the serial parser"
+        t_par = bench(f"cube_to_array x{workers}", lambda: blobs.cube_to_array(fname, workers=workers), repeat)
+        print(f"  threaded speedup {t_bulk / t_par:.1f}x")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        written = os.path.join(tmp, "written.cube")
+        t_wloop = bench("per-value writer", lambda: array_to_cube_loop(written, data), repeat)
+        t_write = bench("array_to_cube", lambda: blobs.array_to_cube(written, data, meta), repeat)
+        print(f"  writer speedup {t_wloop / t_write:.1f}x")
+
+        for module in [gzip, bz2, lzma]:
+            compressed = os.path.join(tmp, os.path.basename(fname) + "." + module.__name__)
+            with open(fname, 'rb') as cube, module.open(compressed, 'wb') as out:
+                out.write(cube.read())
+            ratio = os.path.getsize(fname) / os.path.getsize(compressed)
+            t_comp = bench(f"{module.__name__} ({ratio:.1f}x smaller)", lambda: blobs.cube_to_array(compressed),
+                           repeat)
+            print(f"  {module.__name__} throughput {size / t_comp:.0f} MiB/s of text, "
+                  f"{t_comp / t_bulk:.1f}x the uncompressed time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark blobs cube readers")
+    parser.add_argument("files", nargs="*", help="cube files to read")
+    parser.add_argument("--repeat", type=int, default=5, help="number of timed repetitions")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="threads for the parallel reader")
+    args = parser.parse_args()
+
+    files = args.files
+    if not files:
+        tutorial = os.path.join(os.path.dirname(blobs.__file__), "tutorial")
+        files = sorted(glob.glob(os.path.join(tutorial, "*.cube")))
+
+    for fname in files:
+        benchmark_file(fname, args.repeat, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -44,6 +44,9 @@ setup(
     # Allows `setup.py test` to work correctly with pytest
     setup_requires=[] + pytest_runner,
 
+    # Batch rendering of cube files from the command line, see blobs/cli.py
+    entry_points={'console_scripts': ['blobs = blobs.cli:main']},
+
     # Additional entries you may want simply uncomment the lines you want and fill in the data
     # url='http://www.my_package.com',  # Website
     # install_requires=[],              # Required packages, pulls from pip if needed; do not use for Conda deployment